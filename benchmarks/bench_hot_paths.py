@@ -0,0 +1,250 @@
+#mcandrew
+
+"""Micro-benchmarks of the app's hot paths, without a Streamlit server.
+
+Every case runs the code a page runs, on synthetic games of several sizes
+(synthetic_game.sized, fixed seed):
+
+    validate_infection    checks and outcome of an infection submission (submissions.py, used by add_user_data_to_database)
+    validate_intervention checks and effectiveness draw of an intervention submission
+    state_build           building the validation index (EpidemicState)
+    graph_build           building the contact network (contact_network)
+    transmission_search   ancestry, descendants within 2 generations and subtree size of a user (search_user)
+    incidence_build       binning the log (show_cumulative_plots, first view)
+    incidence_query       hourly series and 24-hour totals (show_cumulative_plots, later views)
+    csv_write, csv_read   the interactions.csv export
+    snapshot_write/read   the Parquet snapshot
+    report_index_parse    parsing reports/report_submissions.csv (one row per ten events)
+
+For each case and size it reports the median time per call, the peak memory
+traced during one run, and the scaling exponent (slope of log time against log
+size). --save writes the results as the baseline, and --compare exits with an
+error if a case got slower or bigger than the baseline by more than the
+tolerance.
+
+    python benchmarks/bench_hot_paths.py [--sizes 1000 10000 100000] [--cases graph_build csv_read] [--save | --compare]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from io import BytesIO
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import event_log
+import incidence
+import submissions
+import report_store
+import usernames
+import transmission
+import contact_graph
+import synthetic_game
+from epidemic_state import EpidemicState
+from intervention_model import InterventionModel
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "hot_paths.json")
+
+SIZES     = [1000, 10000, 100000]
+REPEATS   = 5
+CALLS     = 200    #<--submissions or searches per timed run of the per-request cases
+TOLERANCE = 0.25   #<--allowed slowdown (and memory growth) against the baseline
+
+
+def _sample(values, n, seed=0):
+    values = np.asarray(values, dtype=object)
+    return list(np.random.default_rng(seed).choice(values, size=n)) if len(values) else []
+
+
+def _infected(events):
+    return pd.unique(events.loc[(events.infection_intervention == 1) & (events.success == 1), "Audience"].astype(str))
+
+
+#--Cases: setup(events) -> (function to time, calls it makes)--------------------------------------------------------------
+def validate_infection(events):
+    state    = EpidemicState.from_dataframe(events)
+    infected = _infected(events)
+    everyone = pd.unique(events.Audience.astype(str))
+    pairs    = list(zip(_sample(infected, CALLS), _sample(everyone, CALLS, seed=1)))
+    now      = events.timestamp.max().to_pydatetime() + timedelta(hours=1)
+    rng      = np.random.default_rng(0)
+    def run():
+        for actor, audience in pairs:
+            if submissions.check_infection(state, actor, audience, now) is None:
+                submissions.infection_row(state, actor, audience, now, rng=rng)
+    return run, CALLS
+
+
+def validate_intervention(events):
+    state = EpidemicState.from_dataframe(events)
+    model = InterventionModel(synthetic_game.DEFAULT_CATALOG, seed=0)
+    calls = list(zip(_sample(events.Actor.astype(str), CALLS), _sample(events.Audience.astype(str), CALLS, seed=1)
+                     , _sample(model.types, CALLS, seed=2)))
+    now   = events.timestamp.max().to_pydatetime() + timedelta(hours=1)
+    def run():
+        for actor, audience, intervention_type in calls:
+            if submissions.check_intervention(state, model, actor, audience, intervention_type) is None:
+                submissions.intervention_row(model, actor, audience, intervention_type, now)
+    return run, CALLS
+
+
+def state_build(events):
+    return (lambda: EpidemicState.from_dataframe(events)), 1
+
+
+def graph_build(events):
+    return (lambda: contact_graph.ContactGraph().sync(events)), 1
+
+
+def transmission_search(events):
+    index = transmission.TransmissionIndex().sync(events)
+    users = [usernames.lookup(user) for user in _sample(events.Actor.astype(str), CALLS)]
+    def run():
+        for user in users:
+            index.ancestry(user)
+            index.descendants_within(user, depth=2, limit=500)
+            index.subtree_size(user)
+            index.first_infection_by(user)
+    return run, len(users)
+
+
+def incidence_build(events):
+    return (lambda: incidence.IncidenceAggregator().sync(events).incidence("hour")), 1
+
+
+def incidence_query(events):
+    aggregator = incidence.IncidenceAggregator().sync(events)
+    def run():
+        aggregator.incidence("hour")
+        aggregator.rolling(24, "hour")
+    return run, 1
+
+
+def csv_write(events):
+    return (lambda: event_log.to_csv_bytes(events)), 1
+
+
+def csv_read(events):
+    body = event_log.to_csv_bytes(events)
+    return (lambda: event_log.apply_schema(pd.read_csv(BytesIO(body)))), 1
+
+
+def snapshot_write(events):
+    return (lambda: event_log.to_snapshot_bytes(events)), 1
+
+
+def snapshot_read(events):
+    body = event_log.to_snapshot_bytes(events)
+    return (lambda: pd.read_parquet(BytesIO(body))), 1
+
+
+def report_index_parse(events):
+    n     = max(10, len(events)//10)
+    rng   = np.random.default_rng(0)
+    index = pd.DataFrame({"username": _sample(events.Actor.astype(str), n), "filename": [f"report_{i}.pdf" for i in range(n)]
+                          , "filesize_kb": rng.uniform(50, 5000, n).round(2)
+                          , "timestamp": (pd.Timestamp(synthetic_game.START) + pd.to_timedelta(rng.integers(0, 21*86400, n), unit="s")).strftime("%Y-%m-%d %H:%M:%S")
+                          , "sha256": [f"{i:064x}" for i in rng.integers(0, 2**62, n)], "pages": rng.integers(1, 30, n), "thumbnail": True})
+    body  = index.to_csv(index=False).encode("utf-8")
+    return (lambda: report_store.parse_index(body)), 1
+
+
+CASES = {case.__name__: case for case in [validate_infection, validate_intervention, state_build, graph_build
+                                          , transmission_search, incidence_build, incidence_query, csv_write, csv_read, snapshot_write
+                                          , snapshot_read, report_index_parse]}
+
+
+#--Measurement-------------------------------------------------------------------------------------------------------------
+def measure(function, calls, repeats=REPEATS):
+    """Median seconds per call over repeats, and peak traced memory (MB) of one extra run"""
+    function()   #<--warm-up: imports, caches, first allocation of pools
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return float(np.median(times))/calls, peak/2**20
+
+
+def run(sizes=SIZES, cases=None, repeats=REPEATS):
+    rows = []
+    for size in sizes:
+        events = synthetic_game.sized(size, seed=0)
+        for name in cases or CASES:
+            function, calls = CASES[name](events)
+            seconds, peak   = measure(function, calls, repeats)
+            rows.append({"case": name, "events": size, "seconds": seconds, "peak_mb": round(peak, 2)})
+            print(f"{name:22s} {size:>9d} events  {seconds*1e3:10.3f} ms/call  {peak:9.2f} MB peak", flush=True)
+    return pd.DataFrame(rows)
+
+
+def scaling(results):
+    """Slope of log(seconds) against log(events) per case: ~1 linear, ~0 constant per call"""
+    exponents = {}
+    for case, rows in results.groupby("case", sort=False):
+        if rows.events.nunique() > 1:
+            exponents[case] = round(float(np.polyfit(np.log(rows.events), np.log(rows.seconds), 1)[0]), 2)
+    return pd.Series(exponents, name="exponent")
+
+
+#--Baselines----------------------------------------------------------------------------------------------------------------
+def save_baseline(results, path=BASELINE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"machine": platform.platform(), "python": platform.python_version()
+                   , "results": results.to_dict(orient="records")}, f, indent=1)
+
+
+def compare(results, path=BASELINE_PATH, tolerance=TOLERANCE):
+    """Results next to the baseline with a regression flag per case and size"""
+    with open(path) as f:
+        baseline = pd.DataFrame(json.load(f)["results"])
+    joined = results.merge(baseline, on=["case", "events"], how="left", suffixes=("", "_baseline"))
+    joined["time_ratio"]   = (joined.seconds/joined.seconds_baseline).round(2)
+    joined["memory_ratio"] = (joined.peak_mb/joined.peak_mb_baseline).round(2)
+    joined["regression"]   = (joined.time_ratio > 1 + tolerance) | (joined.memory_ratio > 1 + tolerance)
+    return joined
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--save", action="store_true", help=f"write the results as the baseline ({BASELINE_PATH})")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--csv", default=None, help="also write the results to this CSV file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.cases, args.repeats)
+    table   = results.assign(ms_per_call=(results.seconds*1e3).round(3)).pivot(index="case", columns="events", values="ms_per_call")
+    print("\nms per call")
+    print(table.join(scaling(results)).to_string())
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"\nbaseline saved to {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"No baseline at {args.baseline}: run with --save first")
+        joined = compare(results, args.baseline, args.tolerance)
+        print("\n" + joined[["case", "events", "time_ratio", "memory_ratio", "regression"]].to_string(index=False))
+        if joined.regression.any():
+            raise SystemExit(f"{int(joined.regression.sum())} regression(s) over {args.tolerance:.0%}")
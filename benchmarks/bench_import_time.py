@@ -0,0 +1,82 @@
+#mcandrew
+
+"""Import-time budget of the app's entry point and pages.
+
+Each module is imported in a fresh interpreter after `import streamlit`, which
+every page pays for anyway. The time measured is what the module adds on top of
+that (`python -X importtime`, median over repeats). The check fails if a module
+goes over its budget, or if main.py or the Home page loads a heavy dependency
+that only the other pages need. That would mean the first paint after a restart
+waits for it again.
+
+    python benchmarks/bench_import_time.py [--repeats 5] [--modules main pages.login]
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+BUDGET_MS = { "main"               : 50     #<--measured ~2 ms: routing only, pages imported on selection
+            , "pages.login"        : 50     #<--consent page; pandas is imported at login
+            , "pages.user_input"   : 1500   #<--measured ~550 ms, almost all of it pandas
+            , "pages.report_upload": 1500
+            , "pages.top_spreaders": 1500
+            , "pages.visual"       : 1500}
+
+#--must not be loaded by importing these modules (plotly is not listed: streamlit itself imports it)
+HEAVY     = ["pandas", "numpy", "scipy", "networkx", "pyvis", "boto3", "botocore", "googleapiclient", "pymupdf", "fitz"
+             , "streamlit_player", "streamlit_autorefresh"]
+LIGHTWEIGHT = ["main", "pages.login"]
+
+REPEATS = 5
+
+
+def import_time(module, repeats=REPEATS):
+    """Median ms the module adds to `import streamlit`, and the heavy modules it loaded"""
+    code  = ("import sys, streamlit; before = set(sys.modules); import " + module
+             + "; print(' '.join(sorted(name for name in set(sys.modules) - before if name.split('.')[0] in "
+             + repr(HEAVY) + ")))")
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True
+                                , env={**os.environ, "PYTHONPATH": ROOT})
+        if result.returncode != 0:
+            raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+        line = re.search(r"import time:\s+\d+ \|\s+(\d+) \| " + re.escape(module) + "$", result.stderr, re.M)
+        times.append(int(line.group(1))/1000.)
+        loaded = sorted({name.split(".")[0] for name in result.stdout.split()})
+    return float(np.median(times)), loaded
+
+
+def check(modules=None, repeats=REPEATS):
+    """One row per module: time, budget and the problems found (empty if within budget)"""
+    rows = []
+    for module in modules or BUDGET_MS:
+        ms, loaded = import_time(module, repeats)
+        problems   = []
+        if ms > BUDGET_MS.get(module, float("inf")):
+            problems.append(f"over budget by {ms - BUDGET_MS[module]:.0f} ms")
+        if module in LIGHTWEIGHT and loaded:
+            problems.append("loads " + ", ".join(loaded))
+        rows.append({"module": module, "ms": ms, "budget_ms": BUDGET_MS.get(module), "heavy": loaded, "problems": problems})
+        print(f"{module:22s} {ms:9.1f} ms  (budget {BUDGET_MS.get(module, float('nan')):6.0f})  "
+              + ("; ".join(problems) if problems else "ok"), flush=True)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=None)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    rows   = check(args.modules, args.repeats)
+    failed = [row["module"] for row in rows if row["problems"]]
+    if failed:
+        raise SystemExit(f"Import budget exceeded: {', '.join(failed)}")
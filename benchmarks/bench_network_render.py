@@ -0,0 +1,108 @@
+#mcandrew
+
+"""Benchmark of the contact network page as the game grows.
+
+For each game size this reports the server time to build and lay out the
+graph, the time to place the nodes of 1% more events, and the size of the
+HTML sent to the browser at full and at low detail, with the number of nodes
+and edges drawn at low detail.
+
+Client side, the cost that matters is vis.js stabilization: with physics on,
+the browser runs up to stabilization.iterations physics steps over every
+free body before stabilizationIterationsDone fires and the graph settles.
+No headless browser is available to the benchmark, so it reports a proxy read
+from the generated HTML instead of a measured time: the stabilization
+iterations vis.js will run (0 with physics off), the bodies it simulates
+(nodes not pinned with physics: false, plus one support node per edge with
+dynamic smooth edges), and their product times log2(bodies), the Barnes-Hut
+work, in millions. --legacy adds the same columns for the previous rendering.
+
+    python benchmarks/bench_network_render.py [--sizes 1000 4000 16000] [--legacy]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import contact_graph
+import synthetic_game
+import usernames
+
+def legacy_html(G):
+    """What the page sent before: pyvis add_node/add_edge with physics left on"""
+    from pyvis.network import Network
+    net = Network(height='740px', width='100%', bgcolor='white', font_color='black', directed=True)
+    for node, data in G.nodes(data=True):
+        net.add_node(node, label=usernames.get_dictionary().name(node), color=contact_graph.NODE_COLORS[data["infected"]])
+    for source, target in G.edges:
+        net.add_edge(source, target, width=2, color="black")
+    return net.generate_html()
+
+
+def _dataset(html, name):
+    """The JSON array passed to `name = new vis.DataSet(...)` in a pyvis page"""
+    start = html.index(f"{name} = new vis.DataSet(") + len(f"{name} = new vis.DataSet(")
+    return json.JSONDecoder().raw_decode(html, start)[0]
+
+
+def client_physics(html):
+    """(stabilization iterations, simulated bodies, Barnes-Hut work in millions) vis.js will spend on a page"""
+    start   = html.index("options = ") + len("options = ")
+    options = json.JSONDecoder().raw_decode(html, start)[0]
+    physics = options.get("physics", {})
+    if not physics.get("enabled", True) or not physics.get("stabilization", {}).get("enabled", True):
+        return 0, 0, 0.
+    iterations = physics.get("stabilization", {}).get("iterations", 1000)   #<--vis.js default
+    bodies     = sum(1 for node in _dataset(html, "nodes") if node.get("physics", True))
+    smooth     = options.get("edges", {}).get("smooth", {})
+    if smooth.get("enabled", True) and smooth.get("type", "dynamic") == "dynamic":
+        bodies += len(_dataset(html, "edges"))   #<--dynamic smooth edges are simulated through a hidden support node
+    return iterations, bodies, round(iterations*bodies*math.log2(max(bodies, 2))/1e6, 1)
+
+
+def run(sizes, legacy=False):
+    rows = []
+    for size in sizes:
+        events = synthetic_game.sized(size, seed=0)
+        head   = events.iloc[:int(size*0.99)]
+
+        graph = contact_graph.ContactGraph()
+        t0 = time.perf_counter(); graph.sync(head);   t1 = time.perf_counter()
+        graph.update_layout();                        t2 = time.perf_counter()
+        graph.sync(events);                           t3 = time.perf_counter()
+        graph.update_layout();                        t4 = time.perf_counter()
+        full = graph.network_html();                  t5 = time.perf_counter()
+        lod  = graph.network_html(detail=False);      t6 = time.perf_counter()
+        colors = {node: contact_graph.NODE_COLORS[data["infected"]] for node, data in graph.G.nodes(data=True)}
+        lod_G, _, _ = contact_graph.collapse(graph.G, colors, graph.positions, graph.aggregates(), anchors=graph.sink_owners())
+
+        row = {"events": size, "nodes": graph.G.number_of_nodes(), "edges": graph.G.number_of_edges()
+               , "build_s": round(t1 - t0, 4), "layout_s": round(t2 - t1, 4)
+               , "incremental_sync_s": round(t3 - t2, 4), "incremental_layout_s": round(t4 - t3, 4)
+               , "render_full_s": round(t5 - t4, 4), "render_lod_s": round(t6 - t5, 4)
+               , "payload_full_kb": round(len(full)/1024, 1), "payload_lod_kb": round(len(lod)/1024, 1)
+               , "lod_nodes": lod_G.number_of_nodes(), "lod_edges": lod_G.number_of_edges()}
+        for name, html in (("full", full), ("lod", lod)):
+            row[f"stabilization_iterations_{name}"], row[f"physics_bodies_{name}"], row[f"physics_mwork_{name}"] = client_physics(html)
+        if legacy:
+            t7 = time.perf_counter(); old = legacy_html(graph.G); t8 = time.perf_counter()
+            row.update(legacy_render_s=round(t8 - t7, 4), legacy_payload_kb=round(len(old)/1024, 1))
+            row["stabilization_iterations_legacy"], row["physics_bodies_legacy"], row["physics_mwork_legacy"] = client_physics(old)
+        rows.append(row)
+        print(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 1000, 4000, 16000])
+    parser.add_argument("--legacy", action="store_true", help="also time the previous pyvis add_node/add_edge rendering")
+    args = parser.parse_args()
+    print(run(args.sizes, legacy=args.legacy).to_string(index=False))
@@ -0,0 +1,309 @@
+#mcandrew
+
+"""Contact network built incrementally from the interaction log.
+
+Node colours and edges are derived with vectorized operations over the new
+events only; a cursor records how many events have been applied, so a page
+view costs O(new events) instead of rebuilding the network row by row.
+
+Node positions are computed here, once, and only new nodes are placed when
+events arrive. The browser receives fixed coordinates with physics turned
+off, and large graphs can be shown at a lower level of detail. There, every
+user who never contacted anyone is drawn with a single edge from one of their
+contacts (its owner), large fan-outs of such users are collapsed into one
+aggregate under their owner, and small components into one aggregate per size.
+"""
+
+import math
+import heapq
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+import event_log
+import telemetry
+import usernames
+
+NOT_INFECTED, INFECTED, CONTACTED = 0, 1, 2       #<--values of the "infected" node attribute
+NODE_COLORS     = {CONTACTED: "gray", INFECTED: "red", NOT_INFECTED: "blue"}
+AGGREGATE_COLOR = "#f0a30a"
+
+NODE_SPACING    = 1.      #<--layout units between neighbouring nodes
+PIXELS_PER_UNIT = 60.
+SPRING_LIMIT    = 300     #<--components larger than this get a radial tree layout instead of a spring layout
+PACKING_WIDTH   = 60.     #<--width (layout units) of a row when packing components side by side
+
+FANOUT_THRESHOLD   = 5   #<--level of detail: collapse a node's sink contacts when it owns more than this many
+MIN_COMPONENT_SIZE = 3   #<--level of detail: collapse components smaller than this
+
+
+def event_status(events):
+    """Status each event gives a node: 1 infected, 2 contacted but not infected, 0 intervention"""
+    infection = events.infection_intervention.values == 1
+    success   = events.success.values == 1
+    return np.where(infection & success, INFECTED, np.where(infection, CONTACTED, NOT_INFECTED))
+
+
+def radial_layout(component, seed=0):
+    """O(n) radial tree layout of a connected undirected graph: each node gets a wedge sized by its leaves"""
+    root   = max(component.degree, key=lambda item: item[1])[0]
+    tree   = nx.bfs_tree(component, root)
+    order  = list(nx.topological_sort(tree))
+
+    leaves = {}
+    for node in reversed(order):
+        leaves[node] = sum(leaves[child] for child in tree.successors(node)) or 1
+
+    positions = {root: (0., 0.)}
+    wedges    = {root: (0., 2*math.pi)}
+    depth     = {root: 0}
+    for node in order:
+        start, width = wedges[node]
+        for child in tree.successors(node):
+            share         = width*leaves[child]/leaves[node]
+            wedges[child] = (start, share)
+            depth[child]  = depth[node] + 1
+            angle         = start + share/2
+            radius        = depth[child]*NODE_SPACING*2
+            positions[child] = (radius*math.cos(angle), radius*math.sin(angle))
+            start        += share
+    return positions
+
+
+def component_layout(component, seed=0):
+    """Layout of one connected component centred on the origin (layout units)"""
+    if len(component) == 1:
+        return {next(iter(component.nodes)): (0., 0.)}
+    if len(component) > SPRING_LIMIT:
+        return radial_layout(component, seed)
+    positions = nx.spring_layout(component, seed=seed, k=NODE_SPACING, iterations=50, scale=None)
+    centre    = np.mean(list(positions.values()), axis=0)
+    return {node: tuple(xy - centre) for node, xy in positions.items()}
+
+
+class ContactGraph(event_log.IncrementalIndex):
+    """nx.DiGraph of who contacted whom (nodes are user IDs), kept up to date with the log (event_log.IncrementalIndex)"""
+
+    NAME = "contact_graph"
+
+    def _reset(self):
+        self.G       = nx.DiGraph()
+        self._html   = {}     #<--(cursor, options) -> rendered network
+        self._groups = {}     #<--(cursor, options) -> aggregates
+        if not hasattr(self, "positions"):
+            #--positions outlive a rebuild (user IDs are stable), so a node that is in the new log again keeps its place
+            self.positions = {}     #<--node -> (x, y) in layout units, computed once per node
+            self._shelf    = {"x": 0., "y": 0., "row_height": 0.}   #<--where the next new component is placed
+
+    def _apply(self, events):
+        """Add new events: first appearance sets a node's status, every infection attempt on it overrides it"""
+        if events.empty:
+            return
+        status    = event_status(events)
+        names     = usernames.get_dictionary()
+        actors    = names.encode(events.Actor)
+        audiences = names.encode(events.Audience)
+
+        #--Actor then Audience of every event, in log order
+        appearances = pd.DataFrame({"node": np.column_stack([actors, audiences]).ravel()
+                                    , "status": np.repeat(status, 2)})
+        first       = appearances.drop_duplicates("node", keep="first")
+        nodes       = names.keys(first.node.values)
+        self.G.add_nodes_from((node, {"infected": s}) for node, s in zip(nodes, first.status.values.tolist()) if node not in self.G)
+
+        attempts = events.infection_intervention.values == 1
+        last     = pd.DataFrame({"node": audiences[attempts], "status": status[attempts]}).drop_duplicates("node", keep="last")
+        for node, s in zip(names.keys(last.node.values), last.status.values.tolist()):
+            self.G.nodes[node]["infected"] = s
+
+        self.G.add_edges_from(zip(names.keys(actors), names.keys(audiences)))
+        self._html   = {}
+        self._groups = {}
+
+    #--Layout-------------------------------------------------------------------------------------------------------------
+    def _place(self, positions):
+        """Shelf-pack a newly laid out component next to the ones already placed"""
+        xy     = np.array(list(positions.values()))
+        low    = xy.min(axis=0) - NODE_SPACING
+        size   = xy.max(axis=0) + NODE_SPACING - low
+        shelf  = self._shelf
+        if shelf["x"] > 0 and shelf["x"] + size[0] > PACKING_WIDTH:
+            shelf["x"], shelf["y"], shelf["row_height"] = 0., shelf["y"] + shelf["row_height"], 0.
+        offset = np.array([shelf["x"], shelf["y"]]) - low
+        shelf["x"]         += size[0]
+        shelf["row_height"] = max(shelf["row_height"], size[1])
+        for node, position in positions.items():
+            self.positions[node] = tuple(np.asarray(position) + offset)
+
+    @telemetry.timed("contact_graph.layout")
+    def update_layout(self, seed=0):
+        """Give positions to nodes that do not have one yet; existing nodes never move"""
+        with self.lock:
+            new = [node for node in self.G.nodes if node not in self.positions]
+            if not new:
+                return 0
+            undirected = self.G.to_undirected(as_view=True)
+            rng        = np.random.default_rng(seed + len(self.positions))
+
+            local = undirected.subgraph(set(new) | {neighbor for node in new for neighbor in undirected.neighbors(node)})
+            components = sorted(nx.connected_components(local), key=len, reverse=True)
+            for component in components:
+                placed = [node for node in component if node in self.positions]
+                if not placed:
+                    #--a brand new cluster: lay it out on its own and pack it beside the others
+                    self._place(component_layout(undirected.subgraph(component), seed))
+                    continue
+
+                #--new nodes hanging off placed ones: start next to their placed neighbours and relax only them
+                start = {node: self.positions[node] for node in placed}
+                for node in component:
+                    if node not in start:
+                        anchors     = [self.positions[n] for n in undirected.neighbors(node) if n in self.positions] or list(start.values())
+                        start[node] = tuple(np.mean(anchors, axis=0) + rng.normal(scale=NODE_SPACING, size=2))
+                relaxed = nx.spring_layout(local.subgraph(component), pos=start, fixed=placed, k=NODE_SPACING, iterations=20, seed=seed)
+                for node in component:
+                    if node not in self.positions:
+                        self.positions[node] = tuple(relaxed[node])
+            self._html = {}
+            return len(new)
+
+    #--Level of detail----------------------------------------------------------------------------------------------------
+    def sink_owners(self):
+        """{sink: owner} for every sink, a user who was contacted but never contacted anyone.
+
+        Owners are picked greedily: the user with the most unassigned sinks among their contacts owns all
+        of them, then the next, so the sinks gather into few large fan-outs rather than many small ones.
+        """
+        with self.lock:
+            key = (self.cursor, "owners")
+            if key in self._groups:
+                return self._groups[key]
+
+            G         = self.G
+            sinks     = {node for node, out_degree in G.out_degree() if out_degree == 0 and G.in_degree(node) > 0}
+            remaining = {node: [child for child in G.successors(node) if child in sinks] for node in G.nodes}
+            heap      = [(-len(children), node) for node, children in remaining.items() if children]
+            heapq.heapify(heap)
+            owners    = {}
+            while heap:
+                count, node = heapq.heappop(heap)
+                children    = [child for child in remaining[node] if child not in owners]
+                if len(children) < -count:   #<--some were taken since it was pushed: requeue with the true count
+                    remaining[node] = children
+                    if children:
+                        heapq.heappush(heap, (-len(children), node))
+                    continue
+                owners.update((child, node) for child in children)
+            self._groups[key] = owners
+            return owners
+
+    def aggregates(self, fanout_threshold=FANOUT_THRESHOLD, min_component_size=MIN_COMPONENT_SIZE):
+        """Groups that are collapsed at low detail: {aggregate id: (label, member nodes, owner node or None)}.
+
+        An owner's sinks (see sink_owners) are collapsed when there are more than fanout_threshold of them.
+        Components smaller than min_component_size are collapsed by size.
+        """
+        with self.lock:
+            key = (self.cursor, fanout_threshold, min_component_size)
+            if key in self._groups:
+                return self._groups[key]
+
+            owners = {}
+            for sink, owner in self.sink_owners().items():
+                owners.setdefault(owner, []).append(sink)
+
+            names  = usernames.get_dictionary()
+            groups = {}
+            for owner, sinks in owners.items():
+                if len(sinks) > fanout_threshold:
+                    groups[f"fanout:{owner}"] = (f"+{len(sinks)} contacts of {names.name(owner)}", sinks, owner)
+
+            small = {}
+            for component in nx.weakly_connected_components(self.G):
+                if len(component) < min_component_size:
+                    small.setdefault(len(component), []).extend(component)
+            for size, members in small.items():
+                groups[f"small:{size}"] = (f"{len(members)//size} groups of {size}", members, None)
+            self._groups[key] = groups
+            return groups
+
+    def network_html(self, height='740px', detail=True, expanded=(), fanout_threshold=FANOUT_THRESHOLD, min_component_size=MIN_COMPONENT_SIZE):
+        """pyvis HTML with precomputed positions (rendered once per graph version and options).
+
+        With detail=False every aggregate that is not in expanded is drawn as a single node.
+        """
+        with self.lock:
+            key = (self.cursor, height, detail, tuple(sorted(expanded)), fanout_threshold, min_component_size)
+            if key in self._html:
+                telemetry.count("cache.network_html.hit")
+                return self._html[key]
+            telemetry.count("cache.network_html.miss")
+
+            self.update_layout()
+            colors = {node: NODE_COLORS[data["infected"]] for node, data in self.G.nodes(data=True)}
+            with telemetry.span("contact_graph.render_html", detail=detail, nodes=self.G.number_of_nodes()):
+                if detail:
+                    html = render_html(self.G, colors, self.positions, height=height)
+                else:
+                    groups = {group: value for group, value in self.aggregates(fanout_threshold, min_component_size).items() if group not in expanded}
+                    G, colors, positions = collapse(self.G, colors, self.positions, groups, anchors=self.sink_owners())
+                    html = render_html(G, colors, positions, height=height)
+            self._html[key] = html
+            return html
+
+
+def collapse(G, colors, positions, groups, anchors=None):
+    """Replace each group of members by one aggregate node placed at their centroid.
+
+    anchors maps nodes to the one source whose edge into them is kept ({sink: owner}); their other incoming
+    edges are left out. Defaults to the members of the groups that have an owner.
+    """
+    if anchors is None:
+        anchors = {member: source for _, (_, members, source) in groups.items() if source is not None for member in members}
+    labels    = {group: label for group, (label, _, _) in groups.items()}
+    owner     = {member: group for group, (_, members, _) in groups.items() for member in members}
+    collapsed = nx.DiGraph()
+    collapsed.add_nodes_from(node for node in G.nodes if node not in owner)
+    collapsed.add_nodes_from(groups)
+    collapsed.add_edges_from((owner.get(source, source), owner.get(target, target)) for source, target in G.edges
+                             if owner.get(source, source) != owner.get(target, target) and anchors.get(target, source) == source)
+
+    colors    = dict(colors)
+    positions = dict(positions)
+    for group, (_, members, _) in groups.items():
+        colors[group]    = AGGREGATE_COLOR
+        positions[group] = tuple(np.mean([positions[member] for member in members], axis=0))
+        collapsed.nodes[group].update(label=labels[group], size=10 + 3*math.log1p(len(members)))
+    return collapsed, colors, positions
+
+
+def render_html(G, colors, positions, height='740px'):
+    """pyvis HTML for graph G with fixed node positions and physics turned off"""
+    from pyvis.network import Network
+
+    # Set background to white and default node color to black
+    net = Network(height=height, width='100%', bgcolor='white', font_color='black', directed=True)
+    net.toggle_physics(False)
+
+    #--Fill pyvis' node and edge lists directly; add_node/add_edge scan every existing node per call
+    #--nodes are user IDs (aggregates are strings with their own label); names are decoded only here
+    names     = usernames.get_dictionary()
+    net.nodes = []
+    for node, data in G.nodes(data=True):
+        x, y = positions[node]
+        net.nodes.append({"id": node, "label": data.get("label") or names.name(node), "shape": "dot" if "size" not in data else "square"
+                          , "color": colors[node], "font": {"color": "black"}, "size": data.get("size", 10)
+                          , "x": round(x*PIXELS_PER_UNIT, 1), "y": round(y*PIXELS_PER_UNIT, 1), "physics": False})
+    net.node_ids = list(G.nodes)
+    net.node_map = {options["id"]: options for options in net.nodes}
+    net.edges    = [{"from": source, "to": target, "width": 2, "color": "black", "arrows": "to"} for source, target in G.edges]
+    return net.generate_html()
+
+
+_graph = ContactGraph()
+
+
+def get_contact_graph(interactions):
+    """Process-wide contact graph synced with the given dataset (the latest, or one a few events behind it)"""
+    return _graph.sync(interactions)
@@ -0,0 +1,143 @@
+#mcandrew
+
+"""Incrementally maintained index of the game state used to validate submissions.
+
+The index is updated with only the events that arrived since it was last
+synced, so every check in add_user_data_to_database is a dictionary or set
+lookup instead of a scan over the whole interaction log.
+"""
+
+import numpy as np
+import pandas as pd
+
+import event_log
+import usernames
+
+INFECTION_BASELINE = 0.50   #<--this is the baseline probability of infection
+COOLDOWN_SECONDS   = 60.    #<--cool down between two events of the same pair
+
+
+def pair_key(actors, audiences):
+    """One int64 per (actor ID, audience ID) pair (arrays or scalars)"""
+    return (np.asarray(actors, dtype=np.int64) << 32) | (np.asarray(audiences, dtype=np.int64) & 0xFFFFFFFF)
+
+
+class EpidemicState(event_log.IncrementalIndex):
+    """Infected users, per-pair last contact, per-user protection and intervention types"""
+
+    NAME = "epidemic_state"
+
+    def _reset(self):
+        self.infected      = set()   #<--user IDs (usernames.py); queries take names
+        self.last_contact  = {}      #<--pair_key(actor ID, audience ID) -> pd.Timestamp
+        self.protection    = {}      #<--audience ID -> product of (1 - intervention_value)
+        self.interventions = {}      #<--audience ID -> set of intervention types
+
+    @classmethod
+    def from_dataframe(cls, interactions):
+        state = cls()
+        state.apply(interactions)
+        return state
+
+    def _apply(self, events):
+        if events.empty:
+            return
+
+        names       = usernames.get_dictionary()
+        actors      = names.encode(events.Actor)
+        audiences   = names.encode(events.Audience)
+        infection   = events.infection_intervention.values == 1
+        self.infected.update(names.keys(audiences[infection & (events.success.values == 1)]))
+
+        timestamps = events.timestamp
+        if not pd.api.types.is_datetime64_any_dtype(timestamps):
+            timestamps = pd.to_datetime(timestamps, format=event_log.TIMESTAMP_FORMAT)
+        last       = pd.Series(timestamps.values).groupby(pair_key(actors, audiences)).max()
+        for pair, timestamp in zip(last.index.tolist(), last):
+            previous = self.last_contact.get(pair)
+            if previous is None or timestamp > previous:
+                self.last_contact[pair] = timestamp
+
+        interventions = ~infection
+        if interventions.any():
+            for audience, value, intervention_type in zip(names.keys(audiences[interventions])
+                                                          , events.intervention_value.values[interventions]
+                                                          , events.intervention_type.values[interventions]):
+                self.protection[audience] = self.protection.get(audience, 1.) * (1. - value)
+                self.interventions.setdefault(audience, set()).add(intervention_type)
+
+    #--Queries (by username; under the lock, so a sync in progress is never seen half done)------------------------------
+    def is_infected(self, user):
+        with self.lock:
+            return usernames.lookup(user) in self.infected
+
+    def seconds_since_contact(self, actor, audience, now):
+        """Seconds since the last event between actor and audience (None if they never interacted)"""
+        with self.lock:
+            last = self.last_contact.get(pair_key(usernames.lookup(actor), usernames.lookup(audience)))
+        return None if last is None else (pd.Timestamp(now) - last).total_seconds()
+
+    def in_cooldown(self, actor, audience, now):
+        seconds = self.seconds_since_contact(actor, audience, now)
+        return seconds is not None and seconds < COOLDOWN_SECONDS
+
+    def has_intervention(self, user, intervention_type):
+        with self.lock:
+            return intervention_type in self.interventions.get(usernames.lookup(user), ())
+
+    def protection_of(self, ids):
+        """Protection left (product of 1 - effectiveness) of an array of user IDs"""
+        with self.lock:
+            return np.array([self.protection.get(id_, 1.) for id_ in np.asarray(ids).tolist()], dtype=float)
+
+    def infection_probability(self, audience):
+        with self.lock:
+            return INFECTION_BASELINE*self.protection.get(usernames.lookup(audience), 1.)
+
+    #--Verification-------------------------------------------------------------------------------------------------------
+    def check_against_dataframe(self, interactions):
+        """Compare the index with the original full-DataFrame logic. Returns a list of mismatches."""
+        mismatches = []
+
+        infected = set(interactions.loc[(interactions.infection_intervention==1) & (interactions.success==1), "Audience"].unique())
+        indexed  = set(usernames.decode(sorted(self.infected)))
+        if infected != indexed:
+            mismatches.append(f"infected: {sorted(infected ^ indexed)}")
+
+        for audience in interactions.Audience.unique():
+            applied  = interactions.loc[(interactions.Audience == audience) & (interactions.infection_intervention==0)]
+            expected = INFECTION_BASELINE
+            if len(applied) > 0:
+                expected = INFECTION_BASELINE*np.prod(1. - applied.intervention_value.values)
+            if not np.isclose(expected, self.infection_probability(audience), equal_nan=True):
+                mismatches.append(f"probability of {audience}: {expected} != {self.infection_probability(audience)}")
+
+            types = set(applied.intervention_type.unique())
+            indexed = self.interventions.get(usernames.lookup(audience), set())
+            if types != indexed:
+                mismatches.append(f"interventions of {audience}: {types} != {indexed}")
+
+        for (actor, audience), timestamps in interactions.groupby(["Actor", "Audience"], observed=True).timestamp:
+            expected = pd.Timestamp(sorted(timestamps.values)[-1])
+            indexed  = self.last_contact.get(pair_key(usernames.lookup(actor), usernames.lookup(audience)))
+            if expected != indexed:
+                mismatches.append(f"last contact {actor}->{audience}: {expected} != {indexed}")
+
+        return mismatches
+
+
+_state = EpidemicState()
+
+
+def get_state(interactions):
+    """Process-wide index synced with the given dataset (the latest, or one a few events behind it)"""
+    return _state.sync(interactions)
+
+
+if __name__ == "__main__":
+    #--Rebuild the index from the event log and check it against the DataFrame logic
+    import storage
+
+    interactions = event_log.read_interactions(storage.get_storage())
+    mismatches   = EpidemicState.from_dataframe(interactions).check_against_dataframe(interactions)
+    print("\n".join(mismatches) if mismatches else f"Index matches the DataFrame logic for {len(interactions)} events")
@@ -0,0 +1,562 @@
+#mcandrew
+
+"""Append-only event log for the WMM interactions.
+
+Every submission is written as a small immutable segment object under
+``interactions/segments/``. The base snapshot ``interactions.csv`` records,
+in its metadata, the last segment that was folded into it. Readers fetch the
+base snapshot plus any newer segments, so a write costs one small PUT no
+matter how many events already exist.
+
+The base snapshot is stored as Parquet with a fixed schema (categorical
+usernames, int8 flags, float32 values, datetime64 timestamps) and exported
+as interactions.csv for anything that still reads the CSV. In memory the
+username categoricals share the process-wide dictionary of usernames.py, so
+their codes are user IDs.
+
+Segments are numbered densely and created with ``If-None-Match: *``, so two
+writers can never both claim the same position in the log. A writer that
+loses the race reads only the segments it has not checked yet, re-checks its
+event against them and tries the position after them. A writer whose cursor
+is below the base watermark re-checks against the base snapshot instead, since
+the segments after its cursor may already be folded and deleted.
+"""
+
+import time
+import random
+import threading
+from io import BytesIO
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import storage
+import telemetry
+import usernames
+
+SNAPSHOT_KEY   = "interactions.parquet"    #<--typed columnar base snapshot (source of truth)
+BASE_KEY       = "interactions.csv"        #<--CSV export of the same snapshot, kept for compatibility
+SEGMENT_PREFIX = "interactions/segments/"
+WATERMARK_META = "last-segment"            #<--metadata field on the base snapshot
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+INTERACTION_COLUMNS = ["Actor", "Audience", "infection_intervention", "success"
+                       , "intervention_value", "intervention_type", "timestamp"]
+
+CHECKPOINTS                = 1024   #<--last batches remembered by an index, to recognise a caller whose dataset is behind it
+COMPACT_THRESHOLD          = 100    #<--fold segments into the base once this many are pending
+SEGMENT_RETENTION_SECONDS  = 3600   #<--folded segments are kept this long (writers check the watermark, not these)
+
+WRITE_TIMEOUT_SECONDS = 30.    #<--a writer gives up only if it keeps losing positions for this long
+BACKOFF_BASE          = 0.005  #<--seconds of jitter after a lost position, growing with each loss (spreads out a burst)
+BACKOFF_CAP           = 0.1
+
+_stats_lock = threading.Lock()
+WRITE_STATS = Counter()     #<--writes, conflicts, retries, rejected, exhausted, stale_cursor, compaction_conflicts, export_skipped
+
+
+class EventRejected(Exception):
+    """The event is no longer valid given events that were written concurrently"""
+
+
+class AppendTimeout(Exception):
+    """The event could not be written before the write timeout (it was not stored)"""
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        WRITE_STATS[name] += n
+    telemetry.count(f"event_log.{name}", n)
+
+
+def write_stats():
+    """Snapshot of the write counters (for monitoring how often writers collide)"""
+    with _stats_lock:
+        return dict(WRITE_STATS)
+
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (attempt + 1))))
+
+
+def segment_key(seq):
+    return f"{SEGMENT_PREFIX}{seq:020d}.csv"
+
+
+def segment_seq(key):
+    """Sequence number of a segment key (0 for the empty watermark)"""
+    return int(key[len(SEGMENT_PREFIX):-len(".csv")]) if key else 0
+
+
+@telemetry.timed("event_log.append")
+def append_event(store, new_row_df, cursor=None, validate=None, timeout=WRITE_TIMEOUT_SECONDS):
+    """Write new events as the next segment of the log. Returns the new cursor.
+
+    cursor is the sequence number of the last event the caller has seen (as
+    returned by read_interactions_with_cursor). When another writer already
+    took the next position, only the segments written since the last check are
+    read and passed to validate(changed_rows_df); if it returns False the write
+    is abandoned with EventRejected, otherwise the write moves on to the position
+    after them. Every conflict means another event was stored, so writers keep
+    trying until timeout seconds have passed.
+
+    A cursor at or below the base watermark points into events that were already
+    folded (their segments may be deleted, so the position looks free). The event
+    is then checked against the whole base snapshot and written after its watermark.
+    """
+    if cursor is None:
+        _, cursor = read_interactions_with_cursor(store)
+
+    body     = to_csv_bytes(new_row_df)
+    deadline = time.monotonic() + timeout
+    attempt  = 0
+    while True:
+        watermark = segment_seq(base_info(store).metadata.get(WATERMARK_META, ""))
+        if cursor < watermark:
+            cursor = _catch_up(store, validate)
+
+        seq = cursor + 1
+        try:
+            store.put(segment_key(seq), body, content_type='text/csv', if_none_match=True)
+            _count("writes")
+            return seq
+        except storage.PreconditionFailed:
+            _count("conflicts")
+
+        #--Somebody else took this position: read it and the segments written after it (none of which we have
+        #--checked yet) in one batch, re-check our event against them and try the position after the last
+        keys = [segment_key(seq)] + list_segment_keys(store, start_after=segment_key(seq))
+        try:
+            changed = _read_changed(store, keys)
+        except storage.NotFound:
+            changed = None   #<--folded and removed meanwhile: the next attempt checks the event against the base
+        if changed is not None:
+            if validate is not None and len(changed) and not validate(changed):
+                _count("rejected")
+                raise EventRejected(f"Event conflicts with {len(changed)} concurrent event(s)")
+            cursor = segment_seq(keys[-1])
+
+        _count("retries")
+        if time.monotonic() > deadline:
+            _count("exhausted")
+            raise AppendTimeout(f"Could not append event within {timeout} seconds")
+        _backoff(attempt)
+        attempt += 1
+
+
+def _catch_up(store, validate):
+    """Check an event against the base snapshot for a writer whose cursor is below its watermark. Returns the watermark.
+
+    The snapshot does not record which segment each row came from, so the event is checked against all of
+    it: a superset of the rows folded after the cursor, which the checks of submissions.py treat the same.
+    """
+    _count("stale_cursor")
+    base, _, _, watermark = _read_base(store)
+    if validate is not None and len(base) and not validate(base):
+        _count("rejected")
+        raise EventRejected("Event conflicts with the base snapshot (the cursor was behind its watermark)")
+    return segment_seq(watermark)
+
+
+def list_segment_keys(store, start_after=""):
+    """All segment keys strictly after start_after, oldest first"""
+    return [info.key for info in store.list(SEGMENT_PREFIX, start_after=start_after)]
+
+
+def _read_segment_rows(store, key):
+    """Body of a segment without its header line"""
+    body = store.get(key).body
+    return body.split(b"\n", 1)[1] if b"\n" in body else b""
+
+
+def _fetch_segments(store, keys):
+    with ThreadPoolExecutor(max_workers=min(16, max(1, len(keys)))) as pool:
+        return list(pool.map(lambda key: _read_segment_rows(store, key), keys))
+
+
+@telemetry.timed("event_log.read_segments")
+def read_segments(store, keys, columns=None):
+    """Events stored in the given segments as a typed DataFrame"""
+    header = (",".join(INTERACTION_COLUMNS) + "\n").encode('utf-8')
+    body   = _join_csv(header, _fetch_segments(store, keys))
+    with telemetry.span("event_log.parse_csv", rows=len(keys)):
+        return apply_schema(pd.read_csv(BytesIO(body), usecols=columns))
+
+
+def _read_changed(store, keys):
+    """Events of the given segments for validation only: plain columns and parsed timestamps.
+
+    Cheaper than read_segments (no categoricals over the dictionary), which matters when many
+    writers in the process re-check their events at once.
+    """
+    header = (",".join(INTERACTION_COLUMNS) + "\n").encode('utf-8')
+    body   = _join_csv(header, _fetch_segments(store, keys))
+    return pd.read_csv(BytesIO(body), parse_dates=["timestamp"], date_format=TIMESTAMP_FORMAT)
+
+
+def _join_csv(base_body, segment_rows):
+    parts = [base_body if base_body.endswith(b"\n") else base_body + b"\n"]
+    parts.extend(rows for rows in segment_rows if rows)
+    return b"".join(parts)
+
+
+def same_event(a, b):
+    """True if two events (rows as sequences) are identical, treating missing values as equal"""
+    return all(x == y or (pd.isna(x) and pd.isna(y)) for x, y in zip(a, b))
+
+
+#--Indexes kept in step with the log----------------------------------------------------------------------------------------
+class IncrementalIndex:
+    """Base of the in-memory indexes that only apply the events appended since they last synced.
+
+    A subclass implements _reset() (an empty index) and _apply(events); apply() and sync() keep the
+    cursor. sync() tells apart three callers: one whose dataset has new events (they are applied),
+    one whose dataset is a few events behind the index (nothing to do: the index is newer), and one
+    whose log was replaced by a new game or snapshot (the index is rebuilt). Queries hold self.lock.
+    """
+    NAME = "index"   #<--prefix of the telemetry span and counters
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.cursor      = 0              #<--number of events applied
+        self.last_event  = None           #<--the last event applied
+        self.checkpoints = OrderedDict()  #<--cursor after each recent batch -> its last event
+        self._reset()
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _apply(self, events):
+        raise NotImplementedError
+
+    def apply(self, events):
+        """Fold events (rows appended to the log after the cursor) into the index; returns what _apply returns"""
+        with self.lock:
+            result = self._apply(events)
+            if len(events):
+                self.cursor    += len(events)
+                self.last_event = tuple(events.iloc[-1].values)
+                self.checkpoints[self.cursor] = self.last_event
+                if len(self.checkpoints) > CHECKPOINTS:
+                    self.checkpoints.popitem(last=False)
+            return result
+
+    def _behind(self, interactions):
+        """True if interactions is the log as it was at one of the recent checkpoints"""
+        n    = len(interactions)
+        seen = self.checkpoints.get(n)
+        return n > 0 and seen is not None and same_event(interactions.iloc[n-1].values, seen)
+
+    def sync(self, interactions):
+        """Bring the index up to date with the dataset, rebuilding only if the log was replaced"""
+        with telemetry.span(self.NAME + ".sync"), self.lock:
+            if self.cursor > len(interactions):
+                if self._behind(interactions):
+                    telemetry.count(self.NAME + ".behind")
+                    return self
+                telemetry.count(self.NAME + ".rebuild")
+                self._clear()
+            elif self.cursor and not same_event(interactions.iloc[self.cursor-1].values, self.last_event):
+                telemetry.count(self.NAME + ".rebuild")
+                self._clear()
+            self.apply(interactions.iloc[self.cursor:])
+        return self
+
+
+#--Typed snapshot--------------------------------------------------------------------------------------------------------
+def apply_schema(events):
+    """Cast interaction columns to the fixed snapshot schema (missing columns are skipped)"""
+    #--usernames are categoricals over the process-wide dictionary: their codes are user IDs
+    names = [column for column in ("Actor", "Audience") if column in events.columns]
+    typed = dict(zip(names, usernames.get_dictionary().to_categoricals([events[column] for column in names])))
+    for column in events.columns:
+        values = events[column]
+        if column in typed:
+            values = typed[column]
+        elif column == "intervention_type":
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                #--intervention_type mixes -1 (infections) with names; store everything as text
+                values = values.where(values.isna(), values.astype(str)).astype("category")
+            if values.cat.categories.dtype != object:
+                #--one category dtype everywhere, so snapshots and segments can be concatenated
+                values = values.cat.set_categories(values.cat.categories.astype(object))
+        elif column in ("infection_intervention", "success") and values.dtype != "int8":
+            values = values.astype("int8")
+        elif column == "intervention_value" and values.dtype != "float32":
+            values = values.astype("float32")
+        elif column == "timestamp" and values.dtype != "datetime64[ns]":
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                values = pd.to_datetime(values, format=TIMESTAMP_FORMAT)
+            values = values.astype("datetime64[ns]")
+        typed[column] = values
+    return pd.DataFrame(typed, index=events.index)
+
+
+def concat_events(frames):
+    """Concatenate typed event frames, merging the categories of categorical columns"""
+    frames = [apply_schema(frame) for i, frame in enumerate(frames) if i == 0 or len(frame)]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    columns = {}
+    for column in frames[0].columns:
+        if column in ("Actor", "Audience"):
+            dictionary      = usernames.get_dictionary()
+            columns[column] = pd.Series(dictionary.categorical(np.concatenate([dictionary.encode(frame[column]) for frame in frames])))
+        elif isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            columns[column] = pd.Series(union_categoricals([frame[column] for frame in frames]))
+        else:
+            columns[column] = pd.concat([frame[column] for frame in frames], ignore_index=True)
+    return apply_schema(pd.DataFrame(columns))
+
+
+def to_snapshot_bytes(events):
+    buffer = BytesIO()
+    events = apply_schema(events[INTERACTION_COLUMNS])
+    for column in ("Actor", "Audience"):
+        #--only the names this log uses, not every name the process has seen
+        events[column] = events[column].cat.remove_unused_categories()
+    events.to_parquet(buffer, index=False, compression="zstd")
+    return buffer.getvalue()
+
+
+def to_csv_bytes(events):
+    return events[INTERACTION_COLUMNS].to_csv(index=False, date_format=TIMESTAMP_FORMAT).encode('utf-8')
+
+
+@telemetry.timed("event_log.read_base")
+def _read_base(store, columns=None):
+    """Base snapshot as a typed DataFrame, with the key and ETag it was read from and its watermark.
+
+    The Parquet snapshot is preferred; the CSV is only read for logs that were never compacted.
+    """
+    try:
+        base_obj = store.get(SNAPSHOT_KEY)
+        with telemetry.span("event_log.parse_snapshot"):
+            base = apply_schema(pd.read_parquet(BytesIO(base_obj.body), columns=columns))
+        key      = SNAPSHOT_KEY
+    except storage.NotFound:
+        base_obj = store.get(BASE_KEY)
+        with telemetry.span("event_log.parse_csv"):
+            base = apply_schema(pd.read_csv(BytesIO(base_obj.body), usecols=columns))
+        key      = BASE_KEY
+    return base, key, base_obj.etag, base_obj.metadata.get(WATERMARK_META, "")
+
+
+def base_info(store):
+    """Key, ETag and metadata (with the watermark) of the current base snapshot (a cheap HEAD)"""
+    try:
+        return store.head(SNAPSHOT_KEY)
+    except storage.NotFound:
+        return store.head(BASE_KEY)
+
+
+def base_etag(store):
+    """ETag of the current base snapshot"""
+    return base_info(store).etag
+
+
+def _read_log(store, columns=None):
+    """Base snapshot (frame, key, ETag, watermark) and the pending segments as (keys, frame)"""
+    base = _read_base(store, columns)
+    keys = list_segment_keys(store, start_after=base[3])
+    return base, keys, read_segments(store, keys, columns=columns)
+
+
+@telemetry.timed("event_log.read")
+def read_interactions_with_cursor(store, columns=None):
+    """Latest interactions (typed) and the sequence number of the last event in them.
+
+    columns restricts the load to the given columns (only those are read from the snapshot).
+    """
+    for attempt in range(3):
+        try:
+            base, keys, pending = _read_log(store, columns)
+            break
+        except storage.NotFound:
+            #--a concurrent compaction removed a segment between our base read and segment read
+            if attempt == 2:
+                raise
+
+    events = concat_events([base[0], pending])
+    if len(keys) >= COMPACT_THRESHOLD and columns is None:
+        try:
+            _fold(store, events, base, keys)
+        except Exception as e:
+            print(f"Warning: Could not compact interactions: {str(e)}")
+
+    return events, segment_seq(keys[-1] if keys else base[3])
+
+
+def read_interactions(store, columns=None):
+    """Latest interactions as a DataFrame (base snapshot + pending segments)"""
+    return read_interactions_with_cursor(store, columns=columns)[0]
+
+
+@telemetry.timed("event_log.compact")
+def _fold(store, events, base, keys):
+    """Write a new base snapshot holding events (base + the segments in keys). Returns number folded."""
+    if not keys:
+        return 0
+    _, base_key, etag, watermark = base
+
+    #--The Parquet snapshot is the source of truth; the first compaction of a CSV-only log creates it
+    condition = {"if_match": etag} if base_key == SNAPSHOT_KEY else {"if_none_match": True}
+    try:
+        store.put(SNAPSHOT_KEY, to_snapshot_bytes(events), content_type='application/vnd.apache.parquet'
+                  , metadata={WATERMARK_META: keys[-1]}, **condition)
+    except storage.PreconditionFailed:
+        #--another process compacted first; its snapshot is at least as new as ours
+        _count("compaction_conflicts")
+        return 0
+
+    #--CSV export of the same snapshot, kept for anything that still reads interactions.csv
+    _export_csv(store, events, keys[-1])
+
+    #--Remove segments that were folded by an earlier compaction and are old enough that
+    #--no writer can still be trying to claim their sequence number
+    cutoff = time.time() - SEGMENT_RETENTION_SECONDS
+    store.delete([info.key for info in store.list(SEGMENT_PREFIX)
+                  if info.key <= watermark and info.last_modified < cutoff])
+    return len(keys)
+
+
+def _export_csv(store, events, watermark):
+    """Write the CSV export of a snapshot, unless the export already holds this watermark or a later one.
+
+    The export is replaced with If-Match on the ETag it was checked at, so a slow compactor can never
+    overwrite a newer export with its older one.
+    """
+    body = None
+    for attempt in range(3):
+        try:
+            current   = store.head(BASE_KEY)
+            condition = {"if_match": current.etag}
+            if current.metadata.get(WATERMARK_META, "") >= watermark:
+                _count("export_skipped")
+                return False
+        except storage.NotFound:
+            condition = {"if_none_match": True}
+        body = body if body is not None else to_csv_bytes(events)
+        try:
+            store.put(BASE_KEY, body, content_type='text/csv', metadata={WATERMARK_META: watermark}, **condition)
+            return True
+        except storage.PreconditionFailed:
+            continue   #<--another compactor exported in between; check its watermark
+    _count("export_skipped")
+    return False
+
+
+def compact_interactions(store):
+    """Fold pending segments into the base snapshot. Meant to run on a schedule (see __main__)."""
+    base, keys, pending = _read_log(store)
+    return _fold(store, concat_events([base[0], pending]), base, keys)
+
+
+def reset_interactions(store, dataset):
+    """Start a new game: replace the base snapshot and ignore every existing segment"""
+    existing  = list_segment_keys(store)
+    watermark = existing[-1] if existing else ""
+    store.put(SNAPSHOT_KEY, to_snapshot_bytes(dataset), content_type='application/vnd.apache.parquet'
+              , metadata={WATERMARK_META: watermark})
+    store.put(BASE_KEY, to_csv_bytes(dataset), content_type='text/csv', metadata={WATERMARK_META: watermark})
+
+
+#--Event store interface-----------------------------------------------------------------------------------------------------
+class ObjectEventLog:
+    """The segmented log in object storage, behind the interface shared with sqlite_store.SQLiteEventStore"""
+
+    def __init__(self, store):
+        self.store       = store
+        self.name        = store.name
+        self._watermark  = None               #<--seq of the last folded segment, as of the latest version()
+        self._compacting = threading.Lock()   #<--one background fold at a time
+
+    def append(self, new_row_df, cursor=None, validate=None):
+        return append_event(self.store, new_row_df, cursor=cursor, validate=validate)
+
+    def read_with_cursor(self, columns=None):
+        return read_interactions_with_cursor(self.store, columns=columns)
+
+    def read_after(self, cursor):
+        """Events after cursor and the cursor of the last of them"""
+        keys = list_segment_keys(self.store, start_after=segment_key(cursor))
+        return read_segments(self.store, keys), (segment_seq(keys[-1]) if keys else cursor)
+
+    def version(self):
+        """Changes whenever earlier events may have changed (compaction or a new game)"""
+        info            = base_info(self.store)
+        self._watermark = segment_seq(info.metadata.get(WATERMARK_META, ""))
+        return info.etag
+
+    def compact_if_needed(self, cursor):
+        """Fold the pending segments in a background thread once COMPACT_THRESHOLD of them are pending.
+
+        Called after each revalidation, so a warm process that only reads new segments still keeps
+        their number (and the cost of a cold start) bounded. Returns True if a fold was started.
+        """
+        if self._watermark is None or cursor - self._watermark < COMPACT_THRESHOLD:
+            return False
+        if not self._compacting.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                compact_interactions(self.store)
+            except Exception as e:
+                print(f"Warning: Could not compact interactions: {str(e)}")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, name="compact-interactions", daemon=True).start()
+        return True
+
+    def validation_state(self, interactions):
+        """Index used to validate a submission against interactions"""
+        import epidemic_state
+        return epidemic_state.get_state(interactions)
+
+    def reset(self, dataset):
+        reset_interactions(self.store, dataset)
+
+
+_events_lock = threading.Lock()
+_events      = None
+
+
+def get_event_log(secrets=None):
+    """Process-wide event store: the object log (default) or SQLite when event_backend = "sqlite" in the secrets"""
+    global _events
+    with _events_lock:
+        if _events is None:
+            if secrets is None:
+                import streamlit as st
+                secrets = st.secrets
+            if secrets.get("event_backend", "object") == "sqlite":
+                import sqlite_store
+                _events = sqlite_store.from_secrets(secrets)
+            else:
+                _events = ObjectEventLog(storage.get_storage(secrets))
+        return _events
+
+
+def set_event_log(events):
+    """Replace the process-wide event store (tests, benchmarks, scripts)"""
+    global _events
+    with _events_lock:
+        _events = events
+    return events
+
+
+if __name__ == "__main__":
+    #--Run from a scheduler (e.g. cron every few minutes) to keep the number of pending segments small
+    store  = storage.get_storage()
+    folded = compact_interactions(store)
+    print(f"Folded {folded} segments into {store.name}/{SNAPSHOT_KEY}")
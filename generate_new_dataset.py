@@ -4,20 +4,11 @@ import pandas as pd
 from datetime import datetime
 import numpy as np
 
-import boto3
-import streamlit as st
+import event_log
 
 if __name__ == "__main__":
 
-    AWS_S3_BUCKET = "wmm-2025"
-    AWS_ACCESS_KEY_ID = st.secrets["AWS_ACCESS_KEY_ID"]
-    AWS_SECRET_ACCESS_KEY = st.secrets["AWS_SECRET_ACCESS_KEY"]
-
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-    )
+    events = event_log.get_event_log()
 
     d = pd.DataFrame({ "Actor"   :["exp626",'thm220']
                       ,"Audience":["thm220",'gms221']
@@ -27,5 +18,6 @@ if __name__ == "__main__":
                       ,'intervention_type'     :[-1,-1]
                       ,"timestamp"             :[datetime.now().strftime("%Y-%m-%d %H:%M:%S"),datetime.now().strftime("%Y-%m-%d %H:%M:%S")]})
 
-    s3_client.put_object(Bucket=AWS_S3_BUCKET, Key="interactions.csv", Body=d.to_csv(index=False).encode('utf-8'))
+    #--Replaces every event of the previous game (object log: new base snapshot that hides old segments)
+    events.reset(d)
 
@@ -0,0 +1,101 @@
+#mcandrew
+
+"""Incidence of infections, contact attempts and interventions over time.
+
+Events are binned once, by minute, with np.bincount over (series, minute)
+codes; hour and day series are sums of the minute bins. New events extend the
+existing bins in place, so a dashboard refresh costs O(new events + bins).
+"""
+
+import numpy as np
+import pandas as pd
+
+import event_log
+
+RESOLUTIONS = {"minute": 1, "hour": 60, "day": 1440}   #<--width of each resolution in minutes
+
+INFECTIONS       = "infections"
+CONTACT_ATTEMPTS = "contact_attempts"
+NS_PER_MINUTE    = 60*10**9
+
+
+class IncidenceAggregator(event_log.IncrementalIndex):
+    """Per-minute counts for infections, contact attempts and each intervention type"""
+
+    NAME = "incidence"
+
+    def _reset(self):
+        self.series     = [INFECTIONS, CONTACT_ATTEMPTS]   #<--row order of self.counts; intervention types follow
+        self.origin     = None                             #<--first minute bin (epoch minutes, aligned to a day)
+        self.counts     = np.zeros((len(self.series), 0), dtype=np.int64)
+
+    def _apply(self, events):
+        """Bin new events in one pass and grow the count matrix as needed"""
+        if events.empty:
+            return
+        timestamps = events.timestamp
+        if not pd.api.types.is_datetime64_any_dtype(timestamps):
+            timestamps = pd.to_datetime(timestamps, format=event_log.TIMESTAMP_FORMAT)
+        minutes = timestamps.values.astype("datetime64[ns]").astype(np.int64)//NS_PER_MINUTE
+
+        #--keep day boundaries on bin boundaries so hours and days are exact sums of minutes
+        first = (minutes.min()//RESOLUTIONS["day"])*RESOLUTIONS["day"]
+        if self.origin is None:
+            self.origin = first
+        elif first < self.origin:
+            self.counts = np.pad(self.counts, ((0, 0), (self.origin - first, 0)))
+            self.origin = first
+        n_bins = max(self.counts.shape[1], int(minutes.max() - self.origin) + 1)
+
+        infection = events.infection_intervention.values == 1
+        success   = events.success.values == 1
+        types     = np.asarray(events.intervention_type, dtype=object)[~infection]
+        for intervention_type in pd.unique(types):
+            if intervention_type not in self.series:
+                self.series.append(intervention_type)
+        type_rows = {name: row for row, name in enumerate(self.series)}
+
+        #--each event counts once or twice: (series row, minute) -> one flat code per count
+        rows = np.concatenate([np.zeros(int((infection & success).sum()), dtype=np.int64)
+                               , np.ones(int(infection.sum()), dtype=np.int64)
+                               , np.array([type_rows[t] for t in types], dtype=np.int64)])
+        bins = np.concatenate([minutes[infection & success], minutes[infection], minutes[~infection]]) - self.origin
+
+        added = np.bincount(rows*n_bins + bins, minlength=len(self.series)*n_bins).reshape(len(self.series), n_bins)
+        grown = np.zeros((len(self.series), n_bins), dtype=np.int64)
+        grown[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+        self.counts = grown + added
+
+    #--Queries------------------------------------------------------------------------------------------------------------
+    def incidence(self, resolution="hour"):
+        """Counts per bin at minute, hour or day resolution (one column per series)"""
+        with self.lock:
+            width  = RESOLUTIONS[resolution]
+            counts = self.counts
+            if self.origin is None:
+                return pd.DataFrame(columns=self.series, dtype=np.int64)
+            n_bins = -(-counts.shape[1]//width)
+            padded = np.zeros((counts.shape[0], n_bins*width), dtype=np.int64)
+            padded[:, :counts.shape[1]] = counts
+            binned = padded.reshape(counts.shape[0], n_bins, width).sum(axis=2)
+            index  = pd.to_datetime((self.origin + np.arange(n_bins)*width)*NS_PER_MINUTE)
+            return pd.DataFrame(binned.T, index=index, columns=list(self.series))
+
+    def cumulative(self, resolution="hour"):
+        return self.incidence(resolution).cumsum()
+
+    def rolling(self, window, resolution="hour"):
+        """Events in the trailing window of `window` bins, e.g. rolling(24, "hour")"""
+        return self.incidence(resolution).rolling(window, min_periods=1).sum().astype(np.int64)
+
+    def intervention_types(self):
+        with self.lock:
+            return [name for name in self.series if name not in (INFECTIONS, CONTACT_ATTEMPTS)]
+
+
+_aggregator = IncidenceAggregator()
+
+
+def get_incidence(interactions):
+    """Process-wide aggregator synced with the given dataset (the latest, or one a few events behind it)"""
+    return _aggregator.sync(interactions)
@@ -0,0 +1,106 @@
+#mcandrew
+
+"""Process-wide cache of the interaction log.
+
+Every Streamlit session in this server process shares one copy of the
+dataset. Revalidation asks the event store for its version and for the
+events after the cached cursor (for the object log: a HEAD on the base
+snapshot and a listing of newer segments); everything is read again only
+when the version changes. One session revalidates at a time and the others
+wait for its result; the cache lock itself is never held during network I/O.
+Revalidation also starts a background compaction once enough segments are
+pending (event_log.COMPACT_THRESHOLD).
+"""
+
+import time
+import threading
+
+import event_log
+import telemetry
+
+REVALIDATE_SECONDS = 2.   #<--at most one revalidation per interval, shared by all sessions
+
+_lock         = threading.Lock()   #<--guards _cache; never held during network I/O
+_refresh_lock = threading.Lock()   #<--one revalidation at a time; the other sessions wait for its result
+_cache        = {"etag": None, "cursor": 0, "dataset": None, "checked_at": 0., "store": None}
+
+
+def _version():
+    return f"{_cache['etag']}:{_cache['cursor']}"
+
+
+def dataset_version():
+    """Token that changes whenever the cached dataset changes (use as a cache key)"""
+    with _lock:
+        return _version()
+
+
+def _fresh(events, since):
+    """True if the cache holds this store's dataset, revalidated at or after since"""
+    return _cache["dataset"] is not None and _cache["store"] == events.name and _cache["checked_at"] >= since
+
+
+def _revalidate(events, started):
+    """Bring the cache up to date with the event store; the reads run outside _lock"""
+    for attempt in range(3):
+        with _lock:
+            dataset, etag, cursor = _cache["dataset"], _cache["etag"], _cache["cursor"]
+            known                 = dataset is not None and _cache["store"] == events.name
+
+        #--version first: if it changes in between we hold an older version and simply reload again next time
+        version = events.version()
+        if not known or version != etag:
+            #--first load, another store, or compaction / a new game replaced the base snapshot
+            telemetry.count("cache.interactions.miss")
+            dataset, cursor = events.read_with_cursor()
+            with _lock:
+                _cache.update(etag=version, cursor=cursor, dataset=dataset, store=events.name, checked_at=started)
+            return
+
+        new_rows, new_cursor = events.read_after(cursor)
+        telemetry.count("cache.interactions.revalidated")
+        with _lock:
+            if _cache["cursor"] != cursor or _cache["etag"] != etag:
+                continue   #<--record_append added an event while we read: read again after it
+            if len(new_rows):
+                _cache["dataset"] = event_log.concat_events([dataset, new_rows])
+                _cache["cursor"]  = new_cursor
+            _cache["checked_at"] = started
+            return
+
+
+def get_interactions(events, max_age=REVALIDATE_SECONDS):
+    """Latest dataset, the cursor of its last event and its version token.
+
+    The dataset is shared between sessions; callers must copy it before modifying it.
+    max_age=0 forces a revalidation (used right before validating a submission).
+    """
+    now = time.time()
+    with _lock:
+        if _fresh(events, now - max_age) and max_age > 0:
+            telemetry.count("cache.interactions.hit")
+            return _cache["dataset"], _cache["cursor"], _version()
+
+    with _refresh_lock:
+        with _lock:
+            joined = _fresh(events, now)   #<--another session revalidated after we asked: use its result
+        if not joined:
+            with telemetry.span("interactions_cache.revalidate"):
+                _revalidate(events, time.time())
+        else:
+            telemetry.count("cache.interactions.joined")
+
+    with _lock:
+        dataset, cursor, version = _cache["dataset"], _cache["cursor"], _version()
+
+    #--a warm process only reads new segments, so it is what keeps their number bounded
+    events.compact_if_needed(cursor)
+    return dataset, cursor, version
+
+
+def record_append(events, new_row_df, cursor):
+    """Fold an event this process just wrote into the cache without another round-trip"""
+    with _lock:
+        if _cache["dataset"] is not None and _cache["store"] == events.name and cursor == _cache["cursor"] + len(new_row_df):
+            _cache["dataset"] = event_log.concat_events([_cache["dataset"], new_row_df[event_log.INTERACTION_COLUMNS]])
+            _cache["cursor"]  = cursor
@@ -0,0 +1,137 @@
+#mcandrew
+
+"""Intervention effectiveness model shared by every session in the process.
+
+The catalog (intervention_effectiveness.csv) is downloaded once per ETag
+and each intervention type's KDE is fitted once. Draws come from a pool of
+precomputed samples; the next batch is generated on a background thread while
+the current one is used, so an intervention submit is an array lookup.
+"""
+
+import time
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+
+CATALOG_KEY = "intervention_effectiveness.csv"
+
+POOL_SIZE                  = 256    #<--samples generated per type and batch
+CATALOG_REVALIDATE_SECONDS = 60.    #<--at most one HEAD on the catalog per interval
+SCALE                      = 10.    #<--catalog values are on a 0-10 scale; effectiveness is 0-1
+
+_refiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intervention-refill")
+
+
+class SamplePool:
+    """Precomputed draws from one KDE: the current batch is consumed while the next one is generated"""
+
+    def __init__(self, kde, rng, size=POOL_SIZE):
+        self.kde      = kde
+        self.rng      = rng
+        self.size     = size
+        self.lock     = threading.Lock()
+        self.samples  = self._batch()
+        self.position = 0
+        self.pending  = _refiller.submit(self._batch)
+
+    def _batch(self):
+        #--batches are produced one at a time and in order, so the stream only depends on the seed
+        return np.clip(self.kde.resample(self.size, seed=self.rng)[0], 0, 1)
+
+    def draw(self):
+        with self.lock:
+            if self.position == len(self.samples):
+                self.samples, self.position = self.pending.result(), 0   #<--only waits if the refill is still running
+                self.pending = _refiller.submit(self._batch)
+            value = self.samples[self.position]
+            self.position += 1
+            return float(value)
+
+
+class InterventionModel:
+    """One fitted KDE and sample pool per intervention type in the catalog"""
+
+    def __init__(self, catalog, seed=None, version=None, pool_size=POOL_SIZE):
+        from scipy.stats import gaussian_kde
+
+        self.version = version
+        self.types   = catalog.columns.tolist()
+        self.pools   = {}
+        rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(self.types))]
+        for intervention_type, rng in zip(self.types, rngs):
+            try:
+                kde = gaussian_kde(catalog[intervention_type].dropna().values/SCALE)
+            except Exception as e:
+                print(f"Warning: Could not fit effectiveness of {intervention_type}: {str(e)}")
+                continue
+            self.pools[intervention_type] = SamplePool(kde, rng, size=pool_size)
+
+    def draw(self, intervention_type):
+        """One effectiveness value in [0, 1] for intervention_type (KeyError if it is not in the catalog)"""
+        return self.pools[intervention_type].draw()
+
+
+_lock         = threading.Lock()   #<--guards _model; never held during storage I/O or the fit
+_refresh_lock = threading.Lock()   #<--one revalidation at a time
+_model        = {"model": None, "checked_at": 0., "store": None}
+
+
+def load_catalog(store):
+    """The catalog and its ETag"""
+    catalog_obj = store.get(CATALOG_KEY)
+    return pd.read_csv(BytesIO(catalog_obj.body)), catalog_obj.etag
+
+
+def _cached(store):
+    """The cached model if it was built from this store (call with _lock held)"""
+    return _model["model"] if _model["store"] == store.name else None
+
+
+def get_model(store, max_age=CATALOG_REVALIDATE_SECONDS, seed=None):
+    """Process-wide model, rebuilt only when the catalog in storage changes.
+
+    One session revalidates at a time, outside _lock; sessions that already have a model keep drawing
+    from it meanwhile instead of waiting for the HEAD, the download or the fit.
+    """
+    now = time.time()
+    with _lock:
+        model = _cached(store)
+        seen  = _model["checked_at"]
+        if model is not None and now - seen < max_age:
+            telemetry.count("cache.intervention_model.hit")
+            return model
+
+    if not _refresh_lock.acquire(blocking=model is None):
+        telemetry.count("cache.intervention_model.stale")   #<--another session is revalidating
+        return model
+    try:
+        with _lock:
+            model = _cached(store)
+            if model is not None and _model["checked_at"] != seen:
+                return model   #<--revalidated by another session while we waited
+
+        try:
+            etag = store.head(CATALOG_KEY).etag
+        except Exception as e:
+            if model is None:
+                raise
+            print(f"Warning: Could not revalidate the intervention catalog, using the cached one: {str(e)}")
+            return model
+
+        if model is None or etag != model.version:
+            telemetry.count("cache.intervention_model.miss")
+            catalog, etag = load_catalog(store)
+            with telemetry.span("intervention_model.fit", types=len(catalog.columns)):
+                model = InterventionModel(catalog, seed=seed, version=etag)
+        else:
+            telemetry.count("cache.intervention_model.revalidated")
+        with _lock:
+            _model.update(model=model, checked_at=now, store=store.name)
+        return model
+    finally:
+        _refresh_lock.release()
@@ -0,0 +1,146 @@
+#mcandrew
+
+"""Top spreaders, kept ranked as events arrive.
+
+Three counters are ranked per user ID: direct infections and descendants
+(every infection the user led to), both read from the shared transmission
+tree, and failed infection attempts, counted here. All three only grow as
+events are appended. The leaderboard listens to the tree: after each batch it
+gets the users whose counts changed and by how much, and re-ranks only them.
+Each counter has a Ranking: the users grouped by count, with the distinct
+counts and the users of each count kept sorted, so the top k is read from the
+highest counts down without a scan over users or events.
+
+When the tree is rebuilt (a new game, or a snapshot that does not extend the
+one applied) the leaderboard is reset with it and fed the whole log again.
+"""
+
+import bisect
+
+import numpy as np
+
+import transmission
+import usernames
+
+METRICS = {"descendants": "Infections led to", "direct_infections": "Direct infections", "failed_attempts": "Failed attempts"}
+TOP_K   = 50
+
+REBUILD_SHARE = 0.25   #<--a batch that changes more than this share of the ranked users rebuilds the ranking instead
+
+
+class Ranking:
+    """Users with a positive count, grouped by count, with the distinct counts in ascending order"""
+
+    def __init__(self):
+        self.buckets = {}   #<--count -> sorted list of user IDs
+        self.counts  = []   #<--sorted distinct counts
+        self.size    = 0    #<--users ranked
+
+    def _add(self, user, count):
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = self.buckets[count] = []
+            bisect.insort(self.counts, count)
+        bisect.insort(bucket, user)
+        self.size += 1
+
+    def _remove(self, user, count):
+        bucket = self.buckets[count]
+        del bucket[bisect.bisect_left(bucket, user)]
+        self.size -= 1
+        if not bucket:
+            del self.buckets[count]
+            del self.counts[bisect.bisect_left(self.counts, count)]
+
+    def update(self, users, old, new):
+        """Move users from their old to their new counts"""
+        for user, before, after in zip(users.tolist(), old.tolist(), new.tolist()):
+            if before > 0:
+                self._remove(user, before)
+            if after > 0:
+                self._add(user, after)
+
+    def rebuild(self, values):
+        """Rank every user from an array of counts indexed by user ID"""
+        users  = np.flatnonzero(values > 0)
+        counts = values[users]
+        order  = np.argsort(counts, kind="stable")   #<--users stay in ID order within a count
+        users, counts = users[order], counts[order]
+        starts = np.flatnonzero(np.r_[True, counts[1:] != counts[:-1]]) if len(counts) else np.zeros(0, dtype=np.int64)
+        ends   = np.r_[starts[1:], len(counts)]
+        self.buckets = {int(counts[start]): users[start:end].tolist() for start, end in zip(starts, ends)}
+        self.counts  = sorted(self.buckets)
+        self.size    = len(users)
+
+    def top(self, k):
+        """(user ID, count) of the k highest counts; ties by ID"""
+        found = []
+        for count in reversed(self.counts):
+            found.extend((user, count) for user in self.buckets[count][:k - len(found)])
+            if len(found) >= k:
+                break
+        return found
+
+
+class SpreaderLeaderboard:
+    """A Ranking per counter, updated by the shared transmission tree after each batch it applies"""
+
+    def __init__(self, index):
+        self.index = index
+        self.lock  = index.lock   #<--updates run inside the tree's sync
+        self.reset()
+        index.listen(self)
+
+    def reset(self):
+        self.direct_infections = np.zeros(0, dtype=np.int64)   #<--by user ID; descendants are read from the tree
+        self.failed_attempts   = np.zeros(0, dtype=np.int64)
+        self.rankings          = {metric: Ranking() for metric in METRICS}
+
+    def _grow(self, n):
+        """Make room for user IDs below n"""
+        if n > len(self.failed_attempts):
+            extra = max(n, 2*len(self.failed_attempts)) - len(self.failed_attempts)
+            self.direct_infections = np.concatenate([self.direct_infections, np.zeros(extra, dtype=np.int64)])
+            self.failed_attempts   = np.concatenate([self.failed_attempts, np.zeros(extra, dtype=np.int64)])
+
+    def _values(self, metric):
+        return self.index.descendants if metric == "descendants" else getattr(self, metric)
+
+    def update(self, events, linked, credited, added):
+        """Add the counts a batch changed (linked infectors, descendants added by the tree, failed attempts) and re-rank those users"""
+        failed = (events.infection_intervention.values == 1) & (events.success.values == 0)
+        failed = usernames.encode(events.Actor[failed]).astype(np.int64)
+        failed = failed[failed != usernames.MISSING]
+        self._grow(len(usernames.get_dictionary()))
+
+        for metric, users in (("direct_infections", linked), ("failed_attempts", failed)):
+            users, increments = np.unique(users, return_counts=True)
+            getattr(self, metric)[users] += increments
+            self._rerank(metric, users, increments)
+        self._rerank("descendants", credited, added)   #<--the tree already added them
+
+    def _rerank(self, metric, users, increments):
+        if not len(users):
+            return
+        values  = self._values(metric)
+        ranking = self.rankings[metric]
+        if len(users) > REBUILD_SHARE*ranking.size:
+            ranking.rebuild(values)
+        else:
+            ranking.update(users, values[users] - increments, values[users])
+
+    def top(self, metric="descendants", k=TOP_K):
+        """The k users highest on metric, each with all three counters (user IDs)"""
+        with self.lock:
+            ranked = self.rankings[metric].top(k)
+            users  = np.array([user for user, _ in ranked], dtype=np.int64)
+            return {"user": users, **{counter: self._values(counter)[users] for counter in METRICS}}
+
+
+_leaderboard = SpreaderLeaderboard(transmission._index)
+
+
+def get_leaderboard(interactions):
+    """Process-wide leaderboard synced with the given (latest) dataset (through the shared transmission tree)"""
+    transmission.get_transmission(interactions)
+    return _leaderboard
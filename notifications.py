@@ -0,0 +1,374 @@
+#mcandrew
+
+"""Background delivery of WMM notification emails.
+
+Submissions put messages on a queue and return immediately; a small pool of
+worker threads sends them. The Gmail access token and API client are built
+once and reused until the token expires. Delivery status is kept per event so
+it can be looked up after the Submit handler has finished.
+
+A NotificationScheduler sits in front of the dispatcher: repeated contact
+notices to the same recipient are folded into one digest per window, sends
+are paced by token buckets matching the Gmail quota, and "you were infected"
+messages always go out before contact notices.
+"""
+
+import time
+import heapq
+import base64
+import itertools
+import threading
+from email.mime.text import MIMEText
+
+import telemetry
+
+FROM         = "thm220@lehigh.edu"
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+
+NUM_WORKERS  = 2
+MAX_ATTEMPTS = 3
+RETRY_DELAY  = 2.   #<--seconds, doubled after each failed attempt
+STATUS_TTL   = 3600.   #<--seconds a finished delivery status is kept for lookups
+
+#--Gmail: messages.send costs 100 of the 250 quota units a user may spend per second,
+#--and a Workspace account may send 2000 messages per day
+SENDS_PER_SECOND = 2.5
+SEND_BURST       = 5
+DAILY_SEND_LIMIT = 2000
+
+COALESCE_WINDOW = 600.   #<--seconds over which contact notices to one recipient become one digest
+
+PRIORITY_INFECTION = 0   #<--lower is sent first
+PRIORITY_CONTACT   = 1
+
+
+def infection_message(audience, actor, success=True):
+    """Recipient, subject and body of the email sent after an infection attempt"""
+    TO = f"{audience}@lehigh.edu"
+
+    if success:
+        subject = "You were infected with Watermelon Meow Meow"
+        body = f"""You have been infected with Watermelon Meow Meow!
+
+You have been Infected by: {actor}
+
+Instructions
+
+1. You can infect students, staff, or professors, anyone with a lehigh account. You are also allowed to infect more than one person at a time. The only rule is that you need to be INPERSON with the individual(s).
+2. Open up this link https://wmm-2025.streamlit.app/ and login with your Lehigh username (the letters and numbers before @lehigh.edu).
+3. Navigate to “User Input”
+4. You should explain that lehigh usernames will be included in a public facing app.
+5. Watch together the 1-min video.
+6. Add your name to the Infector textbox, the person you are infecting to the “Infectee” text box and press submit.
+
+- The WMM Team
+"""
+    else:
+        subject = "Watermelon Meow Meow - Contact Attempt"
+        body = f"""Someone attempted to infect you with Watermelon Meow Meow!
+
+Contact from: {actor}
+
+Good news - you were NOT infected this time! However, you are still at risk.
+
+Please visit https://wmm-2025.streamlit.app/ to view your status.
+
+Stay safe!
+
+- The WMM Team
+"""
+    return TO, subject, body
+
+
+def contact_digest_message(audience, actors):
+    """One email for every contact attempt on audience within a coalescing window"""
+    if len(actors) == 1:
+        return infection_message(audience, actors[0], success=False)
+
+    TO      = f"{audience}@lehigh.edu"
+    subject = f"Watermelon Meow Meow - {len(actors)} Contact Attempts"
+    contacts = "\n".join(f"- {actor}" for actor in actors)
+    body = f"""Several people attempted to infect you with Watermelon Meow Meow!
+
+Contacts from:
+{contacts}
+
+Good news - you were NOT infected! However, you are still at risk.
+
+Please visit https://wmm-2025.streamlit.app/ to view your status.
+
+Stay safe!
+
+- The WMM Team
+"""
+    return TO, subject, body
+
+
+class TokenBucket:
+    """Allows rate events per second on average with bursts of up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate     = rate
+        self.capacity = capacity
+        self.tokens   = float(capacity)
+        self.updated  = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)"""
+        now          = time.monotonic()
+        self.tokens  = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+        self.updated = now
+        return 0. if self.tokens >= 1. else (1. - self.tokens)/self.rate
+
+    def take(self):
+        self.tokens -= 1.
+
+
+class GmailTransport:
+    """Sends through the Gmail API, refreshing the OAuth token only when it has expired"""
+
+    def __init__(self, client_id, client_secret, refresh_token, sender=FROM):
+        from google.oauth2.credentials import Credentials
+
+        self.sender      = sender
+        self.credentials = Credentials(
+            token=None,
+            refresh_token=refresh_token,
+            client_id=client_id,
+            client_secret=client_secret,
+            token_uri="https://oauth2.googleapis.com/token",
+            scopes=GMAIL_SCOPES
+        )
+        self._token_lock = threading.Lock()
+        self._local      = threading.local()   #<--the API client is not thread safe; one per worker
+
+    def _service(self):
+        from google.auth.transport.requests import Request
+        from googleapiclient.discovery import build
+
+        with self._token_lock:
+            if not self.credentials.valid:
+                with telemetry.span("gmail.refresh_token"):
+                    self.credentials.refresh(Request())
+
+        if getattr(self._local, "service", None) is None:
+            #--static_discovery uses the discovery document bundled with the client (no round-trip)
+            self._local.service = build('gmail', 'v1', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+        return self._local.service
+
+    def send(self, to, subject, body):
+        message = MIMEText(body)
+        message['to'] = to
+        message['from'] = self.sender
+        message['subject'] = subject
+        raw = base64.urlsafe_b64encode(message.as_bytes())
+        self._service().users().messages().send(userId="me", body={'raw': raw.decode()}).execute()
+
+
+class FakeTransport:
+    """Local stand-in for Gmail that records messages instead of sending them"""
+
+    def __init__(self, fail_times=0, delay=0.):
+        self.sent       = []
+        self.fail_times = fail_times   #<--number of sends that raise before sends start succeeding
+        self.delay      = delay
+        self._lock      = threading.Lock()
+
+    def send(self, to, subject, body):
+        time.sleep(self.delay)
+        with self._lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise ConnectionError("fake transport failure")
+            self.sent.append({"to": to, "subject": subject, "body": body})
+
+
+class EmailDispatcher:
+    """Priority queue of outgoing emails drained by background worker threads at a bounded rate"""
+
+    def __init__(self, transport, num_workers=NUM_WORKERS, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY
+                 , buckets=None):
+        self.transport    = transport
+        self.max_attempts = max_attempts
+        self.retry_delay  = retry_delay
+        self.buckets      = buckets if buckets is not None else [TokenBucket(SENDS_PER_SECOND, SEND_BURST)
+                                                                  , TokenBucket(DAILY_SEND_LIMIT/86400., DAILY_SEND_LIMIT)]
+        self._heap        = []   #<--(priority, order, message) ready to send
+        self._delayed     = []   #<--(not before, order, priority, message) retries waiting for their delay
+        self._order       = itertools.count()
+        self._unfinished  = 0
+        self._statuses    = {}
+        self._evicted_at  = time.time()
+        self._lock        = threading.Lock()
+        self._ready       = threading.Condition(self._lock)
+        self._workers     = [threading.Thread(target=self._work, daemon=True, name=f"email-worker-{i}") for i in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, event_ids, to, subject, body, priority=PRIORITY_INFECTION):
+        """Queue a message for delivery and return immediately. event_ids may be one id or a list."""
+        event_ids = list(event_ids) if isinstance(event_ids, (list, tuple)) else [event_ids]
+        with self._lock:
+            self._set_status(event_ids, status="queued", to=to, attempts=0, error=None)
+            heapq.heappush(self._heap, (priority, next(self._order), (event_ids, to, subject, body, 1)))
+            self._unfinished += 1
+            self._evict()
+            self._ready.notify()
+        return event_ids
+
+    def status(self, event_id):
+        """Delivery status of an event's email: queued, sending, retrying, sent or failed (None if unknown)"""
+        with self._lock:
+            status = self._statuses.get(event_id)
+            return dict(status) if status else None
+
+    def set_status(self, event_ids, **fields):
+        with self._lock:
+            self._set_status(event_ids, **fields)
+
+    def join(self, timeout=None):
+        """Block until every queued message was sent or gave up"""
+        with self._ready:
+            return self._ready.wait_for(lambda: self._unfinished == 0, timeout=timeout)
+
+    def _set_status(self, event_ids, **fields):
+        for event_id in event_ids:
+            self._statuses.setdefault(event_id, {}).update(fields, updated=time.time())
+
+    def _evict(self):
+        """Forget statuses of deliveries that finished more than STATUS_TTL ago (scans at most every tenth of it)"""
+        now = time.time()
+        if now - self._evicted_at < STATUS_TTL/10:
+            return
+        self._evicted_at = now
+        expired = [event_id for event_id, status in self._statuses.items()
+                   if status.get("status") in ("sent", "failed", "superseded") and now - status["updated"] > STATUS_TTL]
+        for event_id in expired:
+            del self._statuses[event_id]
+
+    def _next(self):
+        """Highest priority message that is due, once every bucket has a token for it"""
+        with self._ready:
+            while True:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, order, priority, message = heapq.heappop(self._delayed)
+                    heapq.heappush(self._heap, (priority, order, message))
+                if not self._heap:
+                    self._ready.wait(timeout=self._delayed[0][0] - now if self._delayed else None)
+                    continue
+                wait = max(bucket.wait_time() for bucket in self.buckets)
+                if wait > 0:
+                    #--a higher priority message may arrive while we wait; we pick again afterwards
+                    self._ready.wait(timeout=wait)
+                    continue
+                for bucket in self.buckets:
+                    bucket.take()
+                priority, _, message = heapq.heappop(self._heap)
+                return priority, message
+
+    def _retry(self, priority, message, delay):
+        """Queue a failed message again; it goes through the buckets like any other send once delay has passed"""
+        with self._ready:
+            heapq.heappush(self._delayed, (time.time() + delay, next(self._order), priority, message))
+            self._ready.notify()
+
+    def _work(self):
+        while True:
+            priority, message = self._next()
+            event_ids, to, subject, body, attempt = message
+            finished = True
+            try:
+                self.set_status(event_ids, status="sending", attempts=attempt)
+                with telemetry.span("gmail.send", attempt=attempt):
+                    self.transport.send(to, subject, body)
+                telemetry.count("gmail.sent")
+                self.set_status(event_ids, status="sent", error=None)
+                print(f"Email successfully sent to {to}")
+            except Exception as e:
+                print(f"Failed to send email: {str(e)}")
+                telemetry.count("gmail.failed")
+                if attempt < self.max_attempts:
+                    self.set_status(event_ids, status="retrying", error=str(e))
+                    self._retry(priority, (event_ids, to, subject, body, attempt + 1), self.retry_delay * 2**(attempt - 1))
+                    finished = False
+                else:
+                    self.set_status(event_ids, status="failed", error=str(e))
+            finally:
+                if finished:
+                    with self._ready:
+                        self._unfinished -= 1
+                        self._ready.notify_all()
+
+
+class NotificationScheduler:
+    """Coalesces contact notices per recipient and hands messages to the dispatcher by priority"""
+
+    def __init__(self, dispatcher, window=COALESCE_WINDOW):
+        self.dispatcher = dispatcher
+        self.window     = window
+        self._pending   = {}    #<--audience -> {"actors": [...], "event_ids": [...], "due": t}
+        self._lock      = threading.Condition()
+        self._flusher   = threading.Thread(target=self._flush_loop, daemon=True, name="email-digest-flusher")
+        self._flusher.start()
+
+    def infection(self, event_id, audience, actor):
+        """Send "you were infected" now; pending contact notices for audience are no longer relevant"""
+        with self._lock:
+            superseded = self._pending.pop(audience, None)
+        if superseded:
+            self.dispatcher.set_status(superseded["event_ids"], status="superseded")
+        TO, subject, body = infection_message(audience, actor, success=True)
+        return self.dispatcher.submit(event_id, TO, subject, body, priority=PRIORITY_INFECTION)
+
+    def contact(self, event_id, audience, actor):
+        """Hold a contact notice and send it with the others for audience when the window closes"""
+        with self._lock:
+            digest = self._pending.setdefault(audience, {"actors": [], "event_ids": [], "due": time.time() + self.window})
+            if actor not in digest["actors"]:
+                digest["actors"].append(actor)
+            digest["event_ids"].append(event_id)
+            self._lock.notify()
+        self.dispatcher.set_status([event_id], status="coalescing", to=f"{audience}@lehigh.edu", attempts=0, error=None)
+        return event_id
+
+    def flush(self, force=False):
+        """Send every digest whose window has closed (all of them with force=True)"""
+        now = time.time()
+        with self._lock:
+            due = [audience for audience, digest in self._pending.items() if force or digest["due"] <= now]
+            digests = [(audience, self._pending.pop(audience)) for audience in due]
+        for audience, digest in digests:
+            TO, subject, body = contact_digest_message(audience, digest["actors"])
+            self.dispatcher.submit(digest["event_ids"], TO, subject, body, priority=PRIORITY_CONTACT)
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                next_due = min((digest["due"] for digest in self._pending.values()), default=None)
+                self._lock.wait(timeout=None if next_due is None else max(0., next_due - time.time()))
+            self.flush()
+
+
+_lock      = threading.Lock()
+_scheduler = None
+
+
+def get_scheduler(secrets):
+    """Process-wide scheduler and dispatcher (built on first use from the Gmail secrets)"""
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            transport  = GmailTransport(client_id       = secrets["gmail_client_id"]
+                                        , client_secret = secrets["gmail_client_secret"]
+                                        , refresh_token = secrets["gmail_refresh_token"])
+            _scheduler = NotificationScheduler(EmailDispatcher(transport)
+                                               , window=float(secrets.get("contact_digest_window", COALESCE_WINDOW)))
+        return _scheduler
+
+
+def delivery_status(event_id):
+    """Delivery status of the email queued for an event (None if nothing was queued in this process)"""
+    with _lock:
+        scheduler = _scheduler
+    return scheduler.dispatcher.status(event_id) if scheduler is not None else None
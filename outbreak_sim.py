@@ -0,0 +1,215 @@
+#mcandrew
+
+"""Monte Carlo SIR/SEIR outbreaks on the contact network collected by the game.
+
+The network is a sparse adjacency matrix over every user who took part in an
+infection attempt. Each user's chance of being infected by one infectious
+contact in one step is the game's INFECTION_BASELINE times the protection
+left after their interventions, exactly as in the game itself.
+
+Runs are simulated together: the state of R runs is an (users x R) boolean
+matrix, and a step is one sparse matrix product (or, once few users are still
+infectious, a walk over their neighbours only). Chunks of runs are spread over
+a process pool.
+
+    python outbreak_sim.py --runs 10000 --model seir
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import usernames
+from epidemic_state import INFECTION_BASELINE, EpidemicState
+
+RUNS_PER_TASK          = 500    #<--runs simulated together in one worker task
+MAX_STEPS              = 365
+RECOVERY_PROBABILITY   = 0.2    #<--per step; mean infectious period of 5 steps
+INCUBATION_PROBABILITY = 0.5    #<--SEIR only: per step chance an exposed user becomes infectious
+QUANTILES              = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class ContactNetwork:
+    """Undirected contact network and each user's per-contact infection probability"""
+
+    def __init__(self, users, adjacency, susceptibility):
+        self.users          = users            #<--user of each row/column
+        self.adjacency      = adjacency        #<--scipy.sparse CSR, float32, symmetric, no self loops
+        self.susceptibility = susceptibility   #<--INFECTION_BASELINE * protection left, per user
+
+    @classmethod
+    def from_interactions(cls, interactions, baseline=INFECTION_BASELINE):
+        from scipy import sparse
+
+        attempts   = interactions.loc[interactions.infection_intervention.values == 1]
+        endpoints  = np.concatenate([usernames.encode(attempts.Actor), usernames.encode(attempts.Audience)])
+        ids, codes = np.unique(endpoints, return_inverse=True)
+        users      = usernames.decode(ids)
+        source, target = codes[:len(attempts)], codes[len(attempts):]
+        keep      = source != target
+
+        n         = len(users)
+        edges     = sparse.coo_matrix((np.ones(int(keep.sum()), dtype=np.float32), (source[keep], target[keep])), shape=(n, n)).tocsr()
+        adjacency = ((edges + edges.T) > 0).astype(np.float32)
+
+        state      = EpidemicState.from_dataframe(interactions)
+        protection = np.nan_to_num(state.protection_of(ids), nan=1.)
+        return cls(users, adjacency, baseline*protection)
+
+    def index(self, users):
+        positions = {user: i for i, user in enumerate(self.users)}
+        return np.array([positions[user] for user in users], dtype=np.int64)
+
+
+def _simulate(adjacency, susceptibility, runs, model, steps, recovery, incubation, seeds, seed):
+    """One chunk of runs. Returns (final sizes, new infections per step as a steps x runs array).
+
+    Users are tracked as flat (user, run) positions. Infections come from one sparse matrix product while many
+    users are infectious, and from walking the infectious users' neighbours when few are.
+    """
+    rng     = np.random.default_rng(seed)
+    n       = adjacency.shape[0]
+    indptr  = adjacency.indptr
+    indices = adjacency.indices
+    dense_limit = adjacency.nnz*runs//8   #<--contacts per step above which the matrix product is cheaper
+
+    susceptible = np.ones((n, runs), dtype=bool)
+    infectious  = np.zeros((n, runs), dtype=bool)
+    if seeds is None:
+        rows = rng.integers(0, n, size=runs)    #<--one random index case per run
+        infectious[rows, np.arange(runs)] = True
+    else:
+        infectious[seeds, :] = True
+    susceptible &= ~infectious
+    infectious_at = np.flatnonzero(infectious)
+    exposed_at    = np.empty(0, dtype=np.int64)
+
+    probability = susceptibility.astype(np.float32)
+    #--1 - (1 - p)^k for k infectious neighbours, computed as -expm1(k*log(1 - p))
+    log_escape  = np.log1p(-np.minimum(susceptibility, 1. - 1e-9)).astype(np.float32)
+
+    incidence = [infectious.sum(axis=0)]
+    for _ in range(steps):
+        if not (len(infectious_at) or len(exposed_at)):
+            break
+
+        nodes, columns = np.divmod(infectious_at, runs)
+        degree = indptr[nodes + 1] - indptr[nodes]
+        if degree.sum() > dense_limit:
+            pressure   = adjacency @ infectious.astype(np.float32)
+            candidates = np.flatnonzero(susceptible & (pressure > 0))
+            chance     = -np.expm1(pressure.ravel()[candidates]*log_escape[candidates//runs])
+            infected   = candidates[rng.random(len(candidates), dtype=np.float32) < chance]
+        else:
+            #--one trial per contact: every neighbour of every infectious user, in the same run
+            offsets  = np.repeat(indptr[nodes] - np.cumsum(degree) + degree, degree) + np.arange(degree.sum())
+            contacts = indices[offsets]*runs + np.repeat(columns, degree)
+            contacts = contacts[rng.random(len(contacts), dtype=np.float32) < probability[contacts//runs]]
+            infected = np.unique(contacts[susceptible.ravel()[contacts]])
+        susceptible.ravel()[infected] = False
+
+        recovered     = rng.random(len(infectious_at), dtype=np.float32) < recovery
+        infectious.ravel()[infectious_at[recovered]] = False
+        infectious_at = infectious_at[~recovered]
+        if model == "seir":
+            onset      = rng.random(len(exposed_at), dtype=np.float32) < incubation
+            becoming   = exposed_at[onset]
+            exposed_at = np.concatenate([exposed_at[~onset], infected])
+        else:
+            becoming   = infected
+        infectious.ravel()[becoming] = True
+        infectious_at = np.concatenate([infectious_at, becoming])
+        incidence.append(np.bincount(infected % runs, minlength=runs))
+
+    return n - susceptible.sum(axis=0), np.array(incidence, dtype=np.int32)
+
+
+class OutbreakResult:
+    """Final outbreak sizes and epidemic curves of every run"""
+
+    def __init__(self, sizes, incidence, n_users):
+        self.sizes     = sizes        #<--users ever infected, per run (index cases included)
+        self.incidence = incidence    #<--new infections per step, steps x runs
+        self.n_users   = n_users
+
+    def size_distribution(self, bins=20):
+        """Share of runs per outbreak-size bin"""
+        counts, edges = np.histogram(self.sizes, bins=min(bins, max(1, self.n_users)), range=(0, self.n_users))
+        return pd.DataFrame({"size_from": edges[:-1], "size_to": edges[1:], "share": counts/len(self.sizes)})
+
+    def curve_quantiles(self, quantiles=QUANTILES, cumulative=False):
+        """Quantiles over runs of the new (or cumulative) infections at every step"""
+        curves = np.cumsum(self.incidence, axis=0) if cumulative else self.incidence
+        return pd.DataFrame(np.quantile(curves, quantiles, axis=1).T, columns=list(quantiles)).rename_axis("step")
+
+    def summary(self, major=0.1):
+        attack = self.sizes/self.n_users
+        return {"runs": len(self.sizes), "users": self.n_users
+                , "mean_size": float(self.sizes.mean()), "median_size": float(np.median(self.sizes))
+                , "mean_attack_rate": float(attack.mean()), f"p_attack_over_{major:g}": float((attack > major).mean())
+                , "mean_duration": float((np.cumsum(self.incidence[::-1], axis=0) > 0).sum(axis=0).mean())}
+
+
+def simulate(network, runs=10000, model="sir", steps=MAX_STEPS, recovery=RECOVERY_PROBABILITY
+             , incubation=INCUBATION_PROBABILITY, seed_users=None, seed=None, workers=None):
+    """Run `runs` stochastic outbreaks on network and collect them.
+
+    seed_users starts every run from the given users; by default each run starts from one random user.
+    workers=1 runs in this process; otherwise chunks of RUNS_PER_TASK runs go to a process pool.
+    """
+    if model not in ("sir", "seir"):
+        raise ValueError(f"Unknown model {model}")
+    seeds  = None if seed_users is None else network.index(seed_users)
+    chunks = [min(RUNS_PER_TASK, runs - start) for start in range(0, runs, RUNS_PER_TASK)]
+    rngs   = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks  = [(network.adjacency, network.susceptibility, chunk, model, steps, recovery, incubation, seeds, rng)
+              for chunk, rng in zip(chunks, rngs)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = [_simulate(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(_simulate, *zip(*tasks)))
+
+    #--chunks stop as soon as all of their runs died out; pad their curves with zeros
+    length    = max(incidence.shape[0] for _, incidence in results)
+    incidence = np.hstack([np.pad(incidence, ((0, length - incidence.shape[0]), (0, 0))) for _, incidence in results])
+    sizes     = np.concatenate([sizes for sizes, _ in results])
+    return OutbreakResult(sizes, incidence, len(network.users))
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate outbreaks on the WMM contact network")
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--model", choices=["sir", "seir"], default="sir")
+    parser.add_argument("--steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--recovery", type=float, default=RECOVERY_PROBABILITY)
+    parser.add_argument("--incubation", type=float, default=INCUBATION_PROBABILITY)
+    parser.add_argument("--seed-user", action="append", default=None, help="start every run from this user (repeatable)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--data", default=None, help="CSV or Parquet file with the interactions (default: the game's event store)")
+    args = parser.parse_args()
+
+    if args.data is None:
+        import event_log
+        interactions = event_log.get_event_log().read_with_cursor()[0]
+    elif args.data.endswith(".parquet"):
+        interactions = pd.read_parquet(args.data)
+    else:
+        interactions = pd.read_csv(args.data)
+
+    network = ContactNetwork.from_interactions(interactions)
+    start   = time.perf_counter()
+    result  = simulate(network, runs=args.runs, model=args.model, steps=args.steps, recovery=args.recovery
+                       , incubation=args.incubation, seed_users=args.seed_user, seed=args.seed, workers=args.workers)
+    print(f"{args.runs} {args.model.upper()} runs on {len(network.users)} users in {time.perf_counter() - start:.2f}s")
+    print(pd.Series(result.summary()).to_string())
+    print(result.size_distribution().to_string(index=False))
+    print(result.curve_quantiles(cumulative=True).iloc[::7].to_string())
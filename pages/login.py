@@ -1,22 +1,16 @@
 #mcandrew
 
-import sys
-import numpy as np
-import pandas as pd
 import streamlit as st
 
+import prefetch
+import telemetry
 
+
+@telemetry.timed("login.attach_data")
 def attach_WMM_data():
-    AWS_S3_BUCKET = "wmm-2025"
-    AWS_ACCESS_KEY_ID = st.secrets["AWS_ACCESS_KEY_ID"]
-    AWS_SECRET_ACCESS_KEY = st.secrets["AWS_SECRET_ACCESS_KEY"]
-    if 'dataset' not in st.session_state:
-        st.session_state.dataset = pd.read_csv(f"s3://{AWS_S3_BUCKET}/interactions.csv"
-                                              ,storage_options={"key"   : AWS_ACCESS_KEY_ID,"secret": AWS_SECRET_ACCESS_KEY})
-    if 'intervention_group' not in st.session_state:
-        intervention_group = pd.read_csv(f"s3://{AWS_S3_BUCKET}/intervention_group_2025.csv"
-                                                          ,storage_options={"key"   : AWS_ACCESS_KEY_ID,"secret": AWS_SECRET_ACCESS_KEY})
-        st.session_state.intervention_group = intervention_group.username.unique()
+    """Start loading every game artifact in parallel and wait only for the intervention group (needed to log in)"""
+    prefetch.start(seed=st.secrets.get("intervention_seed"))
+    st.session_state.intervention_group = prefetch.get("intervention_group")
 
 
 def page_info():
@@ -46,8 +40,10 @@ def page_info():
             ''')
 
 
+@telemetry.timed("page.login")
 def show():
-    attach_WMM_data()
+    # Timings and counters of this server process (admin_users only)
+    telemetry.debug_panel()
 
     with st.container(border=True):
         col = st.columns(1)
@@ -61,7 +57,9 @@ def show():
                 if username.strip() != "":
                     st.session_state["logged_in"]          = True
                     st.session_state["username"]           = username
-                    
+
+                    #--the game data is fetched only now, so the consent page draws without touching S3
+                    attach_WMM_data()
                     if username in st.session_state.intervention_group:
                         st.session_state.interventionalist = True
                     else:
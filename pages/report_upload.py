@@ -2,53 +2,48 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import os
-import base64
-import boto3
+import prefetch
+import storage
+import telemetry
 from io import BytesIO
 
-def get_s3_client():
-    """Get configured S3 client"""
+def get_store():
+    """Get the shared storage backend"""
     try:
-        AWS_ACCESS_KEY_ID = st.secrets["AWS_ACCESS_KEY_ID"]
-        AWS_SECRET_ACCESS_KEY = st.secrets["AWS_SECRET_ACCESS_KEY"]
-        
-        return boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
+        return storage.get_storage()
     except Exception as e:
         print(f"Error creating S3 client: {str(e)}")
         return None
 
+@telemetry.timed("report_upload.most_recent")
 def show_most_recent_report(username, reports_dir):
     """Display the most recent report submission from all users from S3"""
-    AWS_S3_BUCKET = "wmm-2025"
-    s3_client = get_s3_client()
+    import report_store
+
+    store = get_store()
     
-    if s3_client is None:
+    if store is None:
         return
     
     try:
-        # Read the log file from S3
-        log_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key="reports/report_submissions.csv")
-        log_df = pd.read_csv(BytesIO(log_obj['Body'].read()))
+        # Read the submission index (prefetched at login and cached; the PDF itself is never downloaded by the app)
+        log_df = prefetch.get("report_index", store)
         
         if not log_df.empty:
             # Get the most recent submission from all users
-            log_df = log_df.sort_values('timestamp', ascending=False)
             recent = log_df.iloc[0]
             
             submission_username = recent['username']
             filename = recent['filename']
             filesize = recent['filesize_kb']
             timestamp = recent['timestamp']
-            s3_key = f"reports/{filename}"
             
-            # Try to get the file from S3
+            # The browser fetches the file straight from S3 through short-lived links
             try:
-                pdf_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
-                pdf_data = pdf_obj['Body'].read()
+                download_url  = report_store.download_url(store, recent)
+                preview_url   = report_store.download_url(store, recent, inline=True)
+                thumbnail_url = report_store.thumbnail_url(store, recent)
+                pages         = recent.get('pages')
                 
                 # Display the most recent report
                 with st.container(border=True):
@@ -58,38 +53,35 @@ def show_most_recent_report(username, reports_dir):
                     with col1:
                         st.markdown(f"**File:** {filename}")
                         st.caption(f"Submitted by: **{submission_username}** | Size: {filesize:.2f} KB | Uploaded: {timestamp}")
+                        if pd.notna(pages):
+                            st.caption(f"Pages: {int(pages)}")
                     
                     with col2:
-                        st.download_button(
-                            label="⬇️ Download",
-                            data=pdf_data,
-                            file_name=filename,
-                            mime="application/pdf",
-                            key="download_recent"
-                        )
+                        st.link_button("⬇️ Download", download_url)
+                        st.link_button("👁️ Open", preview_url)
                     
-                    # Display PDF preview
-                    base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-                    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="600" type="application/pdf"></iframe>'
-                    st.markdown(pdf_display, unsafe_allow_html=True)
+                    # Display the first-page thumbnail made at upload time (the PDF itself is opened on request)
+                    if thumbnail_url is not None:
+                        st.image(thumbnail_url, width=report_store.THUMBNAIL_WIDTH)
                 
                 st.markdown("---")
             except Exception as e:
                 print(f"Error loading PDF from S3: {str(e)}")
                 st.warning("Could not load the most recent report.")
                 
-    except s3_client.exceptions.NoSuchKey:
-        # No log file exists yet
-        pass
     except Exception as e:
         print(f"Error reading report log from S3: {str(e)}")
 
+@telemetry.timed("page.report_upload")
 def show():
     # Login gate
     if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
         st.warning("🚫 You must log in first.")
         st.stop()
     
+    # Timings and counters of this server process (admin_users only)
+    telemetry.debug_panel()
+    
     st.title("📄 Report Upload")
     st.markdown("Upload your intervention report as a PDF file.")
     
@@ -126,26 +118,22 @@ def show():
                         filename = f"{username}_{timestamp}.pdf"
                         
                         # Save to S3
-                        AWS_S3_BUCKET = "wmm-2025"
-                        s3_client = get_s3_client()
+                        import report_store
+                        store = get_store()
                         
-                        if s3_client is None:
+                        if store is None:
                             st.error("❌ Could not connect to storage service.")
                             return
                         
-                        # Upload PDF to S3
-                        s3_key = f"reports/{filename}"
-                        s3_client.put_object(
-                            Bucket=AWS_S3_BUCKET,
-                            Key=s3_key,
-                            Body=uploaded_file.getvalue(),
-                            ContentType='application/pdf'
-                        )
+                        # Stream the PDF to S3 under its content hash, with a thumbnail and metadata record
+                        details, duplicate = report_store.upload_report(store, uploaded_file)
                         
+                        if duplicate:
+                            st.info("An identical file was already stored; this submission points to it.")
                         st.success(f"✅ Report successfully uploaded! File saved as: {filename}")
                         
                         # Log the submission (this will also save to S3)
-                        log_submission(username, filename, uploaded_file.size)
+                        log_submission(username, filename, uploaded_file.size, **details)
                         
                     except Exception as e:
                         st.error(f"❌ Error uploading file: {str(e)}")
@@ -156,12 +144,14 @@ def show():
     st.markdown("---")
     show_previous_submissions(username)
 
-def log_submission(username, filename, filesize):
+@telemetry.timed("report_upload.log_submission")
+def log_submission(username, filename, filesize, **details):
     """Log report submission to S3"""
-    AWS_S3_BUCKET = "wmm-2025"
-    s3_client = get_s3_client()
+    import report_store
+
+    store = get_store()
     
-    if s3_client is None:
+    if store is None:
         print("Could not connect to S3 for logging")
         return
     
@@ -170,15 +160,16 @@ def log_submission(username, filename, filesize):
         "username": username,
         "filename": filename,
         "filesize_kb": filesize / 1024,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **details
     }
     
     try:
         # Try to read existing log from S3
-        log_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key="reports/report_submissions.csv")
-        log_df = pd.read_csv(BytesIO(log_obj['Body'].read()))
+        log_obj = store.get(report_store.INDEX_KEY)
+        log_df = pd.read_csv(BytesIO(log_obj.body))
         log_df = pd.concat([log_df, pd.DataFrame([log_entry])], ignore_index=True)
-    except s3_client.exceptions.NoSuchKey:
+    except storage.NotFound:
         # Log file doesn't exist yet, create new one
         log_df = pd.DataFrame([log_entry])
     except Exception as e:
@@ -187,42 +178,44 @@ def log_submission(username, filename, filesize):
     
     # Save updated log to S3
     try:
-        s3_client.put_object(
-            Bucket=AWS_S3_BUCKET,
-            Key="reports/report_submissions.csv",
-            Body=log_df.to_csv(index=False).encode('utf-8'),
-            ContentType='text/csv'
+        store.put(
+            report_store.INDEX_KEY,
+            log_df.to_csv(index=False).encode('utf-8'),
+            content_type='text/csv'
         )
     except Exception as e:
         print(f"Error saving log to S3: {str(e)}")
 
+    report_store.invalidate()
+
+@telemetry.timed("report_upload.previous_submissions")
 def show_previous_submissions(username):
-    """Display all report submissions from all users with download options from S3"""
-    AWS_S3_BUCKET = "wmm-2025"
-    s3_client = get_s3_client()
+    """Display report submissions from all users, one page at a time, with download links"""
+    import report_store
+
+    store = get_store()
     
-    if s3_client is None:
+    if store is None:
         st.info("Could not connect to storage service.")
         return
     
     try:
-        # Read the log file from S3
-        log_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key="reports/report_submissions.csv")
-        log_df = pd.read_csv(BytesIO(log_obj['Body'].read()))
-        
-        # Sort by timestamp, most recent first
-        log_df = log_df.sort_values('timestamp', ascending=False)
+        # Read the submission index (most recent first)
+        log_df = prefetch.get("report_index", store)
         
         if not log_df.empty:
             st.subheader("📋 All Submissions")
             
-            # Display each submission with a download button
-            for idx, row in log_df.iterrows():
+            pages = report_store.page_count(log_df)
+            number = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key="submissions_page")
+            rows = report_store.page(log_df, number - 1)
+            
+            # Display each submission on this page with a download link
+            for idx, row in rows.iterrows():
                 submission_username = row['username']
                 filename = row['filename']
                 filesize = row['filesize_kb']
                 timestamp = row['timestamp']
-                s3_key = f"reports/{filename}"
                 
                 # Create a container for each submission
                 with st.container(border=True):
@@ -233,25 +226,13 @@ def show_previous_submissions(username):
                         st.caption(f"Submitted by: **{submission_username}** | Size: {filesize:.2f} KB | Uploaded: {timestamp}")
                     
                     with col2:
-                        # Try to get file from S3
                         try:
-                            pdf_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
-                            pdf_data = pdf_obj['Body'].read()
-                            
-                            st.download_button(
-                                label="⬇️ Download",
-                                data=pdf_data,
-                                file_name=filename,
-                                mime="application/pdf",
-                                key=f"download_{idx}"
-                            )
+                            st.link_button("⬇️ Download", report_store.download_url(store, row))
                         except Exception as e:
-                            print(f"Error loading file {filename}: {str(e)}")
+                            print(f"Error creating download link for {filename}: {str(e)}")
                             st.warning("File not found")
         else:
             st.info("No submissions found.")
-    except s3_client.exceptions.NoSuchKey:
-        st.info("No submissions found.")
     except Exception as e:
         print(f"Error reading submissions: {str(e)}")
         st.info("No submissions found.")
@@ -0,0 +1,69 @@
+#mcandrew
+
+import streamlit as st
+import pandas as pd
+
+import prefetch
+import telemetry
+
+TOP_N = 10   #<--rows shown by default (leaderboard.TOP_K at most)
+
+
+@telemetry.timed("top_spreaders.table")
+def leaderboard_table(metric, n):
+    """The top n spreaders on metric, with their names and all three counters"""
+    import leaderboard
+    import usernames
+
+    # The leaderboard is shared by all sessions and only new events are applied to it
+    board = leaderboard.get_leaderboard(st.session_state["dataset"])
+    top   = board.top(metric, n)
+
+    table = pd.DataFrame({"User": usernames.decode(top["user"])})
+    for column in leaderboard.METRICS:
+        table[leaderboard.METRICS[column]] = top[column]
+    table.index = pd.RangeIndex(1, len(table) + 1, name="Rank")
+    return table
+
+def spreaders():
+    import leaderboard
+
+    st.title('Top Spreaders')
+    st.markdown('The players whose infections spread the furthest.')
+
+    metric = st.segmented_control("Rank by", options=list(leaderboard.METRICS), format_func=leaderboard.METRICS.get
+                                  , default="descendants")
+    n      = st.slider("Players shown", min_value=1, max_value=leaderboard.TOP_K, value=TOP_N)
+
+    table = leaderboard_table(metric or "descendants", n)
+    if table.empty:
+        st.info("No infections recorded yet.")
+        return
+    st.dataframe(table, use_container_width=True)
+    st.caption('"Infections led to" counts everyone infected down the chains a player started, directly or not.')
+
+@telemetry.timed("page.top_spreaders")
+def show():
+    #--LOGIN GATE
+    if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
+        st.warning("🚫 You must log in first.")
+        st.stop()   # Prevents rest of the page from rendering
+
+    # Timings and counters of this server process (admin_users only)
+    telemetry.debug_panel()
+
+    try:
+        # Joins the login prefetch if it is still running, otherwise reads the process-wide cache
+        st.session_state.dataset, _, st.session_state.dataset_version = prefetch.get("interactions")
+    except Exception as e:
+        print(f"Warning: Failed to refresh data from S3: {str(e)}")
+
+    if st.session_state.get("dataset") is None:
+        st.error("The game data could not be loaded. Please try again in a moment.")
+        return
+
+    with st.container(border=True):
+        spreaders()
+
+if __name__ == "__main__":
+    show()
@@ -6,122 +6,105 @@ import pandas as pd
 import random
 from datetime import datetime, timedelta
 
-def contact_network():
-    from pyvis.network import Network
-    import networkx as nx
-    
-    # Create a local copy to avoid modifying session state
-    interactions = st.session_state["dataset"].copy()
-
-    # Create a directed graph from the dataset
-    G = nx.DiGraph()
-    for _, row in interactions.iterrows():
-        if row.Actor not in G.nodes:
-            if row.infection_intervention and row.success:
-                G.add_node(row.Actor, infected=1)
-            elif row.infection_intervention and not row.success:
-                G.add_node(row.Actor, infected=2)
-            else:
-                G.add_node(row.Actor, infected=0)
+import telemetry
 
-        if row.Audience not in G.nodes or row.infection_intervention:
-            if row.infection_intervention and row.success:
-                G.add_node(row.Audience, infected=1)
-            elif row.infection_intervention and not row.success:
-                G.add_node(row.Audience, infected=2)
-            else:
-                G.add_node(row.Audience, infected=0)
-        G.add_edge(row['Actor'], row['Audience'])
-
-        # Set background to white and default node color to black
-        net = Network(height='740px', width='100%', bgcolor='white', font_color='black', directed=True)
+SEARCH_DEPTH     = 2     #<--generations below the searched user shown by default
+MAX_SEARCH_DEPTH = 10
+MAX_SEARCH_NODES = 500   #<--descendants drawn at most (the counts above the graph are always complete)
 
-        for node in G.nodes:
-            if G.nodes[node]["infected"] == 2:
-                color = "gray"
-            elif G.nodes[node]["infected"] == 1:
-                color = "red"
-            else:
-                color = "blue"
-            net.add_node(node, label=node, color=color)
 
-        for edge in G.edges:
-            net.add_edge(edge[0], edge[1], width=2, color = "black")
+@telemetry.timed("visual.contact_network")
+def contact_network():
+    import contact_graph
+    
+    interactions = st.session_state.get("dataset", pd.DataFrame())
+    
+    if interactions.empty:
+        st.warning("No data available yet.")
+        return
+    
+    # The graph is shared by all sessions and only new events are applied to it
+    graph = contact_graph.get_contact_graph(interactions)
 
-    net.save_graph('network.html')
+    # Large games start at a lower level of detail (big fan-outs and small clusters are collapsed)
+    detail   = st.toggle("Show every node", value=graph.G.number_of_nodes() <= 500)
+    expanded = []
+    if not detail:
+        groups   = graph.aggregates()
+        expanded = st.multiselect("Expand collapsed groups", options=list(groups), format_func=lambda group: groups[group][0])
 
-    HtmlFile = open('network.html', 'r', encoding='utf-8')
-    source_code = HtmlFile.read()
-    st.components.v1.html(source_code, height=750)
+    st.components.v1.html(graph.network_html(height='740px', detail=detail, expanded=expanded), height=750)
 
-    return G
+    return graph
 
-def search_user(search_username=None, G=None):
-    """Search for a user and display their infection subgraph"""
+@telemetry.timed("visual.search_user")
+def search_user(search_username=None, depth=SEARCH_DEPTH):
+    """Search for a user and display their chain of infection and their descendants up to depth generations"""
     from pyvis.network import Network
     
-    if not search_username or G is None:
+    if not search_username:
         return
     
-    # Get the dataset
-    interactions = st.session_state["dataset"].copy()
+    import transmission
+    import usernames
     
-    # Check if user exists in the network
-    if search_username not in G.nodes:
-        st.warning(f"User '{search_username}' not found in the network.")
-        return
+    interactions = st.session_state.get("dataset", pd.DataFrame())
     
-    # Find primary contacts (nodes infected by the searched user)
-    primary_contacts = [node for node in G.successors(search_username)]
+    if interactions.empty:
+        st.warning("No data available yet.")
+        return
     
-    # Find secondary contacts (nodes infected by primary contacts)
-    secondary_contacts = [neighbor for p in primary_contacts for neighbor in G.successors(p) if neighbor != search_username]
+    # The transmission tree is shared by all sessions and answers in time proportional to what is shown
+    index = transmission.get_transmission(interactions)
+    user  = usernames.lookup(search_username)
+    if not index.in_tree(user):
+        st.warning(f"User '{search_username}' has not infected anyone and has not been infected.")
+        return
     
-    # Create subgraph
-    subgraph_nodes = set([search_username] + primary_contacts + secondary_contacts)
-    subgraph = G.subgraph(subgraph_nodes)
+    ancestry    = index.ancestry(user)
+    descendants = index.descendants_within(user, depth=depth, limit=MAX_SEARCH_NODES)
+    names       = usernames.get_dictionary()
     
     # Calculate statistics
-    infected_count = len(primary_contacts)
-    infection_data = interactions[
-        (interactions['Actor'] == search_username) & 
-        (interactions['infection_intervention'] == 1) & 
-        (interactions['success'] == 1)
-    ]
-    first_infection = infection_data['timestamp'].min() if not infection_data.empty else "No infections"
+    first_infection = index.first_infection_by(user)
+    first_infection = "No infections" if first_infection is None else first_infection
+    infected_at     = index.infected_at(user)
     
     st.markdown(f"**User: {search_username}**")
-    st.markdown(f"- Number of people directly infected: **{infected_count}**")
+    st.markdown(f"- Number of people directly infected: **{index.direct_infections(user)}**")
+    st.markdown(f"- Infections they led to (all generations): **{index.subtree_size(user)}**")
     st.markdown(f"- First infection date: **{first_infection}**")
+    if infected_at is None:
+        st.markdown("- Infected by: **nobody (index case)**")
+    else:
+        chain = " ← ".join(names.name(node) for node in ancestry)
+        st.markdown(f"- Infected on **{infected_at}**, generation **{int(index.depth[user])}**: {search_username} ← {chain}")
+    if len(descendants) == MAX_SEARCH_NODES:
+        st.caption(f"Showing the first {MAX_SEARCH_NODES} descendants.")
     
-    # Create visualization
+    # Create visualization (names are decoded only for display)
     net = Network(height='500px', width='100%', bgcolor='white', font_color='black', directed=True)
     
-    # Add nodes with colors
-    for node in subgraph.nodes:
-        if node == search_username:
-            color = 'blue'
-        elif node in primary_contacts:
-            color = 'red'
-        else:
-            color = 'gray'
-        net.add_node(node, label=node, color=color)
-    
-    # Add edges
-    for edge in subgraph.edges:
-        net.add_edge(edge[0], edge[1], width=2, color='black')
+    net.add_node(user, label=search_username, color='blue')
+    for node in ancestry:
+        net.add_node(node, label=names.name(node), color='orange')
+    for node, level in descendants:
+        net.add_node(node, label=names.name(node), color='red' if level == 1 else 'gray')
     
-    # Save and display
-    net.save_graph('subgraph.html')
+    # Add edges (infector -> infectee)
+    chain = [user] + ancestry
+    for infectee, infector in zip(chain[:-1], chain[1:]):
+        net.add_edge(infector, infectee, width=2, color='black')
+    for node, _ in descendants:
+        net.add_edge(int(index.parent[node]), node, width=2, color='black')
     
-    HtmlFile = open('subgraph.html', 'r', encoding='utf-8')
-    source_code = HtmlFile.read()
-    st.components.v1.html(source_code, height=520)
+    st.components.v1.html(net.generate_html(), height=520)
     
     st.markdown("**Color Coding in the Subgraph:**")
     st.markdown("- **Blue**: The searched user")
-    st.markdown("- **Red**: Users directly infected by the searched user (primary contacts)")
-    st.markdown("- **Gray**: Users infected by the primary contacts (secondary contacts)")
+    st.markdown("- **Orange**: Who infected the searched user, back to the index case")
+    st.markdown("- **Red**: Users directly infected by the searched user")
+    st.markdown("- **Gray**: Users infected further down the chain, up to the chosen depth")
     
 def display_data():
     st.markdown("### Data Dictionary")
@@ -135,56 +118,61 @@ def display_data():
     - **intervention_type**: The specific type of intervention applied (-1 for infections)
     - **timestamp**: Date and time when the event occurred
     """)
-    st.dataframe(st.session_state.dataset)
+    interactions = st.session_state.get("dataset", pd.DataFrame())
+    
+    if interactions.empty:
+        st.warning("No data available yet.")
+        return
+    
+    st.dataframe(interactions)
 
+@telemetry.timed("visual.cumulative_plots")
 def show_cumulative_plots():
     """Display cumulative infection and intervention plots"""
     import plotly.graph_objects as go
-    import plotly.express as px
+    import incidence
     
-    # Get the dataset and create a local copy to avoid modifying session state
-    interactions = st.session_state.get("dataset", pd.DataFrame()).copy()
+    interactions = st.session_state.get("dataset", pd.DataFrame())
     
     if interactions.empty:
         st.warning("No data available yet.")
         return
     
-    # Convert timestamp to datetime (local copy only)
-    interactions['datetime'] = pd.to_datetime(interactions['timestamp'])
-    interactions['hour'] = interactions['datetime'].dt.floor('H')  # Round to nearest hour
+    #--Counts per minute are kept up to date incrementally; hours and days are sums of them
+    aggregator = incidence.get_incidence(interactions)
+    resolution = st.radio("Resolution", ["minute", "hour", "day"], index=1, horizontal=True)
+    counts     = aggregator.incidence(resolution)
+    cumulative = counts.cumsum()
+    label      = f"Time ({resolution.capitalize()})"
+    
+    # Infections and contact attempts in the last 24 hours
+    last_day = aggregator.rolling(24, "hour").iloc[-1]
+    metric1, metric2 = st.columns(2)
+    metric1.metric("Infections in the last 24 hours of play", int(last_day[incidence.INFECTIONS]))
+    metric2.metric("Infection attempts in the last 24 hours of play", int(last_day[incidence.CONTACT_ATTEMPTS]))
     
     # Create two columns for the visualizations
     col1, col2 = st.columns(2)
     
-    # Column 1: Cumulative Infections Over Time (per hour)
+    # Column 1: Cumulative Infections Over Time
     with col1:
         st.subheader("📊 Cumulative Infections Over Time")
         
-        # Filter for successful infections (infection_intervention=1 and success=1)
-        successful_infections = interactions[
-            (interactions['infection_intervention'] == 1) & 
-            (interactions['success'] == 1)
-        ].copy()
+        # Only bins in which an infection happened are drawn
+        active = counts[incidence.INFECTIONS] > 0
         
-        if not successful_infections.empty:
-            # Group by hour and count infections
-            infections_per_hour = successful_infections.groupby('hour').size().reset_index(name='count')
-            infections_per_hour = infections_per_hour.sort_values('hour')
-            
-            # Calculate cumulative sum
-            infections_per_hour['cumulative'] = infections_per_hour['count'].cumsum()
-            
+        if active.any():
             # Create bar chart using plotly
             fig = go.Figure()
             fig.add_trace(go.Bar(
-                x=infections_per_hour['hour'],
-                y=infections_per_hour['cumulative'],
+                x=cumulative.index[active],
+                y=cumulative.loc[active, incidence.INFECTIONS],
                 marker_color='black',
                 name='Cumulative Infections'
             ))
             
             fig.update_layout(
-                xaxis_title="Time (Hour)",
+                xaxis_title=label,
                 yaxis_title="Cumulative Infections",
                 showlegend=False,
                 height=400
@@ -198,60 +186,123 @@ def show_cumulative_plots():
     with col2:
         st.subheader("📈 Cumulative Interventions Over Time")
         
-        # Filter for interventions (infection_intervention=0)
-        interventions_only = interactions[interactions['infection_intervention'] == 0].copy()
+        intervention_types = [it for it in aggregator.intervention_types() if pd.notna(it)]
         
-        if not interventions_only.empty:
-            # Get unique intervention types
-            intervention_types = interventions_only['intervention_type'].unique()
-            intervention_types = [it for it in intervention_types if pd.notna(it)]
+        if intervention_types:
+            # Create figure
+            fig = go.Figure()
             
-            if intervention_types:
-                # Create figure
-                fig = go.Figure()
-                
-                # Add a trace for each intervention type
-                for intervention_type in intervention_types:
-                    # Filter for this specific intervention type
-                    type_data = interventions_only[
-                        interventions_only['intervention_type'] == intervention_type
-                    ].copy()
-                    
-                    # Group by hour and count interventions
-                    interventions_per_hour = type_data.groupby('hour').size().reset_index(name='count')
-                    interventions_per_hour = interventions_per_hour.sort_values('hour')
-                    
-                    # Calculate cumulative sum
-                    interventions_per_hour['cumulative'] = interventions_per_hour['count'].cumsum()
-                    
-                    # Add scatter + line trace
-                    fig.add_trace(go.Scatter(
-                        x=interventions_per_hour['hour'],
-                        y=interventions_per_hour['cumulative'],
-                        mode='lines+markers',
-                        name=str(intervention_type),
-                        line=dict(width=2),
-                        marker=dict(size=8)
-                    ))
-                
-                fig.update_layout(
-                    xaxis_title="Time (Hour)",
-                    yaxis_title="Cumulative Interventions",
-                    showlegend=True,
-                    legend=dict(
-                        yanchor="top",
-                        y=0.99,
-                        xanchor="left",
-                        x=0.01
-                    ),
-                    height=400
-                )
+            # Add a trace for each intervention type
+            for intervention_type in intervention_types:
+                active = counts[intervention_type] > 0
                 
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No valid intervention types found.")
+                # Add scatter + line trace
+                fig.add_trace(go.Scatter(
+                    x=cumulative.index[active],
+                    y=cumulative.loc[active, intervention_type],
+                    mode='lines+markers',
+                    name=str(intervention_type),
+                    line=dict(width=2),
+                    marker=dict(size=8)
+                ))
+            
+            fig.update_layout(
+                xaxis_title=label,
+                yaxis_title="Cumulative Interventions",
+                showlegend=True,
+                legend=dict(
+                    yanchor="top",
+                    y=0.99,
+                    xanchor="left",
+                    x=0.01
+                ),
+                height=400
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No interventions recorded yet.")
+    
+    show_reproduction_panel(interactions, resolution)
+
+@telemetry.timed("visual.reproduction")
+def show_reproduction_panel(interactions, resolution="day"):
+    """Display R(t) and the generation intervals next to the cumulative plots"""
+    import plotly.graph_objects as go
+    import reproduction
+    
+    #--Infection times, infectors and secondary cases are kept up to date incrementally
+    analytics = reproduction.get_reproduction(interactions)
+    summary   = analytics.summary()
+    
+    if summary["cases"] == 0:
+        return
+    
+    metric1, metric2 = st.columns(2)
+    metric1.metric("Mean secondary cases per case", f"{summary['mean_secondary_cases']:.2f}")
+    metric2.metric("Median generation interval (hours)", "-" if pd.isna(summary["median_generation_interval_hours"]) else f"{summary['median_generation_interval_hours']:.1f}")
+    
+    col1, col2 = st.columns(2)
+    
+    # Column 1: R(t) with its credible interval
+    with col1:
+        st.subheader("🔁 Reproduction Number R(t)")
+        window = st.slider("Pool over bins", min_value=1, max_value=14, value=1)
+        rt     = analytics.reproduction_number(resolution, window=window).dropna()
+        
+        if len(rt):
+            fig = go.Figure()
+            fig.add_trace(go.Scatter(
+                x=list(rt.index) + list(rt.index[::-1]),
+                y=list(rt["upper"]) + list(rt["lower"][::-1]),
+                fill='toself',
+                fillcolor='rgba(0,0,0,0.15)',
+                line=dict(width=0),
+                name=f"{int(reproduction.LEVEL*100)}% credible interval"
+            ))
+            fig.add_trace(go.Scatter(
+                x=rt.index,
+                y=rt["mean"],
+                mode='lines+markers',
+                line=dict(color='black', width=2),
+                name='R(t)'
+            ))
+            fig.add_hline(y=1, line_dash="dash")
+            
+            fig.update_layout(
+                xaxis_title=f"Infection time of the infector ({resolution.capitalize()})",
+                yaxis_title="R(t)",
+                showlegend=False,
+                height=400
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption("Recent values are low until the latest cases have had time to infect others.")
+        else:
+            st.info("No infections with a known infection time yet.")
+    
+    # Column 2: time from the infector's infection to the infectee's infection
+    with col2:
+        st.subheader("⏱️ Generation Intervals")
+        intervals = analytics.generation_intervals()
+        
+        if len(intervals):
+            fig = go.Figure()
+            fig.add_trace(go.Histogram(
+                x=intervals["interval"].dt.total_seconds()/3600.,
+                marker_color='black'
+            ))
+            
+            fig.update_layout(
+                xaxis_title="Hours between infections",
+                yaxis_title="Infections",
+                showlegend=False,
+                height=400
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No chains of infection recorded yet.")
 
 def infection_viz():
     st.title('Intervention Analytics Dashboard')
@@ -265,11 +316,12 @@ def infection_viz():
     # Then show the contact network
     st.title('Contact Network')
     st.markdown('Visualize how people have infected each other within Lehigh University.')
-    G = contact_network()
+    contact_network()
 
     with st.expander("### Search for a User"):
-        user = st.text_input("Enter a username to see their infection details")
-        search_user(user, G)
+        user  = st.text_input("Enter a username to see their infection details")
+        depth = st.slider("Generations of infections to show", min_value=1, max_value=MAX_SEARCH_DEPTH, value=SEARCH_DEPTH)
+        search_user(user, depth)
 
     with st.expander("See data that generated this network"):
         display_data()
@@ -281,36 +333,29 @@ def intervention_viz():
     # Show the cumulative plots
     show_cumulative_plots()
 
+@telemetry.timed("visual.refresh")
 def refresh_data_from_s3():
     """Refresh the dataset from S3 to get the latest data"""
     try:
-        import boto3
-        from io import BytesIO
-        
-        AWS_S3_BUCKET = "wmm-2025"
-        AWS_ACCESS_KEY_ID = st.secrets["AWS_ACCESS_KEY_ID"]
-        AWS_SECRET_ACCESS_KEY = st.secrets["AWS_SECRET_ACCESS_KEY"]
+        import prefetch
         
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-        
-        # Read the latest data from S3
-        s3_obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key="interactions.csv")
-        st.session_state.dataset = pd.read_csv(BytesIO(s3_obj['Body'].read()))
+        # Joins the login prefetch if it is still running, otherwise reads the process-wide cache (only re-downloads what changed in S3)
+        st.session_state.dataset, _, st.session_state.dataset_version = prefetch.get("interactions")
         
     except Exception as e:
         print(f"Warning: Failed to refresh data from S3: {str(e)}")
         # If refresh fails, continue with existing session data
 
+@telemetry.timed("page.visual")
 def show():
     #--LOGIN GATE
     if "logged_in" not in st.session_state or not st.session_state["logged_in"]:
         st.warning("🚫 You must log in first.")
         st.stop()   # Prevents rest of the page from rendering
     
+    # Timings and counters of this server process (admin_users only)
+    telemetry.debug_panel()
+    
     # Refresh data from S3 to get the latest updates
     refresh_data_from_s3()
     
@@ -0,0 +1,112 @@
+#mcandrew
+
+"""Concurrent prefetch of the game's artifacts, shared by all sessions.
+
+When someone logs in, everything the pages will read is loaded at the same time
+on a small thread pool: the interactions, the intervention group, the
+intervention catalog (and its fitted model) and the report index. Logging in
+therefore costs the slowest of these fetches, not their sum.
+
+Pages read an artifact with get(name). If a prefetch of that artifact is still
+running, get waits for it instead of starting a second download. Otherwise the
+artifact comes from its process-wide cache (interactions_cache, intervention_model,
+report_store, or the group cache here), which revalidates it against storage.
+
+    prefetch.start(seed=st.secrets.get("intervention_seed"))
+    group = prefetch.get("intervention_group")
+"""
+
+import time
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import telemetry
+
+ARTIFACTS = ["interactions", "intervention_group", "intervention_model", "report_index"]
+
+GROUP_KEY                = "intervention_group_2025.csv"
+GROUP_REVALIDATE_SECONDS = 60.   #<--at most one HEAD on the group file per interval
+
+_lock     = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=len(ARTIFACTS), thread_name_prefix="prefetch")
+_inflight = {}   #<--artifact -> Future of its latest prefetch
+_group    = {"etag": None, "members": None, "checked_at": 0., "store": None}
+
+
+def get_intervention_group(store, max_age=GROUP_REVALIDATE_SECONDS):
+    """Usernames in the intervention group (a frozenset), downloaded again only when the file changes"""
+    with _lock:
+        members = _group["members"]
+        now     = time.time()
+        if members is not None and _group["store"] == store.name and now - _group["checked_at"] < max_age:
+            telemetry.count("cache.intervention_group.hit")
+            return members
+        etag = None if members is None or _group["store"] != store.name else _group["etag"]
+
+    #--download outside the lock so the other artifacts are not held up
+    if etag is None or store.head(GROUP_KEY).etag != etag:
+        import pandas as pd
+
+        telemetry.count("cache.intervention_group.miss")
+        group_obj = store.get(GROUP_KEY)
+        members   = frozenset(pd.read_csv(BytesIO(group_obj.body), usecols=["username"]).username.astype(str))
+        etag      = group_obj.etag
+    else:
+        telemetry.count("cache.intervention_group.revalidated")
+    with _lock:
+        _group.update(etag=etag, members=members, checked_at=now, store=store.name)
+    return members
+
+
+def _load(name, store, events, seed):
+    if name == "interactions":
+        import interactions_cache
+        return interactions_cache.get_interactions(events)   #<--(dataset, cursor, version)
+    if name == "intervention_group":
+        return get_intervention_group(store)
+    if name == "intervention_model":
+        import intervention_model
+        return intervention_model.get_model(store, seed=seed)
+    if name == "report_index":
+        import report_store
+        return report_store.get_index(store)
+    raise KeyError(f"Unknown artifact {name}")
+
+
+def _prefetch(name, store, events, seed):
+    with telemetry.span("prefetch." + name):
+        return _load(name, store, events, seed)
+
+
+def _backends(store, events):
+    import event_log
+    store = store if store is not None else storage.get_storage()
+    return store, events if events is not None else event_log.get_event_log()
+
+
+def start(names=ARTIFACTS, store=None, events=None, seed=None):
+    """Begin loading the artifacts in the background and return their futures (a running prefetch is reused)"""
+    #--backends are resolved here, on the session's thread, where st.secrets is available
+    store, events = _backends(store, events)
+    with _lock:
+        for name in names:
+            future = _inflight.get(name)
+            if future is None or future.done():
+                _inflight[name] = _executor.submit(_prefetch, name, store, events, seed)
+        return {name: _inflight[name] for name in names}
+
+
+def get(name, store=None, events=None, seed=None, timeout=None):
+    """The artifact: the result of its running prefetch, otherwise read through its cache"""
+    with _lock:
+        future = _inflight.get(name)
+    if future is not None and not future.done():
+        telemetry.count("prefetch.joined")
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            print(f"Warning: Prefetch of {name} failed, loading it again: {str(e)}")
+    store, events = _backends(store, events)
+    return _load(name, store, events, seed)
@@ -0,0 +1,199 @@
+#mcandrew
+
+"""Report submissions: the submission index, the stored PDFs and their previews.
+
+Pages are rendered from the index (reports/report_submissions.csv) alone.
+The index is cached per process and downloaded again only when its ETag
+changes. PDFs are never read by the app: the browser downloads them directly
+from storage through short-lived presigned URLs, built only for the rows on screen.
+
+Uploads are stored by content hash (identical files are stored once) and
+streamed to storage, in parts for large files. A first-page thumbnail and a small
+metadata record are written next to each PDF when it is uploaded.
+"""
+
+import json
+import time
+import hashlib
+import threading
+from io import BytesIO
+
+import pandas as pd
+
+import storage
+import telemetry
+
+REPORT_PREFIX = "reports/"
+OBJECT_PREFIX = "reports/objects/"   #<--content-addressed PDFs and their previews: <sha256>.pdf/.png/.json
+INDEX_KEY     = "reports/report_submissions.csv"
+INDEX_COLUMNS = ["username", "filename", "filesize_kb", "timestamp", "sha256", "pages", "thumbnail"]
+
+CHUNK_SIZE      = 8*1024*1024   #<--hashing chunk
+THUMBNAIL_WIDTH = 320           #<--pixels
+
+PAGE_SIZE          = 10
+PRESIGN_SECONDS    = 900   #<--lifetime of a download link
+REVALIDATE_SECONDS = 5.    #<--at most one HEAD on the index per interval
+
+_lock  = threading.Lock()
+_index = {"etag": None, "index": None, "checked_at": 0., "store": None}
+
+
+def report_key(filename):
+    return f"{REPORT_PREFIX}{filename}"
+
+
+def object_key(sha256, suffix):
+    return f"{OBJECT_PREFIX}{sha256}{suffix}"
+
+
+def _has_sha(row):
+    sha256 = row.get("sha256")
+    return isinstance(sha256, str) and len(sha256) > 0
+
+
+def pdf_key(row):
+    """Key of a submission's PDF (submissions from before content addressing are stored by filename)"""
+    return object_key(row["sha256"], ".pdf") if _has_sha(row) else report_key(row["filename"])
+
+
+def thumbnail_key(row):
+    """Key of a submission's first-page thumbnail (None if it has none)"""
+    return object_key(row["sha256"], ".png") if _has_sha(row) and row.get("thumbnail") in (True, 1, "True") else None
+
+
+def _empty_index():
+    return pd.DataFrame(columns=INDEX_COLUMNS)
+
+
+def parse_index(body):
+    """Submission index from the bytes of report_submissions.csv, most recent first"""
+    index = pd.read_csv(BytesIO(body))
+    return index.sort_values('timestamp', ascending=False, kind="stable").reset_index(drop=True)
+
+
+def get_index(store, max_age=REVALIDATE_SECONDS):
+    """Submission index, most recent first (empty if nothing was submitted yet)"""
+    with _lock:
+        now = time.time()
+        if _index["index"] is not None and _index["store"] == store.name and now - _index["checked_at"] < max_age:
+            telemetry.count("cache.report_index.hit")
+            return _index["index"]
+
+        try:
+            etag = store.head(INDEX_KEY).etag
+        except storage.NotFound:
+            etag = None
+
+        if etag is None:
+            index = _empty_index()
+        elif etag == _index["etag"] and _index["store"] == store.name:
+            telemetry.count("cache.report_index.revalidated")
+            index = _index["index"]
+        else:
+            telemetry.count("cache.report_index.miss")
+            index_obj = store.get(INDEX_KEY)
+            etag      = index_obj.etag
+            with telemetry.span("report_store.parse_index"):
+                index = parse_index(index_obj.body)
+        _index.update(etag=etag, index=index, checked_at=now, store=store.name)
+        return index
+
+
+def invalidate():
+    """Revalidate the index on the next read (after this process changed it)"""
+    with _lock:
+        _index["checked_at"] = 0.
+
+
+def page_count(index, page_size=PAGE_SIZE):
+    return max(1, -(-len(index)//page_size))
+
+
+def page(index, number, page_size=PAGE_SIZE):
+    """Rows of page `number` (0-based)"""
+    number = min(max(number, 0), page_count(index, page_size) - 1)
+    return index.iloc[number*page_size:(number + 1)*page_size]
+
+
+def download_url(store, row, inline=False, expires=PRESIGN_SECONDS):
+    """Presigned GET for a submission's PDF; inline=True lets the browser display it instead of saving it"""
+    filename    = row["filename"]
+    disposition = "inline" if inline else f'attachment; filename="{filename}"'
+    return store.url(pdf_key(row), expires=expires, content_type="application/pdf", disposition=disposition)
+
+
+def thumbnail_url(store, row, expires=PRESIGN_SECONDS):
+    key = thumbnail_key(row)
+    return None if key is None else store.url(key, expires=expires)
+
+
+#--Uploads-----------------------------------------------------------------------------------------------------------------
+def content_hash(fileobj):
+    """sha256 of a seekable file, read in chunks"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def describe_pdf(fileobj):
+    """Metadata record and first-page PNG thumbnail (None without PyMuPDF or for an unreadable PDF)"""
+    try:
+        import pymupdf
+    except ImportError:
+        return {}, None
+
+    try:
+        fileobj.seek(0)
+        with pymupdf.open(stream=fileobj.read(), filetype="pdf") as document:
+            first     = document[0]
+            zoom      = THUMBNAIL_WIDTH/first.rect.width
+            thumbnail = first.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).tobytes("png")
+            metadata  = {"pages": document.page_count, "title": (document.metadata or {}).get("title") or ""}
+        return metadata, thumbnail
+    except Exception as e:
+        print(f"Warning: Could not build a preview of the report: {str(e)}")
+        return {}, None
+    finally:
+        fileobj.seek(0)
+
+
+def _exists(store, key):
+    try:
+        store.head(key)
+        return True
+    except storage.NotFound:
+        return False
+
+
+@telemetry.timed("report_store.upload")
+def upload_report(store, fileobj):
+    """Store a PDF by content hash with its preview artifacts.
+
+    Returns the index columns describing the stored file and whether an identical file was already stored.
+    """
+    sha256 = content_hash(fileobj)
+    key    = object_key(sha256, ".pdf")
+
+    if _exists(store, key):
+        try:
+            record = json.loads(store.get(object_key(sha256, ".json")).body)
+        except Exception as e:
+            print(f"Warning: Could not read the metadata of {key}: {str(e)}")
+            record = {}
+        return {"sha256": sha256, "pages": record.get("pages"), "thumbnail": bool(record.get("thumbnail"))}, True
+
+    #--previews first: the upload closes the file when it is done
+    metadata, thumbnail = describe_pdf(fileobj)
+
+    #--streamed, in parts for large files
+    store.upload(key, fileobj, content_type="application/pdf")
+
+    if thumbnail is not None:
+        store.put(object_key(sha256, ".png"), thumbnail, content_type="image/png")
+    record = dict(metadata, sha256=sha256, thumbnail=thumbnail is not None)
+    store.put(object_key(sha256, ".json"), json.dumps(record).encode("utf-8"), content_type="application/json")
+    return {"sha256": sha256, "pages": metadata.get("pages"), "thumbnail": thumbnail is not None}, False
@@ -0,0 +1,148 @@
+#mcandrew
+
+"""Reproduction numbers and generation intervals from the interaction log.
+
+Every successful infection records who infected whom and when, so each
+infection can be joined to its infector's own infection time. Infection times
+and infectors are those of the shared transmission tree (transmission.py);
+this module listens to it and keeps only the number of secondary cases per
+user ID. Queries are vectorized joins over those arrays, cached until the
+next event arrives.
+
+R(t) is the case reproduction number by infection time of the infector: the
+mean number of secondary cases of users infected in a bin. It uses the
+Gamma-Poisson posterior of Cori et al. (2013), which gives a credible interval.
+Recent bins are right-censored, because their cases can still infect others.
+"""
+
+import numpy as np
+import pandas as pd
+
+import transmission
+import usernames
+from incidence import RESOLUTIONS, NS_PER_MINUTE
+
+NOT_INFECTED = transmission.NOT_INFECTED
+PRIOR_SHAPE  = 1.    #<--Gamma prior on R with mean 5 and sd 5 (Cori et al.)
+PRIOR_SCALE  = 5.
+LEVEL        = 0.95  #<--credible level of the R(t) interval
+
+
+class ReproductionAnalytics:
+    """Secondary-case count of every user, updated by the shared transmission tree after each batch it applies"""
+
+    def __init__(self, index):
+        self.index = index
+        self.lock  = index.lock   #<--updates run inside the tree's sync
+        self.reset()
+        index.listen(self)
+
+    def reset(self):
+        self.offspring = np.zeros(0, dtype=np.int64)   #<--by user ID (usernames.py)
+        self._results  = {}     #<--query results for the current cursor
+
+    def update(self, events, linked, credited, added):
+        """Count the infections the tree linked to their infector"""
+        if len(self.index.parent) > len(self.offspring):
+            self.offspring = np.concatenate([self.offspring, np.zeros(len(self.index.parent) - len(self.offspring), dtype=np.int64)])
+        self.offspring += np.bincount(linked, minlength=len(self.offspring))
+        self._results = {}
+
+    @property
+    def infection_time(self):
+        return self.index.infection_time   #<--ns since the epoch, first infection only
+
+    @property
+    def infector(self):
+        return self.index.parent
+
+    def _cached(self, key, compute):
+        with self.lock:
+            if key not in self._results:
+                self._results[key] = compute()
+            return self._results[key]
+
+    #--Queries------------------------------------------------------------------------------------------------------------
+    def _cases(self):
+        """IDs of users who were infected or infected someone (index cases have no infection time)"""
+        return np.flatnonzero((self.infection_time != NOT_INFECTED) | (self.offspring > 0))
+
+    def generation_intervals(self):
+        """One row per infection whose infector's own infection time is known"""
+        def compute():
+            infectee = np.flatnonzero(self.infector >= 0)
+            infector = self.infector[infectee]
+            known    = self.infection_time[infector] != NOT_INFECTED
+            infectee, infector = infectee[known], infector[known]
+            return pd.DataFrame({"infector": usernames.decode(infector), "infectee": usernames.decode(infectee)
+                                 , "infector_time": pd.to_datetime(self.infection_time[infector])
+                                 , "infection_time": pd.to_datetime(self.infection_time[infectee])
+                                 , "interval": pd.to_timedelta(self.infection_time[infectee] - self.infection_time[infector])})
+        return self._cached("generation_intervals", compute)
+
+    def secondary_cases(self):
+        """Number of cases with 0, 1, 2, ... secondary cases"""
+        def compute():
+            counts = np.bincount(self.offspring[self._cases()])
+            return pd.DataFrame({"secondary_cases": np.arange(len(counts)), "cases": counts})
+        return self._cached("secondary_cases", compute)
+
+    def reproduction_number(self, resolution="day", window=1, level=LEVEL):
+        """R(t) by infection time of the infector, pooled over a trailing window of bins.
+
+        Returns per bin the cases infected in the window, their secondary cases, and the posterior mean,
+        median and credible interval of R (NaN for windows without cases).
+        """
+        def compute():
+            from scipy.special import gammaincinv   #<--Gamma quantiles; much lighter to import than scipy.stats
+
+            cases   = self._cases()
+            cases   = cases[self.infection_time[cases] != NOT_INFECTED]
+            columns = ["cases", "secondary_cases", "mean", "median", "lower", "upper"]
+            if len(cases) == 0:
+                return pd.DataFrame(columns=columns, dtype=float)
+
+            width = RESOLUTIONS[resolution]*NS_PER_MINUTE
+            bins  = self.infection_time[cases]//width
+            bins -= bins.min()
+            n_cases   = np.bincount(bins).astype(float)
+            secondary = np.bincount(bins, weights=self.offspring[cases])
+
+            #--trailing sums over `window` bins
+            def trailing(values):
+                total = np.cumsum(values)
+                total[window:] = total[window:] - total[:-window]
+                return total
+            n_cases, secondary = trailing(n_cases), trailing(secondary)
+
+            shape = PRIOR_SHAPE + secondary
+            scale = 1./(1./PRIOR_SCALE + n_cases)
+            tail  = (1. - level)/2.
+            empty = n_cases == 0
+            estimates = np.array([shape, gammaincinv(shape, 0.5), gammaincinv(shape, tail), gammaincinv(shape, 1. - tail)])*scale
+            estimates[:, empty] = np.nan
+
+            start = self.infection_time[cases].min()//width
+            index = pd.to_datetime((start + np.arange(len(n_cases)))*width)
+            return pd.DataFrame(np.column_stack([n_cases, secondary, estimates.T]), index=index, columns=columns)
+        return self._cached(("reproduction_number", resolution, window, level), compute)
+
+    def summary(self):
+        def compute():
+            cases     = self._cases()
+            intervals = self.generation_intervals().interval.dt.total_seconds()/3600.
+            return {"cases": len(cases)
+                    , "index_cases": int((self.infection_time[cases] == NOT_INFECTED).sum())
+                    , "mean_secondary_cases": float(self.offspring[cases].mean()) if len(cases) else np.nan
+                    , "mean_generation_interval_hours": float(intervals.mean()) if len(intervals) else np.nan
+                    , "median_generation_interval_hours": float(intervals.median()) if len(intervals) else np.nan}
+        return self._cached("summary", compute)
+
+
+_analytics = ReproductionAnalytics(transmission._index)
+
+
+def get_reproduction(interactions):
+    """Process-wide analytics synced with the given dataset (through the shared transmission tree)"""
+    transmission.get_transmission(interactions)
+    return _analytics
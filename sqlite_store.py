@@ -0,0 +1,251 @@
+#mcandrew
+
+"""Interactions in an embedded SQLite database (WAL mode).
+
+A drop-in alternative to the object-storage event log for a single host:
+appends are transactions, so concurrent writers are serialized by SQLite
+instead of retrying conditional PUTs. The validation questions asked on every
+submission (is this user infected, when did this pair last interact, which
+interventions has this user had) are answered with indexed queries.
+
+Object storage becomes optional: the database can be copied there periodically
+as a backup and restored from it.
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import event_log
+import telemetry
+from epidemic_state import INFECTION_BASELINE, COOLDOWN_SECONDS
+
+BACKUP_KEY     = "interactions.sqlite3"
+BACKUP_SECONDS = 300.   #<--interval of the periodic backup (only taken if something changed)
+BUSY_TIMEOUT   = 10000  #<--milliseconds a writer waits for the write lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    seq                    INTEGER PRIMARY KEY AUTOINCREMENT,
+    Actor                  TEXT    NOT NULL,
+    Audience               TEXT    NOT NULL,
+    infection_intervention INTEGER NOT NULL,
+    success                INTEGER NOT NULL,
+    intervention_value     REAL,
+    intervention_type      TEXT,
+    timestamp              TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interactions_pair     ON interactions (Actor, Audience, timestamp);
+CREATE INDEX IF NOT EXISTS interactions_audience ON interactions (Audience);
+CREATE INDEX IF NOT EXISTS interactions_kind     ON interactions (infection_intervention, success);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('generation', '0');
+"""
+
+
+def _rows(events):
+    """Events as tuples in column order, with timestamps as text and missing values as NULL"""
+    events = events[event_log.INTERACTION_COLUMNS]
+    timestamps = events.timestamp
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = timestamps.dt.strftime(event_log.TIMESTAMP_FORMAT)
+    values = events.intervention_value.astype(float)
+    return list(zip(events.Actor.astype(str), events.Audience.astype(str)
+                    , events.infection_intervention.astype(int), events.success.astype(int)
+                    , [None if np.isnan(v) else v for v in values]
+                    , [None if pd.isna(t) else str(t) for t in events.intervention_type]
+                    , timestamps.astype(str)))
+
+
+class SQLiteEventStore:
+    """Event store backed by a SQLite file (same interface as event_log.ObjectEventLog)"""
+
+    def __init__(self, path):
+        self.path   = os.path.abspath(path)
+        self.name   = f"sqlite://{self.path}"
+        self._local = threading.local()   #<--one connection per thread
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+        self._backups = None
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT/1000., isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
+            self._local.connection = connection
+        return connection
+
+    def _frame(self, query, parameters=(), columns=None):
+        frame = pd.read_sql_query(query, self._connection(), params=parameters)
+        return event_log.apply_schema(frame[columns or event_log.INTERACTION_COLUMNS])
+
+    #--Event store interface------------------------------------------------------------------------------------------
+    @telemetry.timed("sqlite.append")
+    def append(self, new_row_df, cursor=None, validate=None):
+        """Insert new events in one transaction. Returns the seq of the last one.
+
+        Events written after cursor by other writers are passed to validate(changed_rows_df) inside the
+        transaction; if it returns False nothing is written and EventRejected is raised.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")   #<--takes the write lock: no other writer until COMMIT
+        try:
+            if validate is not None and cursor is not None:
+                changed = self._frame("SELECT * FROM interactions WHERE seq > ? ORDER BY seq", (cursor,))
+                if len(changed) and not validate(changed):
+                    raise event_log.EventRejected(f"Event conflicts with {len(changed)} concurrent event(s)")
+            connection.executemany("INSERT INTO interactions (Actor, Audience, infection_intervention, success"
+                                   ", intervention_value, intervention_type, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                                   , _rows(new_row_df))
+            seq = connection.execute("SELECT MAX(seq) FROM interactions").fetchone()[0]
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return seq
+
+    @telemetry.timed("sqlite.read")
+    def read_with_cursor(self, columns=None):
+        connection = self._connection()
+        connection.execute("BEGIN")   #<--rows and cursor from the same snapshot
+        try:
+            events = self._frame("SELECT * FROM interactions ORDER BY seq", columns=columns)
+            cursor = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM interactions").fetchone()[0]
+        finally:
+            connection.execute("COMMIT")
+        return events, cursor
+
+    @telemetry.timed("sqlite.read_after")
+    def read_after(self, cursor):
+        """Events after cursor and the cursor of the last of them"""
+        events = pd.read_sql_query("SELECT * FROM interactions WHERE seq > ? ORDER BY seq", self._connection(), params=(cursor,))
+        last   = int(events.seq.iloc[-1]) if len(events) else cursor
+        return event_log.apply_schema(events[event_log.INTERACTION_COLUMNS]), last
+
+    def version(self):
+        return self._connection().execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def compact_if_needed(self, cursor):
+        """Nothing to fold: every event is a row of the one table"""
+        return False
+
+    def validation_state(self, interactions):
+        """The database itself: every check is an indexed query on the latest events"""
+        return self
+
+    def reset(self, dataset):
+        """Start a new game with dataset as the only events"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM interactions")
+            connection.executemany("INSERT INTO interactions (Actor, Audience, infection_intervention, success"
+                                   ", intervention_value, intervention_type, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                                   , _rows(dataset))
+            connection.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = 'generation'")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    #--Validation queries (same methods as epidemic_state.EpidemicState)-----------------------------------------------
+    def is_infected(self, user):
+        return self._connection().execute("SELECT 1 FROM interactions WHERE Audience = ? AND infection_intervention = 1"
+                                          " AND success = 1 LIMIT 1", (user,)).fetchone() is not None
+
+    def seconds_since_contact(self, actor, audience, now):
+        """Seconds since the last event between actor and audience (None if they never interacted)"""
+        last = self._connection().execute("SELECT MAX(timestamp) FROM interactions WHERE Actor = ? AND Audience = ?"
+                                          , (actor, audience)).fetchone()[0]
+        return None if last is None else (pd.Timestamp(now) - pd.Timestamp(last)).total_seconds()
+
+    def in_cooldown(self, actor, audience, now):
+        seconds = self.seconds_since_contact(actor, audience, now)
+        return seconds is not None and seconds < COOLDOWN_SECONDS
+
+    def has_intervention(self, user, intervention_type):
+        return self._connection().execute("SELECT 1 FROM interactions WHERE Audience = ? AND infection_intervention = 0"
+                                          " AND intervention_type = ? LIMIT 1", (user, str(intervention_type))).fetchone() is not None
+
+    def infection_probability(self, audience):
+        values = self._connection().execute("SELECT intervention_value FROM interactions WHERE Audience = ?"
+                                            " AND infection_intervention = 0", (audience,)).fetchall()
+        return INFECTION_BASELINE*float(np.prod([1. - (np.nan if value is None else value) for (value,) in values]))
+
+    #--Backups----------------------------------------------------------------------------------------------------------
+    def _change_token(self):
+        return (self.version(), self._connection().execute("SELECT COALESCE(MAX(seq), 0) FROM interactions").fetchone()[0])
+
+    @telemetry.timed("sqlite.backup")
+    def backup_to(self, store, key=BACKUP_KEY):
+        """Copy a consistent snapshot of the database to object storage"""
+        handle, path = tempfile.mkstemp(suffix=".sqlite3", dir=os.path.dirname(self.path))
+        os.close(handle)
+        try:
+            target = sqlite3.connect(path)
+            with target:
+                self._connection().backup(target)
+            target.close()
+            with open(path, "rb") as backup:
+                store.put(key, backup.read(), content_type="application/vnd.sqlite3")
+        finally:
+            os.remove(path)
+
+    @classmethod
+    def restore_from(cls, store, path, key=BACKUP_KEY):
+        """Write the backup in object storage to path and open it"""
+        with open(path, "wb") as database:
+            database.write(store.get(key).body)
+        return cls(path)
+
+    def start_backups(self, store, interval=BACKUP_SECONDS):
+        """Back up to store every interval seconds while the database keeps changing"""
+        if self._backups is not None:
+            return
+        def run():
+            last = None
+            while True:
+                time.sleep(interval)
+                try:
+                    token = self._change_token()
+                    if token != last:
+                        self.backup_to(store)
+                        last = token
+                except Exception as e:
+                    print(f"Warning: SQLite backup failed: {str(e)}")
+        self._backups = threading.Thread(target=run, daemon=True, name="sqlite-backup")
+        self._backups.start()
+
+
+def from_secrets(secrets):
+    """Store at sqlite_path; with sqlite_backup = true it is copied to the storage backend periodically"""
+    events = SQLiteEventStore(secrets.get("sqlite_path", "wmm.sqlite3"))
+    if secrets.get("sqlite_backup", False):
+        import storage
+        events.start_backups(storage.get_storage(secrets), interval=float(secrets.get("sqlite_backup_seconds", BACKUP_SECONDS)))
+    return events
+
+
+if __name__ == "__main__":
+    #--Move a game into SQLite: python sqlite_store.py import <path> (from the object log) or restore <path> (from the backup)
+    import sys
+    import storage
+
+    command, path = sys.argv[1], sys.argv[2]
+    store = storage.get_storage()
+    if command == "import":
+        events = SQLiteEventStore(path)
+        events.reset(event_log.read_interactions(store))
+    elif command == "restore":
+        events = SQLiteEventStore.restore_from(store, path)
+    else:
+        raise SystemExit(f"unknown command {command}")
+    print(f"{events.name}: {events.read_with_cursor()[1]} events")
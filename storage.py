@@ -0,0 +1,310 @@
+#mcandrew
+
+"""Storage layer for everything the app keeps in the WMM bucket.
+
+One process-wide backend is shared by every page and helper module. The S3
+backend owns a single boto3 client with a large keep-alive connection pool, so
+requests reuse open TLS connections instead of building a client per call.
+The local backend keeps the same objects in a directory (for tests, benchmarks
+and running the app without AWS).
+
+Operations are typed: get returns a StoredObject, head and list return
+ObjectInfo. Missing objects raise NotFound and lost conditional writes raise
+PreconditionFailed, whatever the backend.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import functools
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+import telemetry
+
+AWS_S3_BUCKET = "wmm-2025"
+
+MAX_POOL_CONNECTIONS = 32     #<--parallel segment reads and email/report threads share one pool
+CONNECT_TIMEOUT      = 5      #<--seconds
+READ_TIMEOUT         = 30
+MAX_RETRIES          = 5
+PART_SIZE            = 8*1024*1024   #<--multipart part size (and the threshold for using multipart)
+
+
+class NotFound(Exception):
+    """The object does not exist"""
+
+
+class PreconditionFailed(Exception):
+    """A conditional write lost: the object already exists (if_none_match) or changed (if_match)"""
+
+
+class StoredObject(NamedTuple):
+    body: bytes
+    etag: str
+    metadata: dict
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    etag: str
+    size: int
+    last_modified: float    #<--seconds since the epoch
+    metadata: dict          #<--user metadata (only filled by head; list does not return it)
+
+
+def _instrumented(operation):
+    """Time a backend operation as the span storage.<operation> and count the bytes it moves"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, target, *args, **kwargs):
+            with telemetry.span(f"storage.{operation}", backend=self.name, key=target if isinstance(target, str) else None) as attributes:
+                result = method(self, target, *args, **kwargs)
+                if operation == "get":
+                    attributes["bytes"] = len(result.body)
+                    telemetry.count("storage.bytes_read", len(result.body))
+                elif operation == "put":
+                    body = args[0] if args else kwargs["body"]
+                    attributes["bytes"] = len(body)
+                    telemetry.count("storage.bytes_written", len(body))
+            telemetry.count(f"storage.{operation}")
+            return result
+        return wrapper
+    return decorate
+
+
+#--S3-----------------------------------------------------------------------------------------------------------------------
+class S3Storage:
+    """Objects in an S3 bucket, through one pooled boto3 client"""
+
+    def __init__(self, client, bucket=AWS_S3_BUCKET):
+        self.client = client
+        self.bucket = bucket
+        self.name   = f"s3://{bucket}"
+
+    @classmethod
+    def from_credentials(cls, aws_access_key_id, aws_secret_access_key, bucket=AWS_S3_BUCKET, **client_options):
+        import boto3
+        from botocore.config import Config
+
+        config = Config(max_pool_connections=MAX_POOL_CONNECTIONS, tcp_keepalive=True
+                        , connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT
+                        , retries={"max_attempts": MAX_RETRIES, "mode": "standard"})
+        client = boto3.client("s3", aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key
+                              , config=config, **client_options)
+        return cls(client, bucket)
+
+    def _raise(self, error, key):
+        code = error.response.get("Error", {}).get("Code")
+        if code in ("404", "NoSuchKey", "NotFound"):
+            raise NotFound(key) from error
+        if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise PreconditionFailed(key) from error
+        raise error
+
+    @_instrumented("get")
+    def get(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            self._raise(e, key)
+        return StoredObject(obj["Body"].read(), obj["ETag"], obj.get("Metadata", {}))
+
+    @_instrumented("head")
+    def head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            obj = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            self._raise(e, key)
+        return ObjectInfo(key, obj["ETag"], obj["ContentLength"], obj["LastModified"].timestamp(), obj.get("Metadata", {}))
+
+    @_instrumented("put")
+    def put(self, key, body, content_type=None, metadata=None, if_none_match=False, if_match=None):
+        """Write an object and return its ETag. if_none_match=True only creates; if_match only replaces that ETag."""
+        from botocore.exceptions import ClientError
+
+        options = {}
+        if content_type:
+            options["ContentType"] = content_type
+        if metadata:
+            options["Metadata"] = metadata
+        if if_none_match:
+            options["IfNoneMatch"] = "*"
+        if if_match is not None:
+            options["IfMatch"] = if_match
+        try:
+            return self.client.put_object(Bucket=self.bucket, Key=key, Body=body, **options)["ETag"]
+        except ClientError as e:
+            self._raise(e, key)
+
+    @_instrumented("list")
+    def list(self, prefix, start_after=""):
+        """Objects under prefix with keys after start_after, in key order"""
+        objects   = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, StartAfter=start_after or prefix):
+            objects.extend(ObjectInfo(obj["Key"], obj["ETag"], obj["Size"], obj["LastModified"].timestamp(), {})
+                           for obj in page.get("Contents", []))
+        return sorted(objects, key=lambda info: info.key)
+
+    @_instrumented("delete")
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket
+                                       , Delete={"Objects": [{"Key": key} for key in keys[i:i+1000]], "Quiet": True})
+
+    @_instrumented("upload")
+    def upload(self, key, fileobj, content_type=None):
+        """Stream a file to key, in parts above PART_SIZE. fileobj is closed afterwards."""
+        from boto3.s3.transfer import TransferConfig
+
+        self.client.upload_fileobj(fileobj, self.bucket, key
+                                   , ExtraArgs={"ContentType": content_type} if content_type else None
+                                   , Config=TransferConfig(multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE))
+
+    def url(self, key, expires=900, content_type=None, disposition=None):
+        """Short-lived presigned GET the browser can use directly"""
+        params = {"Bucket": self.bucket, "Key": key}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        if disposition:
+            params["ResponseContentDisposition"] = disposition
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+
+#--Local directory---------------------------------------------------------------------------------------------------------
+class LocalStorage:
+    """Objects as files under root, with ETags and metadata in root/.meta (for tests and offline use)"""
+
+    META_DIR = ".meta"
+
+    def __init__(self, root):
+        self.root  = Path(root).resolve()
+        self.name  = self.root.as_uri()
+        self._lock = threading.RLock()  #<--makes check-then-write of conditional puts atomic within the process
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.root / key
+
+    def _meta_path(self, key):
+        return self.root / self.META_DIR / f"{key}.json"
+
+    def _meta(self, key):
+        try:
+            return json.loads(self._meta_path(key).read_text())
+        except FileNotFoundError:
+            raise NotFound(key) from None
+
+    def _write(self, path, body):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        temporary.write_bytes(body)
+        os.replace(temporary, path)
+
+    @_instrumented("get")
+    def get(self, key):
+        with self._lock:
+            meta = self._meta(key)
+            return StoredObject(self._path(key).read_bytes(), meta["etag"], meta["metadata"])
+
+    @_instrumented("head")
+    def head(self, key):
+        with self._lock:
+            meta = self._meta(key)
+            stat = self._path(key).stat()
+            return ObjectInfo(key, meta["etag"], stat.st_size, stat.st_mtime, meta["metadata"])
+
+    @_instrumented("put")
+    def put(self, key, body, content_type=None, metadata=None, if_none_match=False, if_match=None):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            exists = self._meta_path(key).exists()
+            if (if_none_match and exists) or (if_match is not None and (not exists or self._meta(key)["etag"] != if_match)):
+                raise PreconditionFailed(key)
+            self._write(self._path(key), body)
+            self._write(self._meta_path(key), json.dumps({"etag": etag, "content_type": content_type
+                                                          , "metadata": metadata or {}}).encode("utf-8"))
+        return etag
+
+    @_instrumented("list")
+    def list(self, prefix, start_after=""):
+        objects = []
+        with self._lock:
+            for meta_path in (self.root / self.META_DIR).rglob("*.json"):
+                key = meta_path.relative_to(self.root / self.META_DIR).as_posix()[:-len(".json")]
+                if key.startswith(prefix) and key > (start_after or prefix):
+                    meta = json.loads(meta_path.read_text())
+                    stat = self._path(key).stat()
+                    objects.append(ObjectInfo(key, meta["etag"], stat.st_size, stat.st_mtime, {}))
+        return sorted(objects, key=lambda info: info.key)
+
+    @_instrumented("delete")
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                for path in (self._path(key), self._meta_path(key)):
+                    path.unlink(missing_ok=True)
+
+    @_instrumented("upload")
+    def upload(self, key, fileobj, content_type=None):
+        digest    = hashlib.md5()
+        temporary = self._path(key).with_name(f".{Path(key).name}.{uuid.uuid4().hex}")
+        temporary.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(PART_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        fileobj.close()
+        with self._lock:
+            os.replace(temporary, self._path(key))
+            self._write(self._meta_path(key), json.dumps({"etag": f'"{digest.hexdigest()}"', "content_type": content_type
+                                                          , "metadata": {}}).encode("utf-8"))
+
+    def url(self, key, expires=900, content_type=None, disposition=None):
+        return self._path(key).as_uri()
+
+    def clear(self):
+        """Remove every object (tests)"""
+        with self._lock:
+            shutil.rmtree(self.root)
+            self.root.mkdir(parents=True)
+
+
+#--Process-wide backend------------------------------------------------------------------------------------------------------
+_lock    = threading.Lock()
+_storage = None
+
+
+def from_secrets(secrets):
+    """Backend described by the app secrets: storage_backend = "s3" (default) or "local" with storage_root"""
+    if secrets.get("storage_backend", "s3") == "local":
+        return LocalStorage(secrets.get("storage_root", "wmm-data"))
+    return S3Storage.from_credentials(secrets["AWS_ACCESS_KEY_ID"], secrets["AWS_SECRET_ACCESS_KEY"]
+                                      , bucket=secrets.get("storage_bucket", AWS_S3_BUCKET))
+
+
+def get_storage(secrets=None):
+    """The process-wide backend (built on first use from st.secrets unless secrets are given)"""
+    global _storage
+    with _lock:
+        if _storage is None:
+            if secrets is None:
+                import streamlit as st
+                secrets = st.secrets
+            _storage = from_secrets(secrets)
+        return _storage
+
+
+def set_storage(store):
+    """Replace the process-wide backend (tests, benchmarks, scripts)"""
+    global _storage
+    with _lock:
+        _storage = store
+    return store
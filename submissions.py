@@ -0,0 +1,109 @@
+#mcandrew
+
+"""Validation and outcome of infection and intervention submissions.
+
+This is the logic behind add_user_data_to_database without any Streamlit
+calls: checks return the message to show (or None), and row builders return
+the event to append. The page renders the messages and writes the rows.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from epidemic_state import INFECTION_BASELINE, COOLDOWN_SECONDS
+
+RESERVED_AUDIENCE = "exp626"   #<--patient zero cannot be the audience of an event
+
+ERROR, WARNING = "error", "warning"   #<--levels of a failed check (st.error / st.warning)
+
+
+def validate_input(email):
+    pattern  = r'^[A-Za-z]+\d+$'
+    pattern2 = r'^[A-Za-z]+\d+[A-Za-z]+$'
+    return re.match(pattern, email) or re.match(pattern2, email)
+
+
+def _row(actor, audience, infection_intervention, success, value, intervention_type, now):
+    return pd.DataFrame({ "Actor"                 :[actor]
+                         , "Audience"              :[audience]
+                         , "infection_intervention":[infection_intervention]
+                         , "success"               :[success]
+                         , "intervention_value"    :[value]
+                         , "intervention_type"     :[intervention_type]
+                         , "timestamp"             :[now.strftime("%Y-%m-%d %H:%M:%S")]})
+
+
+#--Infections---------------------------------------------------------------------------------------------------------------
+def check_infection(state, actor, audience, now):
+    """(level, message) of the first check an infection attempt fails, None if it may be attempted"""
+    if not (audience and actor):
+        return ERROR, "One or both of the fields is missing input. Please ensure both emails are entered correctly."
+    if audience == actor:
+        return ERROR, "The audience and actor usernames cannot be the same. Please enter different usernames."
+    if audience.lower() == RESERVED_AUDIENCE:
+        return ERROR, f"The username '{RESERVED_AUDIENCE}' cannot be used as the audience."
+    if not validate_input(audience):
+        return ERROR, "Invalid input for your Lehigh Email credentials. Please follow the specified format."
+    if not validate_input(actor):
+        return ERROR, "Invalid input for the Lehigh Email credentials. Please follow the specified format."
+    if state.in_cooldown(actor, audience, now):
+        return WARNING, f"An event between {actor} and {audience} has taken place under a minute. There is a 60 second cool down between events of the same pair."
+    #--Check if actor is contagious
+    if not state.is_infected(actor):
+        return ERROR, f"{actor} is not eligible to infect others as they have not been infected yet."
+    #--Check if the audience has already been infected
+    if state.is_infected(audience):
+        return WARNING, f"{audience} has already been infected in this game. Get out there and infect more people!"
+    return None
+
+
+def infection_row(state, actor, audience, now, intervention_type=-1, rng=np.random):
+    """The infection (or, if the attempt fails, contact) event of a valid attempt"""
+    #--baseline reduced by every intervention the audience received
+    probability = state.infection_probability(audience)
+    if rng.random() < probability:
+        return _row(actor, audience, 1, 1, INFECTION_BASELINE, intervention_type, now)
+    return _row(actor, audience, 1, 0, np.nan, intervention_type, now)
+
+
+def still_valid_infection(actor, audience, current_date_time):
+    """Re-check an infection attempt against events other users wrote while we were submitting"""
+    def validate(changed):
+        infected = changed.loc[(changed.infection_intervention==1) & (changed.success==1), "Audience"].values
+        if audience in infected:
+            return False
+        same_pair = changed.loc[(changed.Actor==actor) & (changed.Audience==audience), "timestamp"]
+        return not (same_pair > pd.Timestamp(current_date_time) - pd.Timedelta(seconds=COOLDOWN_SECONDS)).any()
+    return validate
+
+
+#--Interventions------------------------------------------------------------------------------------------------------------
+def check_intervention(state, effectiveness_model, actor, audience, intervention_type):
+    """(level, message) of the first check an intervention fails, None if it may be stored"""
+    if effectiveness_model is None or intervention_type not in effectiveness_model.pools:
+        return ERROR, f"The intervention type {intervention_type} is not valid. Please select a valid intervention type."
+    if not (audience and actor):
+        return ERROR, "One or both of the fields is missing input. Please ensure both emails are entered correctly."
+    if audience.lower() == RESERVED_AUDIENCE:
+        return ERROR, f"The username '{RESERVED_AUDIENCE}' cannot be used as the audience."
+    if not validate_input(audience):
+        return ERROR, "Invalid input for your Lehigh Email credentials. Please follow the specified format."
+    #--Have they already had this intervention type?
+    if state.has_intervention(audience, intervention_type):
+        return WARNING, f"The user, {audience}, has already engaged with this intervention."
+    return None
+
+
+def intervention_row(effectiveness_model, actor, audience, intervention_type, now):
+    """The intervention event, with effectiveness drawn from the model"""
+    return _row(actor, audience, 0, 1, effectiveness_model.draw(intervention_type), intervention_type, now)
+
+
+def still_valid_intervention(audience, intervention_type):
+    """Re-check an intervention against events other users wrote while we were submitting"""
+    def validate(changed):
+        same = changed.loc[(changed.Audience==audience) & (changed.infection_intervention==0), "intervention_type"].values
+        return intervention_type not in same
+    return validate
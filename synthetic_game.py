@@ -0,0 +1,243 @@
+#mcandrew
+
+"""Synthetic games of any size for capacity testing and benchmarks.
+
+Transmission is a branching process played out on the calendar. Every infected
+user makes a negative-binomial number of contact attempts (a few
+super-spreaders, many who infect nobody) at exponential delays after their
+own infection. Most contacts are within a circle of nearby users and the rest
+are anywhere in the population. An attempt succeeds with the game's
+INFECTION_BASELINE times the protection the target had at that moment, and
+only if the target is not infected yet. Failed attempts are logged like in the
+game.
+
+Interventions come from an intervention group, at random times, with
+effectiveness drawn from the catalog's KDE like intervention_model does.
+Everything is generated with numpy one generation of infections at a time, so
+millions of events take seconds. The same seed gives the same game.
+
+    python synthetic_game.py --users 300000 --out game.parquet
+    python synthetic_game.py --users 50000 --storage-root wmm-data   #<--a complete game in a local storage directory
+"""
+
+import numpy as np
+import pandas as pd
+
+import event_log
+from epidemic_state import INFECTION_BASELINE
+from intervention_model import CATALOG_KEY, SCALE
+
+GROUP_KEY = "intervention_group_2025.csv"
+START     = "2025-09-01"
+
+#--Catalog used when none is given: effectiveness ratings on the catalog's 0-10 scale, one column per type
+DEFAULT_CATALOG = pd.DataFrame({"Mask"              : [6, 7, 5, 8, 6, 7, 4, 6]
+                                , "Vaccine"           : [9, 8, 9, 7, 8, 9, 8, 7]
+                                , "Hand washing"      : [3, 4, 5, 3, 2, 4, 3, 5]
+                                , "Social distancing" : [5, 6, 4, 7, 5, 3, 6, 5]})
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def usernames(n, rng):
+    """n distinct campus-style usernames (three letters and three digits, e.g. exp626)"""
+    space = 26**3*1000
+    if n > space:
+        raise ValueError(f"At most {space} usernames")
+    ids = np.unique(rng.integers(0, space, size=n + n//10 + 16))
+    while len(ids) < n:
+        ids = np.unique(np.concatenate([ids, rng.integers(0, space, size=n)]))
+    ids     = rng.permutation(ids)[:n]
+    letters = ids//1000
+    names   = np.char.add(np.char.add(np.char.add(LETTERS[letters//676], LETTERS[(letters//26) % 26]), LETTERS[letters % 26])
+                          , np.char.zfill((ids % 1000).astype(str), 3))
+    return names.astype(object)
+
+
+def draw_effectiveness(catalog, types, rng):
+    """Effectiveness in [0, 1] for each entry of types, from the KDE of that type's catalog column"""
+    from scipy.stats import gaussian_kde
+
+    values = np.empty(len(types), dtype=np.float64)
+    for code, intervention_type in enumerate(catalog.columns):
+        rows = np.flatnonzero(types == code)
+        if len(rows):
+            kde          = gaussian_kde(catalog[intervention_type].dropna().values/SCALE)
+            values[rows] = np.clip(kde.resample(len(rows), seed=rng)[0], 0, 1)
+    return values
+
+
+class _Protection:
+    """Protection of (user, time) pairs from the interventions a user received before that time"""
+
+    def __init__(self, audience, seconds, values, span):
+        self.span  = span
+        order      = np.lexsort((seconds, audience))
+        self.user  = audience[order]
+        self.keys  = self.user*span + seconds[order]
+        log        = np.log1p(-np.minimum(values[order], 1. - 1e-12))
+        escape     = np.cumsum(log)
+        #--cumulative log protection restarted at every user's first intervention
+        first      = np.ones(len(order), dtype=bool)
+        first[1:]  = self.user[1:] != self.user[:-1]
+        start      = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+        self.log   = escape - escape[start] + log[start]
+
+    def __call__(self, users, seconds):
+        position = np.searchsorted(self.keys, users*self.span + seconds, side="left") - 1   #<--last one strictly before
+        valid    = position >= 0
+        valid[valid] = self.user[position[valid]] == users[valid]
+        log = np.zeros(len(users))
+        log[valid] = self.log[position[valid]]
+        return np.exp(log)
+
+
+def generate(users=10000, attempts_per_case=6., dispersion=0.5, generation_hours=36., days=21
+             , index_cases=None, circle=50, local_share=0.7, group_share=0.1, interventions_per_user=0.5
+             , catalog=None, baseline=INFECTION_BASELINE, start=START, seed=0):
+    """A complete game as a typed event frame in time order.
+
+    attempts_per_case is the mean number of contact attempts of an infected user, dispersion the negative binomial
+    dispersion (smaller means more super-spreading), generation_hours the mean delay from a user's infection to each of
+    their attempts. A share local_share of contacts are within `circle` users of the actor.
+    """
+    rng     = np.random.default_rng(seed)
+    catalog = DEFAULT_CATALOG if catalog is None else catalog
+    span    = int(days*86400)
+    names   = usernames(users, rng)
+
+    #--Interventions: the intervention group treats random users, at most once per type
+    group  = rng.choice(users, size=max(1, int(users*group_share)), replace=False)
+    n      = int(users*interventions_per_user)
+    treats = pd.DataFrame({"actor": group[rng.integers(0, len(group), size=n)], "audience": rng.integers(0, users, size=n)
+                           , "type": rng.integers(0, len(catalog.columns), size=n), "second": rng.integers(0, span, size=n)})
+    treats = treats.sort_values("second", kind="stable").drop_duplicates(["audience", "type"])
+    treats["value"] = draw_effectiveness(catalog, treats.type.values, rng)
+    protection      = _Protection(treats.audience.values, treats.second.values, treats.value.values, span)
+
+    #--Transmission, one generation at a time
+    infected_at = np.full(users, np.iinfo(np.int64).max)
+    frontier    = rng.choice(users, size=min(users, index_cases or max(3, users//10000)), replace=False)   #<--a few, so small games rarely die out at once
+    infected_at[frontier] = rng.integers(0, 3600, size=len(frontier))
+    attempts    = []
+    while len(frontier):
+        count   = rng.negative_binomial(dispersion, dispersion/(dispersion + attempts_per_case), size=len(frontier))
+        actor   = np.repeat(frontier, count)
+        second  = np.repeat(infected_at[frontier], count) + rng.exponential(generation_hours*3600, size=len(actor)).astype(np.int64)
+        keep    = second < span
+        actor, second = actor[keep], second[keep]
+
+        local   = rng.random(len(actor)) < local_share
+        offset  = np.where(local, rng.integers(1, circle + 1, size=len(actor))*rng.choice([-1, 1], size=len(actor))
+                           , rng.integers(1, users, size=len(actor)) if users > 1 else 0)
+        target  = (actor + offset) % users
+
+        #--a trial can only infect a target nobody reached in an earlier generation; the earliest trial wins
+        trial   = rng.random(len(actor)) < baseline*protection(target, second)
+        open_   = trial & (infected_at[target] == np.iinfo(np.int64).max) & (target != actor)
+        order   = np.flatnonzero(open_)[np.argsort(second[open_], kind="stable")]
+        _, win  = np.unique(target[order], return_index=True)
+        winners = order[win]
+
+        success = np.zeros(len(actor), dtype=np.int8)
+        success[winners] = 1
+        infected_at[target[winners]] = second[winners]
+        attempts.append((actor, target, second, success))
+        frontier = target[winners]
+
+    actor, target, second, success = (np.concatenate(column) for column in zip(*attempts)) if attempts else [np.empty(0, dtype=np.int64)]*4
+    events = pd.DataFrame({"Actor"                    : np.concatenate([actor, treats.actor.values])
+                           , "Audience"               : np.concatenate([target, treats.audience.values])
+                           , "infection_intervention" : np.r_[np.ones(len(actor), dtype=np.int8), np.zeros(len(treats), dtype=np.int8)]
+                           , "success"                : np.r_[success.astype(np.int8), np.zeros(len(treats), dtype=np.int8)]
+                           , "intervention_value"     : np.r_[np.full(len(actor), np.nan), treats.value.values]
+                           , "intervention_type"      : np.r_[np.full(len(actor), "-1", dtype=object)
+                                                              , np.asarray(catalog.columns, dtype=object)[treats.type.values]]
+                           , "second"                 : np.r_[second, treats.second.values]})
+    events = events.sort_values("second", kind="stable").reset_index(drop=True)
+
+    #--usernames are categories from the start: one string per user, however many events
+    categories = pd.Index(names, dtype=object)
+    events["Actor"]     = pd.Categorical.from_codes(events.Actor.values, categories=categories)
+    events["Audience"]  = pd.Categorical.from_codes(events.Audience.values, categories=categories)
+    events["timestamp"] = pd.Timestamp(start) + pd.to_timedelta(events.pop("second").values, unit="s")
+    return event_log.apply_schema(events[event_log.INTERACTION_COLUMNS])
+
+
+def sized(n_events, seed=0, **options):
+    """The first n_events events of a game just large enough to have them"""
+    per_user = options.get("attempts_per_case", 6.)*0.8 + options.get("interventions_per_user", 0.5)
+    users    = max(20, int(n_events/per_user))
+    for _ in range(8):
+        events = generate(users=users, seed=seed, **options)
+        if len(events) >= n_events:
+            events = events.iloc[:n_events].copy()
+            for column in ("Actor", "Audience"):
+                events[column] = events[column].cat.remove_unused_categories()
+            return events
+        users = int(users*1.1*n_events/max(1, len(events))) + 1
+    return events
+
+
+#--Output----------------------------------------------------------------------------------------------------------------
+def write(events, path):
+    """CSV (the game's format) or Parquet (the typed snapshot format), by extension"""
+    if str(path).endswith(".parquet"):
+        events[event_log.INTERACTION_COLUMNS].to_parquet(path, index=False, compression="zstd")
+    else:
+        events[event_log.INTERACTION_COLUMNS].to_csv(path, index=False, date_format=event_log.TIMESTAMP_FORMAT)
+
+
+def install(events, store, event_store=None, catalog=None):
+    """Make the game the current one: the events, the intervention group and the catalog.
+
+    store is a storage backend (storage.LocalStorage works as a stand-in for S3); the events go to event_store,
+    or to the object log in store.
+    """
+    catalog = DEFAULT_CATALOG if catalog is None else catalog
+    (event_store or event_log.ObjectEventLog(store)).reset(events)
+    #--the intervention group is everyone who applied an intervention
+    group = pd.DataFrame({"username": pd.unique(events.loc[events.infection_intervention == 0, "Actor"].astype(str))})
+    store.put(GROUP_KEY, group.to_csv(index=False).encode('utf-8'), content_type='text/csv')
+    store.put(CATALOG_KEY, catalog.to_csv(index=False).encode('utf-8'), content_type='text/csv')
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic WMM game")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=None, help="cut the game at this many events (users are scaled to reach it)")
+    parser.add_argument("--attempts", type=float, default=6., help="mean contact attempts per infected user")
+    parser.add_argument("--dispersion", type=float, default=0.5)
+    parser.add_argument("--days", type=float, default=21)
+    parser.add_argument("--interventions", type=float, default=0.5, help="interventions per user")
+    parser.add_argument("--catalog", default=None, help="intervention effectiveness CSV (default: a built-in table)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write the events to a .csv or .parquet file")
+    parser.add_argument("--storage-root", default=None, help="install the game in a local storage directory")
+    parser.add_argument("--sqlite", default=None, help="with --storage-root, keep the events in this SQLite file")
+    args = parser.parse_args()
+
+    catalog = DEFAULT_CATALOG if args.catalog is None else pd.read_csv(args.catalog)
+    options = dict(attempts_per_case=args.attempts, dispersion=args.dispersion, days=args.days
+                   , interventions_per_user=args.interventions, catalog=catalog)
+    t0     = time.perf_counter()
+    events = sized(args.events, seed=args.seed, **options) if args.events else generate(users=args.users, seed=args.seed, **options)
+    t1     = time.perf_counter()
+    hits   = events.loc[(events.infection_intervention == 1) & (events.success == 1)]
+    print(f"{len(events)} events, {events.Audience.nunique()} users reached, {len(hits)} infections in {t1 - t0:.2f}s")
+
+    if args.out:
+        write(events, args.out)
+        print(f"wrote {args.out}")
+    if args.storage_root:
+        import storage
+        store  = storage.LocalStorage(args.storage_root)
+        target = None
+        if args.sqlite:
+            import sqlite_store
+            target = sqlite_store.SQLiteEventStore(args.sqlite)
+        install(events, store, event_store=target, catalog=catalog)
+        print(f"installed in {store.name}" + (f" with events in {target.name}" if target else ""))
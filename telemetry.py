@@ -0,0 +1,202 @@
+#mcandrew
+
+"""Spans, timers and counters for the app's I/O and compute stages.
+
+    with telemetry.span("storage.get", key=key):
+        ...
+    telemetry.count("cache.interactions.hit")
+
+Every span adds its duration to a histogram for its name. The histograms use
+fixed log-spaced buckets, so memory stays constant however long the process
+runs. The most recent spans are also kept, with their attributes and parent
+span, and can be exported as newline-delimited JSON for offline analysis.
+Everything is process-wide and thread-safe. A span costs a few microseconds.
+
+Admins (admin_users in the secrets) see the numbers in a sidebar panel. Login
+does not authenticate usernames, so exporting and resetting also need the
+operator token (telemetry_token in the secrets).
+"""
+
+import hmac
+import json
+import time
+import bisect
+import threading
+import functools
+import contextvars
+from collections import deque, Counter
+from contextlib import contextmanager
+
+BUCKET_BOUNDS_MS = [10**(exponent/4) for exponent in range(-8, 21)]   #<--0.01 ms to 100 s, four buckets per decade
+RECENT_SPANS     = 10000                                              #<--spans kept for export
+
+_lock     = threading.Lock()
+_current  = contextvars.ContextVar("telemetry_span", default=None)    #<--name of the enclosing span
+_started  = time.time()
+
+
+class Histogram:
+    """Count, total, extremes and bucket counts of one span's durations"""
+
+    def __init__(self):
+        self.buckets = [0]*(len(BUCKET_BOUNDS_MS) + 1)
+        self.count   = 0
+        self.total   = 0.
+        self.minimum = float("inf")
+        self.maximum = 0.
+
+    def add(self, ms):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count  += 1
+        self.total  += ms
+        self.minimum = min(self.minimum, ms)
+        self.maximum = max(self.maximum, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the maximum for the overflow bucket)"""
+        if self.count == 0:
+            return float("nan")
+        rank, seen = q*self.count, 0
+        for bound, n in zip(BUCKET_BOUNDS_MS + [self.maximum], self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {"count": self.count, "total_ms": round(self.total, 3), "mean_ms": round(self.total/max(1, self.count), 3)
+                , "min_ms": round(self.minimum if self.count else float("nan"), 3), "p50_ms": round(self.quantile(0.5), 3)
+                , "p90_ms": round(self.quantile(0.9), 3), "p99_ms": round(self.quantile(0.99), 3), "max_ms": round(self.maximum, 3)}
+
+
+_histograms = {}
+_counters   = Counter()
+_recent     = deque(maxlen=RECENT_SPANS)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as `name`. The yielded dict can take attributes known only at the end (e.g. bytes)."""
+    parent = _current.get()
+    token  = _current.set(name)
+    start  = time.perf_counter()
+    wall   = time.time()
+    error  = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - start)*1000.
+        _current.reset(token)
+        record = {"type": "span", "name": name, "start": round(wall, 6), "duration_ms": round(ms, 3)
+                  , "parent": parent, "thread": threading.current_thread().name}
+        if error:
+            record["error"] = error
+        if attributes:
+            record["attributes"] = attributes
+        with _lock:
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram()
+            histogram.add(ms)
+            _recent.append(record)
+
+
+def timed(name):
+    """Decorator: every call of the function is a span"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+#--Reading the numbers-------------------------------------------------------------------------------------------------------
+def histograms():
+    """{span name: summary}, sorted by total time spent"""
+    with _lock:
+        summaries = {name: histogram.summary() for name, histogram in _histograms.items()}
+    return dict(sorted(summaries.items(), key=lambda item: -item[1]["total_ms"]))
+
+
+def counters():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def recent(n=None):
+    with _lock:
+        spans = list(_recent)
+    return spans if n is None else spans[-n:]
+
+
+def to_ndjson():
+    """Recent spans, then one line per histogram and one with the counters"""
+    now   = round(time.time(), 6)
+    lines = [json.dumps(record, default=str) for record in recent()]
+    lines.extend(json.dumps({"type": "histogram", "name": name, "at": now, "since": round(_started, 6), **summary})
+                 for name, summary in histograms().items())
+    lines.append(json.dumps({"type": "counters", "at": now, "since": round(_started, 6), "counters": counters()}))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def reset():
+    global _started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _recent.clear()
+        _started = time.time()
+
+
+#--Operator panel------------------------------------------------------------------------------------------------------------
+def is_admin(username, secrets):
+    try:
+        return username is not None and username in list(secrets.get("admin_users", []))
+    except Exception:
+        return False
+
+
+def is_operator(token, secrets):
+    """True if token is the telemetry_token of the secrets (never when none is configured)"""
+    try:
+        expected = secrets.get("telemetry_token")
+    except Exception:
+        return False
+    return bool(expected) and bool(token) and hmac.compare_digest(str(token).encode(), str(expected).encode())
+
+
+def debug_panel():
+    """Sidebar panel with the histograms and counters, shown only to admin_users"""
+    import streamlit as st
+    import pandas as pd
+
+    if not is_admin(st.session_state.get("username"), st.secrets):
+        return
+    with st.sidebar.expander("🛠️ Performance (admin)"):
+        summaries = histograms()
+        if summaries:
+            table = pd.DataFrame.from_dict(summaries, orient="index")[["count", "total_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]]
+            st.dataframe(table, use_container_width=True)
+        else:
+            st.caption("No spans recorded yet.")
+        values = counters()
+        if values:
+            st.dataframe(pd.Series(values, name="value"), use_container_width=True)
+        token = st.text_input("Operator token", type="password", key="telemetry_token")
+        if not is_operator(token, st.secrets):
+            st.caption("Export and reset need the operator token.")
+            return
+        st.download_button("Export NDJSON", data=to_ndjson(), file_name=f"wmm-telemetry-{int(time.time())}.ndjson"
+                           , mime="application/x-ndjson")
+        if st.button("Reset"):
+            reset()
@@ -0,0 +1,108 @@
+#mcandrew
+
+"""The event log's write path against the local S3 stand-in (storage.LocalStorage).
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import event_log
+import storage
+import submissions
+
+
+def infection(actor, audience, timestamp="2025-09-01 00:00:00"):
+    return pd.DataFrame({"Actor": [actor], "Audience": [audience], "infection_intervention": [1], "success": [1]
+                         , "intervention_value": [np.nan], "intervention_type": [-1], "timestamp": [pd.Timestamp(timestamp)]})
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = event_log.ObjectEventLog(storage.LocalStorage(tmp_path))
+    log.reset(infection("exp626", "thm220"))
+    return log
+
+
+def audiences(log):
+    return event_log.read_interactions(log.store).Audience.astype(str).tolist()
+
+
+def test_concurrent_appends_leave_no_gaps_or_duplicates(log):
+    writers = 24
+    _, cursor = log.read_with_cursor()
+    barrier   = threading.Barrier(writers)
+
+    def write(i):
+        barrier.wait()   #<--every writer starts from the same cursor and races for the same position
+        return log.append(infection(f"w{i}", f"a{i}"), cursor=cursor, validate=lambda changed: True)
+
+    with ThreadPoolExecutor(writers) as pool:
+        positions = list(pool.map(write, range(writers)))
+
+    assert sorted(positions) == list(range(cursor + 1, cursor + writers + 1))
+    stored = audiences(log)
+    assert len(stored) == 1 + writers and len(set(stored)) == len(stored)
+
+
+def test_conflicting_event_is_rejected(log):
+    _, cursor = log.read_with_cursor()
+    log.append(infection("w1", "target"), cursor=cursor)
+
+    #--another writer, still at the old cursor, tries to infect the same user
+    validate = submissions.still_valid_infection("w2", "target", pd.Timestamp("2025-09-01 00:00:00"))
+    with pytest.raises(event_log.EventRejected):
+        log.append(infection("w2", "target"), cursor=cursor, validate=validate)
+    assert audiences(log).count("target") == 1
+
+    #--an event the concurrent one does not conflict with moves on to the next position
+    validate = submissions.still_valid_infection("w2", "other", pd.Timestamp("2025-09-01 00:00:00"))
+    assert log.append(infection("w2", "other"), cursor=cursor, validate=validate) == cursor + 2
+
+
+def test_compaction_keeps_every_event(log):
+    for i in range(5):
+        log.append(infection(f"w{i}", f"a{i}"))
+    assert event_log.compact_interactions(log.store) == 5
+    assert event_log.list_segment_keys(log.store, start_after=log.store.head(event_log.SNAPSHOT_KEY).metadata[event_log.WATERMARK_META]) == []
+    assert sorted(audiences(log)) == sorted(["thm220"] + [f"a{i}" for i in range(5)])
+
+
+def test_append_after_compaction_is_readable(log):
+    for i in range(3):
+        log.append(infection(f"w{i}", f"a{i}"))
+    event_log.compact_interactions(log.store)
+    position = log.append(infection("late", "after"))
+    assert position == 4
+    assert "after" in audiences(log)
+
+
+def test_stale_cursor_after_folded_segments_were_deleted(log, monkeypatch):
+    #--segments folded by an earlier compaction are deleted right away, so old positions look free again
+    monkeypatch.setattr(event_log, "SEGMENT_RETENTION_SECONDS", -1)
+    for i in range(3):
+        log.append(infection(f"w{i}", f"a{i}"))
+    event_log.compact_interactions(log.store)
+    log.append(infection("w3", "a3"))
+    event_log.compact_interactions(log.store)
+    with pytest.raises(storage.NotFound):
+        log.store.head(event_log.segment_key(1))
+
+    position = log.append(infection("stale", "late"), cursor=0)
+    assert position == 5
+    assert "late" in audiences(log)
+
+    #--the event is still checked against what was folded after the stale cursor
+    validate = submissions.still_valid_infection("stale", "a1", pd.Timestamp("2025-09-01 00:00:00"))
+    with pytest.raises(event_log.EventRejected):
+        log.append(infection("stale", "a1"), cursor=0, validate=validate)
+    assert audiences(log).count("a1") == 1
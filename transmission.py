@@ -0,0 +1,214 @@
+#mcandrew
+
+"""Transmission tree of the game: who infected whom, kept in step with the log.
+
+Every user's first successful infection links them to their infector. The index
+keeps, per user ID (usernames.py): the parent, the infection time, the
+generation depth (index cases are depth 0), the number of descendants, and the
+list of children. New events are applied after a cursor, like the other indexes.
+
+Queries cost time in proportion to their answer, not to the size of the log:
+
+    index.ancestry(user)              who infected me, back to an index case (patient zero)
+    index.descendants_within(user, k) everyone my infections led to within k generations
+    index.subtree_size(user)          how many infections I led to in total
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import event_log
+import usernames
+
+NOT_INFECTED = np.iinfo(np.int64).max   #<--infection time of users who were never infected
+NO_PARENT    = -1
+
+
+def new_infections(events, infection_time):
+    """Infectee, infector and time (user IDs, ns since the epoch) of the first infection of each user not yet infected.
+
+    A user is infected once: the first successful infection in the log counts, later ones are ignored. Rows are in
+    log order, so parents come before children. infection_time is the caller's array by user ID; the infector is
+    MISSING when the log has no name for it.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    hits  = events.loc[(events.infection_intervention.values == 1) & (events.success.values == 1)]
+    if hits.empty:
+        return empty, empty, empty
+    infectees = usernames.encode(hits.Audience).astype(np.int64)
+    infectors = usernames.encode(hits.Actor).astype(np.int64)
+
+    timestamps = hits.timestamp
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, format=event_log.TIMESTAMP_FORMAT)
+    times = timestamps.values.astype("datetime64[ns]").astype(np.int64)
+
+    _, first = np.unique(infectees, return_index=True)
+    ids      = infectees[first]
+    new      = ids != usernames.MISSING
+    known    = new & (ids < len(infection_time))   #<--IDs past the end of infection_time were never infected
+    new[known] = infection_time[ids[known]] == NOT_INFECTED
+    first    = np.sort(first[new])
+    return infectees[first], infectors[first], times[first]
+
+
+class TransmissionIndex(event_log.IncrementalIndex):
+    """Parent pointers, children lists, depth and subtree sizes of the infection tree.
+
+    Indexes built on the tree register in listeners: after each batch they get the events and the per-user
+    changes (see _apply), and they are reset with the tree.
+    """
+
+    NAME = "transmission"
+
+    def __init__(self):
+        self.listeners = []
+        super().__init__()
+
+    def _reset(self):
+        self.parent         = np.full(0, NO_PARENT, dtype=np.int64)         #<--by user ID
+        self.infection_time = np.full(0, NOT_INFECTED, dtype=np.int64)      #<--ns since the epoch, first infection only
+        self.depth          = np.zeros(0, dtype=np.int32)
+        self.descendants    = np.zeros(0, dtype=np.int64)                   #<--size of the subtree below the user
+        self.children       = {}                                            #<--infector ID -> infectee IDs, in log order
+        for listener in self.listeners:
+            listener.reset()
+
+    def listen(self, listener):
+        """Register listener (reset() and update(events, linked, credited, added)); it sees the whole log on the next sync"""
+        with self.lock:
+            self.listeners.append(listener)
+            self._clear()   #<--the tree is rebuilt once, so the listener is fed every event
+
+    def _grow(self, n):
+        """Make room for user IDs below n"""
+        if n > len(self.parent):
+            extra = max(n, 2*len(self.parent)) - len(self.parent)
+            self.parent         = np.concatenate([self.parent, np.full(extra, NO_PARENT, dtype=np.int64)])
+            self.infection_time = np.concatenate([self.infection_time, np.full(extra, NOT_INFECTED, dtype=np.int64)])
+            self.depth          = np.concatenate([self.depth, np.zeros(extra, dtype=np.int32)])
+            self.descendants    = np.concatenate([self.descendants, np.zeros(extra, dtype=np.int64)])
+
+    def _is_ancestor(self, user, node):
+        """True if user is node or one of its ancestors"""
+        while node != NO_PARENT:
+            if node == user:
+                return True
+            node = self.parent[node]
+        return False
+
+    def _shift_depth(self, user, offset):
+        """Add offset to the depth of everyone below user"""
+        queue = deque(self.children.get(user, ()))
+        while queue:
+            node = queue.popleft()
+            self.depth[node] += offset
+            queue.extend(self.children.get(node, ()))
+
+    def _apply(self, events):
+        """Link every newly infected user to their infector.
+
+        Returns the infectors linked (one entry per new link), and the users whose number of descendants grew
+        with how much it grew (one entry per user), for indexes built on top of this one.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if events.empty:
+            return empty, empty, empty
+        infectees, infectors, times = new_infections(events, self.infection_time)
+        self._grow(len(usernames.get_dictionary()))
+
+        linked, sizes = [], []
+        for child, infector, time in zip(infectees.tolist(), infectors.tolist(), times.tolist()):
+            self.infection_time[child] = time
+            #--an index case can be infected later by someone in its own subtree; that would close a cycle
+            if infector == usernames.MISSING or (child in self.children and self._is_ancestor(child, infector)):
+                continue
+            depth = self.depth[infector] + 1
+            if child in self.children:   #<--an index case that already infected others: its subtree moves down with it
+                self._shift_depth(child, depth - self.depth[child])
+            self.parent[child] = infector
+            self.depth[child]  = depth
+            self.children.setdefault(infector, []).append(child)
+            linked.append(infector)
+            sizes.append(1 + self.descendants[child])
+
+        #--every new link adds the child and its subtree to the descendants of each of its ancestors
+        nodes, weights = [empty], [empty]
+        ancestors, weight = np.array(linked, dtype=np.int64), np.array(sizes, dtype=np.int64)
+        while len(ancestors):
+            nodes.append(ancestors)
+            weights.append(weight)
+            ancestors = self.parent[ancestors]
+            weight    = weight[ancestors != NO_PARENT]
+            ancestors = ancestors[ancestors != NO_PARENT]
+        credited, inverse = np.unique(np.concatenate(nodes), return_inverse=True)
+        added = np.bincount(inverse, weights=np.concatenate(weights), minlength=len(credited)).astype(np.int64)
+        self.descendants[credited] += added
+
+        linked = np.array(linked, dtype=np.int64)
+        for listener in self.listeners:
+            listener.update(events, linked, credited, added)
+        return linked, credited, added
+
+    #--Queries (user IDs)-------------------------------------------------------------------------------------------------
+    def _known(self, user):
+        return 0 <= user < len(self.parent)
+
+    def is_infected(self, user):
+        return self._known(user) and self.infection_time[user] != NOT_INFECTED
+
+    def in_tree(self, user):
+        """True if the user was infected or infected someone"""
+        return self.is_infected(user) or user in self.children
+
+    def infected_at(self, user):
+        """Time the user was infected (None if never)"""
+        return pd.Timestamp(self.infection_time[user]) if self.is_infected(user) else None
+
+    def first_infection_by(self, user):
+        """Time of the first infection the user caused (None if none)"""
+        children = self.children.get(user)
+        return pd.Timestamp(self.infection_time[children].min()) if children else None
+
+    def direct_infections(self, user):
+        return len(self.children.get(user, ()))
+
+    def subtree_size(self, user):
+        """Number of infections the user led to, directly or not"""
+        return int(self.descendants[user]) if self._known(user) else 0
+
+    def ancestry(self, user):
+        """Infector, their infector, ... up to an index case (empty for index cases and unknown users)"""
+        chain = []
+        with self.lock:
+            node = self.parent[user] if self._known(user) else NO_PARENT
+            while node != NO_PARENT:
+                chain.append(int(node))
+                node = self.parent[node]
+        return chain
+
+    def descendants_within(self, user, depth=2, limit=None):
+        """(ID, generation below user) of everyone within depth generations, breadth first, at most limit of them"""
+        found = []
+        with self.lock:
+            queue = deque([(user, 0)])
+            while queue and (limit is None or len(found) < limit):
+                node, level = queue.popleft()
+                if level == depth:
+                    continue
+                for child in self.children.get(node, ()):
+                    found.append((child, level + 1))
+                    queue.append((child, level + 1))
+                    if limit is not None and len(found) >= limit:
+                        break
+        return found
+
+
+_index = TransmissionIndex()
+
+
+def get_transmission(interactions):
+    """Process-wide transmission index synced with the given (latest) dataset"""
+    return _index.sync(interactions)
@@ -0,0 +1,141 @@
+#mcandrew
+
+"""Process-wide username dictionary: each name is stored once and gets a dense int32 ID.
+
+The Actor and Audience columns of every interaction table in the process are
+categoricals over this dictionary. Their codes are therefore the user IDs, and
+the codes agree across tables: the cached dataset, new segments and snapshots
+that are read back. The contact graph, the validation index and the analytics
+key everything by these IDs. Names are decoded only where they are shown.
+
+IDs are never reused or renumbered while the process runs, so an index keyed by
+ID stays valid when the log is rebuilt from a new snapshot.
+
+    ids   = usernames.encode(events.Actor)      #<--int32 array, -1 for missing names
+    names = usernames.decode(ids)
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1   #<--ID of a missing name (categorical code of NaN)
+
+
+class UsernameDictionary:
+    """Append-only name <-> int32 ID mapping"""
+
+    def __init__(self, capacity=1024):
+        self.lock   = threading.Lock()
+        self.ids    = {}                                   #<--name -> ID
+        self._keys  = []                                   #<--ID -> the one int object used as its dict/graph key
+        self._names = np.empty(capacity, dtype=object)     #<--ID -> name (first `size` entries are used)
+        self.size   = 0
+        self._dtype = pd.CategoricalDtype(pd.Index([], dtype=object))
+
+    def __len__(self):
+        return self.size
+
+    def intern(self, names):
+        """IDs of the names, adding the ones not seen before"""
+        with self.lock:
+            ids = np.empty(len(names), dtype=np.int32)
+            for i, name in enumerate(names):
+                id_ = self.ids.get(name)
+                if id_ is None:
+                    if self.size == len(self._names):
+                        self._names = np.concatenate([self._names, np.empty(len(self._names), dtype=object)])
+                    id_ = self.ids[name] = self.size
+                    self._names[id_] = name
+                    self._keys.append(id_)
+                    self.size += 1
+                ids[i] = id_
+            return ids
+
+    def lookup(self, name):
+        """ID of a name, MISSING if it was never seen (does not add it)"""
+        return self.ids.get(name, MISSING)
+
+    def decode(self, ids):
+        """Names of an array of IDs (None for MISSING)"""
+        ids   = np.asarray(ids, dtype=np.int64)
+        names = self._names[np.where(ids == MISSING, 0, ids)] if self.size else np.full(len(ids), None, dtype=object)
+        if (ids == MISSING).any():
+            names = np.where(ids == MISSING, None, names)
+        return names
+
+    def keys(self, ids):
+        """IDs as Python ints shared by every index, so a user costs one int object however often it is a key"""
+        keys = self._keys
+        return [keys[id_] for id_ in np.asarray(ids).tolist()]
+
+    def name(self, id_):
+        return None if id_ == MISSING else self._names[id_]
+
+    @property
+    def dtype(self):
+        """Categorical dtype whose categories are every name, in ID order (rebuilt only after new names)"""
+        with self.lock:
+            if len(self._dtype.categories) != self.size:
+                self._dtype = pd.CategoricalDtype(pd.Index(self._names[:self.size], dtype=object))
+            return self._dtype
+
+    def _is_prefix(self, categories):
+        """True if the categories are the first names of the dictionary, in order (their codes are IDs)"""
+        if categories is self._dtype.categories:
+            return True
+        n = len(categories)
+        return n <= self.size and categories.dtype == object and bool((categories.values == self._names[:n]).all())
+
+    def encode(self, values):
+        """int32 IDs of a column of names (categorical or not), interning new names"""
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = pd.Series(values)
+            values = values.where(values.isna(), values.astype(str)).astype("category")
+        codes      = values.cat.codes.values
+        categories = values.cat.categories
+        if self._is_prefix(categories):
+            return codes.astype(np.int32)
+
+        #--foreign categories (CSV, Parquet, another generator): look up only the ones that occur
+        lookup = np.full(len(categories) + 1, MISSING, dtype=np.int32)   #<--the extra slot maps code -1
+        used   = np.unique(codes[codes >= 0])
+        lookup[used] = self.intern(np.asarray(categories, dtype=object)[used])
+        return lookup[codes]
+
+    def categorical(self, ids):
+        """Categorical over the dictionary with the given IDs as codes"""
+        return pd.Categorical.from_codes(ids, dtype=self.dtype, validate=False)
+
+    def _current(self, values, dtype):
+        return isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories is dtype.categories
+
+    def to_categoricals(self, columns):
+        """Columns of names as categoricals over one dtype of the dictionary (columns already on it are returned as is)"""
+        #--every column is interned before the dtype is taken, so a name new to one column is in the other's dtype too
+        ids   = [None if self._current(values, self._dtype) else self.encode(values) for values in columns]
+        dtype = self.dtype
+        return [values if codes is None and self._current(values, dtype)
+                else pd.Series(pd.Categorical.from_codes(self.encode(values) if codes is None else codes, dtype=dtype, validate=False)
+                               , index=values.index, name=values.name)
+                for values, codes in zip(columns, ids)]
+
+
+_dictionary = UsernameDictionary()
+
+
+def get_dictionary():
+    return _dictionary
+
+
+def encode(values):
+    return _dictionary.encode(values)
+
+
+def decode(ids):
+    return _dictionary.decode(ids)
+
+
+def lookup(name):
+    return _dictionary.lookup(name)